@@ -1,40 +1,70 @@
-from flask import Flask, request, jsonify, send_file, render_template_string
+from flask import Flask, Response, abort, g, has_app_context, request, jsonify, send_file, render_template, stream_with_context
 from flask_cors import CORS
 import os
 import traceback
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from fpdf import FPDF
-from datetime import datetime, timedelta
-import matplotlib
-from matplotlib.font_manager import fontManager
+from datetime import datetime, timedelta, timezone
 import numpy as np
-from matplotlib.patches import Rectangle
 import warnings
 import sqlite3
 import base64
-from io import BytesIO
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
+from io import BytesIO, StringIO, TextIOWrapper
+import gzip
+import zipfile
+import sys
+from itertools import islice
 import json
+import hashlib
+import csv
+import argparse
+import time
+import uuid
+import atexit
+import threading
+import queue
+from collections import OrderedDict
+from contextlib import contextmanager
+import multiprocessing
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 warnings.filterwarnings('ignore')
 
 # --- 字型設定 ---
+# matplotlib / fpdf / smtplib 等較重的模組延後到第一次使用時才載入，讓 API 與工作程序快速啟動
 FONT_PATH = os.path.join('fonts', 'NotoSansTC-Regular.ttf')
-if os.path.exists(FONT_PATH):
-    fontManager.addfont(FONT_PATH)
-    matplotlib.rcParams['font.family'] = 'Noto Sans TC'
-    matplotlib.rcParams['axes.unicode_minus'] = False
-else:
-    print(f"警告：找不到字型檔案 '{FONT_PATH}'。圖表中的中文可能無法正常顯示。")
-    matplotlib.rcParams['font.family'] = 'sans-serif'
-matplotlib.use('Agg')
-plt.style.use('seaborn-v0_8')
+Figure = None
+FigureCanvasAgg = None
+Rectangle = None
+_matplotlib_lock = threading.Lock()
+
+def _load_matplotlib():
+    """第一次繪圖時才載入 matplotlib 並註冊中文字型；全域 rcParams 只在這裡設定一次"""
+    global Figure, FigureCanvasAgg, Rectangle
+    with _matplotlib_lock:
+        if Figure is None:
+            import matplotlib
+            import matplotlib.style
+            from matplotlib.figure import Figure as _Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg as _FigureCanvasAgg
+            from matplotlib.font_manager import fontManager
+            from matplotlib.patches import Rectangle as _Rectangle
+            if os.path.exists(FONT_PATH):
+                fontManager.addfont(FONT_PATH)
+                matplotlib.rcParams['font.family'] = 'Noto Sans TC'
+                matplotlib.rcParams['axes.unicode_minus'] = False
+            else:
+                print(f"警告：找不到字型檔案 '{FONT_PATH}'。圖表中的中文可能無法正常顯示。")
+                matplotlib.rcParams['font.family'] = 'sans-serif'
+            matplotlib.style.use('seaborn-v0_8')
+            Figure, FigureCanvasAgg, Rectangle = _Figure, _FigureCanvasAgg, _Rectangle
+    return Figure
+
+def new_figure(figsize):
+    """建立不經過 pyplot 的 Figure：各自擁有 Agg 畫布、不登記在全域圖表管理器，多執行緒可同時繪製"""
+    _load_matplotlib()
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
 # --- 字型設定結束 ---
 
 
@@ -43,10 +73,242 @@ CORS(app)
 
 DATABASE_PATH = 'health_reports.db'
 
+# --- 效能指標 ---
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_HELP = {
+    'report_stage_seconds': ('histogram', '報告流程各階段耗時'),
+    'http_request_seconds': ('histogram', 'HTTP 請求處理時間'),
+    'http_requests_total': ('counter', 'HTTP 請求數'),
+    'reports_generated_total': ('counter', '已產生的報告數'),
+    'emails_sent_total': ('counter', '成功寄出的郵件數'),
+    'email_failures_total': ('counter', '寄送失敗的郵件數 (permanent=true 表示不再重試)'),
+    'measurements_imported_total': ('counter', '批次匯入寫入的量測筆數'),
+    'dashboard_profile_renders_total': ('counter', '第一次被請求時才渲染的儀表板輸出規格數'),
+    'page_cache_requests_total': ('counter', '報告頁/歷史列表快照的請求數 (result=hit|miss)'),
+    'db_connections_opened_total': ('counter', '新建立的資料庫連線數 (pool=request|thread)'),
+}
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1'
+PROFILE_DIR = os.path.join('output', 'profiles')
+
+class Metrics:
+    """程序內的計數器與延遲直方圖，以 Prometheus 文字格式輸出"""
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _record(self, kind, name, value, labels):
+        events = getattr(self._local, 'events', None)
+        if events is not None:
+            events.append((kind, name, value, labels)); return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if kind == 'inc':
+                self._counters[key] = self._counters.get(key, 0) + value
+                return
+            hist = self._histograms.get(key)
+            if hist is None: hist = self._histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: hist[i] += 1
+            hist[-2] += value; hist[-1] += 1
+
+    def inc(self, name, value=1, **labels):
+        self._record('inc', name, value, labels)
+
+    def observe(self, name, value, **labels):
+        self._record('observe', name, value, labels)
+
+    @contextmanager
+    def capture(self):
+        """暫存本執行緒的指標事件而不直接記錄；工作程序用它把指標帶回主程序再 replay"""
+        previous = getattr(self._local, 'events', None)
+        self._local.events = events = []
+        try:
+            yield events
+        finally:
+            self._local.events = previous
+
+    def replay(self, events):
+        for kind, name, value, labels in events or ():
+            self._record(kind, name, value, labels)
+
+    def render(self):
+        def fmt(labels, **extra):
+            items = list(labels) + list(extra.items())
+            if not items: return ''
+            escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in items) + '}'
+        with self._lock:
+            counters, histograms = dict(self._counters), {k: list(v) for k, v in self._histograms.items()}
+        lines = []
+        for name in sorted({n for n, _ in counters} | {n for n, _ in histograms}):
+            kind, help_text = METRIC_HELP.get(name, ('counter' if any(n == name for n, _ in counters) else 'histogram', name))
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for (n, labels), value in sorted(counters.items()):
+                if n == name: lines.append(f'{name}{fmt(labels)} {value}')
+            for (n, labels), hist in sorted(histograms.items()):
+                if n != name: continue
+                for bound, count in zip(self.buckets, hist):
+                    lines.append(f'{name}_bucket{fmt(labels, le=bound)} {count}')
+                lines += [f'{name}_bucket{fmt(labels, le="+Inf")} {hist[-1]}', f'{name}_sum{fmt(labels)} {hist[-2]:.6f}', f'{name}_count{fmt(labels)} {hist[-1]}']
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+@contextmanager
+def timed(stage):
+    """量測報告流程的一個階段，記錄到 report_stage_seconds{stage=...}"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe('report_stage_seconds', time.perf_counter() - started, stage=stage)
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+    if PROFILING_ENABLED and request.args.get('profile') == '1':
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable(); g.profiler = profiler
+        except ValueError:
+            pass  # 其他請求正在剖析
+
+@app.after_request
+def _record_request_metrics(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        # .prof 可直接用 snakeviz、flameprof 或 gprof2dot 轉成火焰圖/呼叫圖
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f'{datetime.now().strftime("%Y%m%d%H%M%S")}_{request.endpoint}_{uuid.uuid4().hex[:8]}.prof')
+        profiler.dump_stats(path)
+        response.headers['X-Profile-Path'] = path
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unknown'
+        metrics.observe('http_request_seconds', time.perf_counter() - started, endpoint=endpoint, method=request.method)
+        metrics.inc('http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+    return response
+
 # --- 資料庫和核心功能 (保持不變) ---
-def init_database():
+DB_CACHED_STATEMENTS = 256
+DB_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',       # 寫入不再阻擋讀取
+    'PRAGMA synchronous=NORMAL',     # WAL 下仍可保證一致性，減少 fsync
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-32000',      # 約 32MB 頁面快取
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA busy_timeout=30000',
+)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 16))  # 同時借出的請求連線上限
+DB_POOL_TIMEOUT = 30
+_db_local = threading.local()
+_db_pools = {}
+_pool_lock = threading.Lock()
+_schema_ready = set()
+_schema_lock = threading.Lock()
+
+def _connect(path, pool):
+    """建立連線並執行一次連線層級的 PRAGMA"""
+    conn = sqlite3.connect(path, timeout=30, cached_statements=DB_CACHED_STATEMENTS, check_same_thread=False)
+    for pragma in DB_PRAGMAS: conn.execute(pragma)
+    metrics.inc('db_connections_opened_total', pool=pool)
+    return conn
+
+class ConnectionPool:
+    """有上限的連線池：請求第一次存取資料庫時借出，請求結束 (teardown_appcontext) 時歸還，閒置連線留待下一個請求使用"""
+    def __init__(self, path, size=DB_POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def acquire(self, timeout=DB_POOL_TIMEOUT):
+        if not self._slots.acquire(timeout=timeout): raise sqlite3.OperationalError('資料庫連線池已滿')
+        try: return self._idle.get_nowait()
+        except queue.Empty: pass
+        try: return _connect(self.path, 'request')
+        except BaseException:
+            self._slots.release(); raise
+
+    def release(self, conn):
+        try:
+            if conn.in_transaction: conn.rollback()
+            self._idle.put(conn)
+        except sqlite3.Error:
+            conn.close()
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try: self._idle.get_nowait().close()
+            except queue.Empty: return
+
+def _pool_for(key):
+    pool = _db_pools.get(key)
+    if pool is None:
+        with _pool_lock:
+            pool = _db_pools.setdefault(key, ConnectionPool(key[1]))
+    return pool
+
+@app.teardown_appcontext
+def release_db(exc=None):
+    held = g.pop('db', None)
+    if held is not None: held[1].release(held[2])
+
+def get_db():
+    """取得資料庫連線 (重複使用並快取預編譯陳述式)：請求中向連線池借用，請求結束時歸還；
+    背景執行緒、CLI 與工作程序沒有請求範圍，改用執行緒專用的長效連線"""
+    key = (os.getpid(), DATABASE_PATH)
+    if has_app_context():
+        held = g.get('db')
+        if held is None or held[0] != key:
+            if held is not None: release_db()
+            pool = _pool_for(key)
+            held = g.db = (key, pool, pool.acquire())
+        conn = held[2]
+    else:
+        conn = getattr(_db_local, 'conn', None)
+        if conn is None or _db_local.key != key:
+            if conn is not None: conn.close()
+            conn = _connect(DATABASE_PATH, 'thread')
+            _db_local.conn, _db_local.key = conn, key
+    if key not in _schema_ready:
+        with _schema_lock:
+            if key not in _schema_ready:
+                init_database(conn)
+                _schema_ready.add(key)
+    return conn
+
+def _add_report_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_reports_patient_created ON health_reports (patient_id, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_members_coach ON members (coach_id)')
+
+# 依序執行一次，已執行到的版本記錄在 PRAGMA user_version
+SCHEMA_MIGRATIONS = [
+    lambda conn: backfill_measurements(conn),
+    _add_report_indexes,
+    lambda conn: rebuild_member_summary(conn),
+    lambda conn: _add_report_metric_columns(conn),
+    lambda conn: _add_artifact_ref_indexes(conn),
+    lambda conn: rebuild_member_summary(conn),  # 彙總改為各項量測分別取最新值，匯入不再計入 report_count
+    lambda conn: conn.execute("DELETE FROM render_cache_counters WHERE name = 'compaction_lease'"),  # 租約移到 artifact_leases
+]
+
+def migrate_database(conn):
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    for number, migration in enumerate(SCHEMA_MIGRATIONS[version:], start=version+1):
+        migration(conn)
+        conn.execute(f'PRAGMA user_version = {number}')
+        conn.commit()
+
+def init_database(conn=None):
     """初始化資料庫"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = conn or get_db()
     cursor = conn.cursor()
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS health_reports (
@@ -68,54 +330,321 @@ def init_database():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (coach_id) REFERENCES coaches (id)
         )''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS render_cache (
+            cache_key TEXT PRIMARY KEY, dashboard_path TEXT NOT NULL, pdf_path TEXT NOT NULL,
+            hits INTEGER DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS render_cache_counters (
+            name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0
+        )''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS artifact_leases (
+            name TEXT PRIMARY KEY, owner TEXT, expires_at INTEGER NOT NULL DEFAULT 0
+        )''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS measurements (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, patient_id TEXT NOT NULL,
+            measured_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, report_id INTEGER UNIQUE,
+            heart_rate REAL, weight REAL, height REAL, bmi REAL, systolic INTEGER, diastolic INTEGER,
+            exercise_duration REAL,
+            FOREIGN KEY (report_id) REFERENCES health_reports (id)
+        )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_measurements_patient_time ON measurements (patient_id, measured_at)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, report_id INTEGER, patient_id TEXT,
+            report_type TEXT NOT NULL, recipient_email TEXT NOT NULL, sender_email TEXT NOT NULL,
+            pdf_path TEXT, status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT, claim_token TEXT, claimed_at TIMESTAMP,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, sent_at TIMESTAMP,
+            FOREIGN KEY (report_id) REFERENCES health_reports (id)
+        )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_due ON email_outbox (status, next_attempt_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_report ON email_outbox (report_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_outbox_claim ON email_outbox (claim_token)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS artifacts (
+            name TEXT PRIMARY KEY, data BLOB NOT NULL, size INTEGER NOT NULL, sha256 TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_artifacts_created ON artifacts (created_at)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS artifact_objects (
+            key TEXT PRIMARY KEY, size INTEGER NOT NULL, stored_size INTEGER NOT NULL, pack TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, last_used_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_artifact_objects_pack ON artifact_objects (pack)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS member_summary (
+            patient_id TEXT PRIMARY KEY, report_id INTEGER, measured_at TIMESTAMP NOT NULL,
+            heart_rate REAL, bmi REAL, systolic INTEGER, diastolic INTEGER, exercise_duration REAL,
+            heart_rate_score REAL, bmi_score REAL, exercise_score REAL, blood_pressure_score REAL, overall_score REAL,
+            report_count INTEGER NOT NULL DEFAULT 1, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS report_snapshots (
+            report_id INTEGER PRIMARY KEY, version INTEGER NOT NULL, etag TEXT NOT NULL, html TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (report_id) REFERENCES health_reports (id)
+        )''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS report_list_versions (
+            patient_id TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0
+        )''')
     conn.commit()
-    conn.close()
+    migrate_database(conn)
 
 def save_report_to_db(patient_id, report_data, pdf_path, dashboard_path, table_path, coach_email=None, patient_email=None):
     """儲存報告到資料庫"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
-        'INSERT INTO health_reports (patient_id, report_data, pdf_path, dashboard_path, table_path, coach_email, patient_email) VALUES (?, ?, ?, ?, ?, ?, ?)',
-        (patient_id, json.dumps(report_data), pdf_path, dashboard_path, table_path, coach_email, patient_email))
-    report_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    conn = get_db()
+    with timed('db_save'), conn:
+        cursor = conn.execute(
+            'INSERT INTO health_reports (patient_id, report_data, pdf_path, dashboard_path, table_path, coach_email, patient_email) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (patient_id, json.dumps(report_data), pdf_path, dashboard_path, table_path, coach_email, patient_email))
+        report_id = cursor.lastrowid
+        _insert_measurement(conn, report_id, patient_id, report_data)
+        update_member_summary(conn, [(patient_id, report_id, report_data)])
+        bump_history_versions(conn, [patient_id])
     return report_id
 
+REPORT_PAGE_SIZE = 20
+REPORT_PAGE_MAX = 100
+
+def encode_report_cursor(created_at, report_id):
+    return base64.urlsafe_b64encode(f'{created_at}|{report_id}'.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_report_cursor(cursor):
+    """解析分頁游標，格式錯誤時拋出 ValueError"""
+    try:
+        created_at, report_id = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8').rsplit('|', 1)
+        return created_at, int(report_id)
+    except (UnicodeDecodeError, TypeError, base64.binascii.Error) as e:
+        raise ValueError(f'無效的分頁游標: {cursor}') from e
+
+def get_reports_page(patient_id, cursor=None, limit=REPORT_PAGE_SIZE):
+    """以 (created_at, id) 游標分頁列出報告，只取列表需要的欄位；回傳 (報告清單, 下一頁游標)"""
+    limit = max(1, min(int(limit), REPORT_PAGE_MAX))
+    if cursor:
+        created_at, report_id = decode_report_cursor(cursor)
+        rows = get_db().execute(
+            'SELECT id, created_at, dashboard_path IS NOT NULL FROM health_reports WHERE patient_id = ? AND (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT ?',
+            (patient_id, created_at, report_id, limit + 1)).fetchall()
+    else:
+        rows = get_db().execute('SELECT id, created_at, dashboard_path IS NOT NULL FROM health_reports WHERE patient_id = ? ORDER BY created_at DESC, id DESC LIMIT ?', (patient_id, limit + 1)).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    reports = [{'id':r[0], 'created_at':r[1], 'display_date':format_dt(r[1], '%Y-%m-%d %H:%M'),
+                'view_url':f'/view_report/{r[0]}', 'download_url':f'/download_report/{r[0]}',
+                'thumbnail_url':f'/dashboard_image/{r[0]}?variant=thumbnail' if r[2] else None} for r in rows]
+    return reports, (encode_report_cursor(rows[-1][1], rows[-1][0]) if has_more else None)
+
+def bump_history_versions(conn, patient_ids):
+    """會員的歷史列表有變動時遞增版本號 (呼叫端負責交易)，讓各程序的列表快取失效"""
+    conn.executemany('''INSERT INTO report_list_versions (patient_id, version) VALUES (?, 1)
+        ON CONFLICT (patient_id) DO UPDATE SET version = version + 1''', [(p,) for p in set(patient_ids)])
+
+def get_history_version(patient_id):
+    row = get_db().execute('SELECT version FROM report_list_versions WHERE patient_id = ?', (patient_id,)).fetchone()
+    return row[0] if row else 0
+
+def count_reports(patient_id):
+    return get_db().execute('SELECT COUNT(*) FROM health_reports WHERE patient_id = ?', (patient_id,)).fetchone()[0]
+
+def format_dt(ts_str, fmt):
+    try:
+        return datetime.fromisoformat(ts_str.split('.')[0]).strftime(fmt)
+    except:
+        return ts_str
+
+# --- 報告指標查詢 ---
+# health_reports 上以 JSON1 產生的虛擬欄位 (寫入時不需額外處理)，各自建立索引，門檻查詢走索引範圍掃描而不解析 report_data
+def _json_number(key):
+    return f"CASE WHEN json_valid(report_data) THEN json_extract(report_data, '$.{key}') END"
+
+_JSON_BP = "CASE WHEN json_valid(report_data) THEN json_extract(report_data, '$.blood_pressure') END"
+REPORT_METRIC_COLUMNS = {
+    'heart_rate': _json_number('heart_rate'),
+    'bmi': _json_number('bmi'),
+    'systolic': f"CASE WHEN {_JSON_BP} GLOB '[0-9]*/[0-9]*' THEN CAST(substr({_JSON_BP}, 1, instr({_JSON_BP}, '/') - 1) AS INTEGER) END",
+    'diastolic': f"CASE WHEN {_JSON_BP} GLOB '[0-9]*/[0-9]*' THEN CAST(substr({_JSON_BP}, instr({_JSON_BP}, '/') + 1) AS INTEGER) END",
+    'exercise_duration': _json_number('exercise_duration'),
+}
+REPORT_SEARCH_SORTS = ('created_at',) + tuple(REPORT_METRIC_COLUMNS)
+
+def _add_report_metric_columns(conn):
+    existing = {row[1] for row in conn.execute('PRAGMA table_xinfo(health_reports)')}
+    for name, expr in REPORT_METRIC_COLUMNS.items():
+        if name not in existing:
+            conn.execute(f'ALTER TABLE health_reports ADD COLUMN {name} {"INTEGER" if name in ("systolic", "diastolic") else "REAL"} GENERATED ALWAYS AS ({expr}) VIRTUAL')
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_reports_{name} ON health_reports ({name}, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_reports_created ON health_reports (created_at)')
+    conn.execute('ANALYZE health_reports')
+
+def encode_search_cursor(value, report_id):
+    return base64.urlsafe_b64encode(json.dumps([value, report_id]).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_search_cursor(cursor):
+    try:
+        value, report_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return value, int(report_id)
+    except (ValueError, TypeError, base64.binascii.Error) as e:
+        raise ValueError(f'無效的分頁游標: {cursor}') from e
+
+def search_reports(filters, sort='-created_at', cursor=None, limit=REPORT_PAGE_SIZE):
+    """依指標範圍查詢報告。filters 鍵為 <指標>_min/<指標>_max 與 created_from/created_to (皆為 [min, max) 半開區間)、patient_id、coach_id，
+    以及 blood_pressure_min ("140/90"：收縮壓或舒張壓任一達標)；sort 為欄位名，前綴 '-' 表示遞減。回傳 (報告清單, 下一頁游標)"""
+    descending, column = sort.startswith('-'), sort.lstrip('-')
+    if column not in REPORT_SEARCH_SORTS: raise ValueError(f'不支援的排序欄位: {sort}')
+    limit = max(1, min(int(limit), REPORT_PAGE_MAX))
+    clauses, params = [], []
+    for name in REPORT_METRIC_COLUMNS:
+        for suffix, op in (('_min', '>='), ('_max', '<')):
+            if filters.get(name + suffix) not in (None, ''):
+                clauses.append(f'{name} {op} ?'); params.append(float(filters[name + suffix]))
+    if filters.get('blood_pressure_min'):
+        systolic, diastolic = parse_blood_pressure(filters['blood_pressure_min'])
+        if systolic is None: raise ValueError(f"血壓格式錯誤: {filters['blood_pressure_min']}")
+        clauses.append('(systolic >= ? OR diastolic >= ?)'); params += [systolic, diastolic]
+    for key, op in (('created_from', '>='), ('created_to', '<')):
+        if filters.get(key):
+            datetime.fromisoformat(filters[key])
+            clauses.append(f'created_at {op} ?'); params.append(filters[key])
+    if filters.get('patient_id'):
+        clauses.append('patient_id = ?'); params.append(filters['patient_id'])
+    if filters.get('coach_id') not in (None, ''):
+        clauses.append('patient_id IN (SELECT patient_id FROM members WHERE coach_id = ?)'); params.append(int(filters['coach_id']))
+    if column != 'created_at': clauses.append(f'{column} IS NOT NULL')
+    if cursor:
+        value, report_id = decode_search_cursor(cursor)
+        clauses.append(f"({column}, id) {'<' if descending else '>'} (?, ?)"); params += [value, report_id]
+    order = 'DESC' if descending else 'ASC'
+    fields = ['id', 'patient_id', 'created_at'] + list(REPORT_METRIC_COLUMNS)
+    rows = get_db().execute(f'''SELECT {', '.join(fields)} FROM health_reports {'WHERE ' + ' AND '.join(clauses) if clauses else ''}
+        ORDER BY {column} {order}, id {order} LIMIT ?''', params + [limit + 1]).fetchall()
+    has_more = len(rows) > limit
+    reports = [dict(zip(fields, r), view_url=f'/view_report/{r[0]}', download_url=f'/download_report/{r[0]}') for r in rows[:limit]]
+    return reports, (encode_search_cursor(reports[-1][column], reports[-1]['id']) if has_more else None)
+
 def get_reports_by_patient(patient_id):
     """根據患者ID獲取報告"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM health_reports WHERE patient_id = ? ORDER BY created_at DESC', (patient_id,))
-    reports = cursor.fetchall()
-    conn.close()
-    return reports
+    return get_db().execute('SELECT * FROM health_reports WHERE patient_id = ? ORDER BY created_at DESC', (patient_id,)).fetchall()
+
+# --- 量測時間序列 ---
+TREND_DAYS = 30
+TREND_BUCKETS = {
+    'day': "date(measured_at)",
+    'week': "date(measured_at, '-6 days', 'weekday 1')",
+    'month': "strftime('%Y-%m-01', measured_at)",
+}
+TREND_MAX_POINTS = 500
+
+def parse_blood_pressure(value):
+    """將 "收縮壓/舒張壓" 字串解析成 (sys, dia)，格式錯誤時回傳 (None, None)"""
+    try:
+        sys, dia = map(int, str(value).split('/'))
+        return sys, dia
+    except (ValueError, TypeError):
+        return None, None
+
+def _insert_measurement(conn, report_id, patient_id, report_data, measured_at=None):
+    """依報告內容寫入一筆量測紀錄 (與報告使用同一個交易)"""
+    sys, dia = parse_blood_pressure(report_data.get('blood_pressure'))
+    conn.execute(
+        'INSERT OR IGNORE INTO measurements (patient_id, measured_at, report_id, heart_rate, weight, height, bmi, systolic, diastolic, exercise_duration) VALUES (?, COALESCE(?, CURRENT_TIMESTAMP), ?, ?, ?, ?, ?, ?, ?, ?)',
+        (patient_id, measured_at, report_id, report_data.get('heart_rate'), report_data.get('weight'), report_data.get('height'), report_data.get('bmi'), sys, dia, report_data.get('exercise_duration')))
+
+def backfill_measurements(conn, chunk_size=1000):
+    """將尚未轉入 measurements 的 health_reports.report_data 補寫進來，回傳補寫筆數"""
+    last_id, total = 0, 0
+    while True:
+        rows = conn.execute(
+            'SELECT r.id, r.patient_id, r.report_data, r.created_at FROM health_reports r WHERE r.id > ? AND NOT EXISTS (SELECT 1 FROM measurements m WHERE m.report_id = r.id) ORDER BY r.id LIMIT ?',
+            (last_id, chunk_size)).fetchall()
+        if not rows: return total
+        with conn:
+            for report_id, patient_id, report_data, created_at in rows:
+                try: data = json.loads(report_data)
+                except (TypeError, ValueError): continue
+                if isinstance(data, dict): _insert_measurement(conn, report_id, patient_id, data, created_at); total += 1
+        last_id = rows[-1][0]
+
+def get_trend(patient_id, start=None, end=None, bucket='day'):
+    """以 (patient_id, measured_at) 索引做範圍查詢，並在資料庫端依日/週/月彙總；超過 TREND_MAX_POINTS 時保留最近的點"""
+    clauses, params = ['patient_id = ?'], [patient_id]
+    if start: clauses.append('measured_at >= ?'); params.append(start)
+    if end: clauses.append('measured_at < ?'); params.append(end)
+    where = ' AND '.join(clauses)
+    columns = ['heart_rate','weight','bmi','systolic','diastolic','exercise_duration']
+    conn = get_db()
+    if bucket == 'raw':
+        query = f'SELECT measured_at AS period, 1, {", ".join(columns)} FROM measurements WHERE {where} ORDER BY measured_at DESC LIMIT ?'
+    else:
+        period = TREND_BUCKETS[bucket]
+        query = f'SELECT {period} AS period, COUNT(*), {", ".join(f"AVG({m})" for m in columns)} FROM measurements WHERE {where} GROUP BY period ORDER BY period DESC LIMIT ?'
+    rows = conn.execute(f'SELECT * FROM ({query}) ORDER BY period', params + [TREND_MAX_POINTS]).fetchall()
+    return [dict(zip(['period_start','count']+columns, [r[0], r[1]] + [round(v,2) if v is not None else None for v in r[2:]])) for r in rows]
+
+def pick_trend_bucket(start, end):
+    """依查詢區間長度自動選擇彙總粒度"""
+    try: days = (datetime.fromisoformat(end) - datetime.fromisoformat(start)).days if start and end else None
+    except ValueError: days = None
+    if days is None or days > 2 * 365: return 'month'
+    if days > 120: return 'week'
+    return 'day'
+
+# --- 郵件寄送 ---
+SMTP_SERVER = os.environ.get('SMTP_SERVER', 'smtp.gmail.com')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', 587))
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1') not in ('0', 'false')
+SMTP_IDLE_SECONDS = 60          # 閒置超過此秒數的連線在重用前先 NOOP 檢查
+MAIL_BATCH_SIZE = 20
+MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS', 5))
+MAIL_RETRY_BASE_SECONDS = 30    # 第 n 次失敗後等待 30 * 2^(n-1) 秒
+MAIL_SENDER_THREADS = int(os.environ.get('MAIL_SENDER_THREADS', 2))
+
+def build_report_message(sender_email, recipient_email, patient_id, pdf_path, report_type="patient"):
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    from email.mime.base import MIMEBase
+    from email import encoders
+    msg = MIMEMultipart()
+    msg['From'] = sender_email
+    msg['To'] = recipient_email
+    if report_type == "coach":
+        msg['Subject'] = f"學員 {patient_id} 的健康數據報告"
+        body = f"親愛的教練：\n\n您好！這是學員 {patient_id} 的最新健康數據報告。\n\n請查看附件。\n\n健身數據分析系統"
+    else:
+        msg['Subject'] = f"您的個人健康數據報告 - {patient_id}"
+        body = f"親愛的會員：\n\n您好！這是您的最新健康數據分析報告。\n\n請查看附件。\n\n健身數據分析系統"
+    msg.attach(MIMEText(body, 'plain', 'utf-8'))
+    pdf_bytes = read_artifact(pdf_path) if pdf_path else None
+    if pdf_bytes:
+        part = MIMEBase('application', 'octet-stream')
+        part.set_payload(pdf_bytes)
+        encoders.encode_base64(part)
+        filename = f'health_report_{patient_id}.pdf' if is_cas_ref(pdf_path) else artifact_name(pdf_path)
+        part.add_header('Content-Disposition', f'attachment; filename="{filename}"')
+        msg.attach(part)
+    return msg
+
+def _open_smtp(sender_email, sender_password):
+    import smtplib
+    server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=30)
+    if SMTP_STARTTLS: server.starttls()
+    server.ehlo_or_helo_if_needed()
+    if server.has_extn('auth'): server.login(sender_email, sender_password)
+    return server
 
 def send_email_report(sender_email, sender_password, recipient_email, patient_id, pdf_path, report_type="patient"):
-    SMTP_SERVER = "smtp.gmail.com"
-    SMTP_PORT = 587
+    """立即寄送單封報告郵件 (不經過寄件匣)"""
+    import smtplib
     try:
-        msg = MIMEMultipart()
-        msg['From'] = sender_email
-        msg['To'] = recipient_email
-        if report_type == "coach":
-            msg['Subject'] = f"學員 {patient_id} 的健康數據報告"
-            body = f"親愛的教練：\n\n您好！這是學員 {patient_id} 的最新健康數據報告。\n\n請查看附件。\n\n健身數據分析系統"
-        else:
-            msg['Subject'] = f"您的個人健康數據報告 - {patient_id}"
-            body = f"親愛的會員：\n\n您好！這是您的最新健康數據分析報告。\n\n請查看附件。\n\n健身數據分析系統"
-        msg.attach(MIMEText(body, 'plain', 'utf-8'))
-        if os.path.exists(pdf_path):
-            with open(pdf_path, "rb") as attachment:
-                part = MIMEBase('application', 'octet-stream')
-                part.set_payload(attachment.read())
-                encoders.encode_base64(part)
-                part.add_header('Content-Disposition', f'attachment; filename="{os.path.basename(pdf_path)}"')
-                msg.attach(part)
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(sender_email, sender_password)
+        msg = build_report_message(sender_email, recipient_email, patient_id, pdf_path, report_type)
+        server = _open_smtp(sender_email, sender_password)
         server.sendmail(sender_email, recipient_email, msg.as_string())
         server.quit()
         return True, "郵件發送成功"
@@ -123,7 +652,386 @@ def send_email_report(sender_email, sender_password, recipient_email, patient_id
         if isinstance(e, smtplib.SMTPAuthenticationError): return False, "SMTP驗證錯誤，請檢查寄件Email和應用程式密碼。"
         return False, f"郵件發送失敗: {str(e)}"
 
+class SMTPConnectionPool:
+    """依寄件帳號保留已驗證的 SMTP 連線，供多封郵件重複使用"""
+    def __init__(self):
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, sender_email, sender_password):
+        while True:
+            with self._lock:
+                idle = self._idle.get(sender_email)
+                if not idle: break
+                server, last_used = idle.pop()
+            if time.time() - last_used < SMTP_IDLE_SECONDS: return server
+            # 連線檢查是網路 I/O，在鎖外進行，避免一台慢的伺服器卡住其他寄件執行緒
+            try:
+                if server.noop()[0] == 250: return server
+            except OSError: pass  # smtplib.SMTPException 也是 OSError
+            self._discard(server)
+        return _open_smtp(sender_email, sender_password)
+
+    def release(self, sender_email, server):
+        with self._lock:
+            self._idle.setdefault(sender_email, []).append((server, time.time()))
+
+    def _discard(self, server):
+        try: server.quit()
+        except OSError: pass
+
+    def discard(self, server):
+        self._discard(server)
+
+    def close_all(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for server, _ in idle: self._discard(server)
+            self._idle.clear()
+
+class MailSender:
+    """背景寄件：從 email_outbox 認領待寄郵件，沿用連線池寄出，失敗時以指數退避重試
+
+    寄件密碼只保存在記憶體中 (不寫入資料庫)，因此每個程序只認領自己持有憑證的寄件帳號。
+    """
+    def __init__(self, threads=MAIL_SENDER_THREADS):
+        self.threads = max(1, threads)
+        self.pool = SMTPConnectionPool()
+        self._credentials = {}
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._workers = []
+        self._lock = threading.Lock()
+        if os.environ.get('SMTP_USERNAME'):
+            self._credentials[os.environ['SMTP_USERNAME']] = os.environ.get('SMTP_PASSWORD', '')
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._workers: return
+            conn = get_db()
+            with conn:
+                # 上次程序中斷時停在 sending 的郵件重新排入
+                conn.execute("UPDATE email_outbox SET status = 'pending' WHERE status = 'sending' AND claimed_at < datetime('now', '-10 minutes')")
+            self._workers = [threading.Thread(target=self._run, name=f'mail-sender-{i}', daemon=True) for i in range(self.threads)]
+            for worker in self._workers: worker.start()
+
+    def enqueue(self, report_id, patient_id, pdf_path, sender_email, sender_password, recipients):
+        """將 (收件人類型, Email) 清單寫入寄件匣並喚醒寄件執行緒，回傳寄送紀錄"""
+        self._credentials[sender_email] = sender_password
+        conn = get_db()
+        results = []
+        with conn:
+            for report_type, recipient_email in recipients:
+                cursor = conn.execute(
+                    'INSERT INTO email_outbox (report_id, patient_id, report_type, recipient_email, sender_email, pdf_path) VALUES (?, ?, ?, ?, ?, ?)',
+                    (report_id, patient_id, report_type, recipient_email, sender_email, pdf_path))
+                results.append({"recipient":report_type, "status":"queued", "delivery_id":cursor.lastrowid, "message":"郵件已排入寄送佇列"})
+        self._ensure_started()
+        self._wakeup.set()
+        return results
+
+    def _claim(self):
+        senders = list(self._credentials)
+        if not senders: return []
+        token = uuid.uuid4().hex
+        conn = get_db()
+        with conn:
+            conn.execute(f'''UPDATE email_outbox SET status = 'sending', claim_token = ?, claimed_at = CURRENT_TIMESTAMP
+                WHERE id IN (SELECT id FROM email_outbox WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                             AND sender_email IN ({",".join("?"*len(senders))}) ORDER BY sender_email, id LIMIT ?)''',
+                (token, *senders, MAIL_BATCH_SIZE))
+        return conn.execute('SELECT id, patient_id, report_type, recipient_email, sender_email, pdf_path, attempts FROM email_outbox WHERE claim_token = ? ORDER BY sender_email, id', (token,)).fetchall()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                batch = self._claim()
+            except sqlite3.Error as e:
+                print(f"寄件匣讀取失敗: {e}"); batch = []
+            if not batch:
+                self._wakeup.wait(timeout=MAIL_RETRY_BASE_SECONDS)
+                self._wakeup.clear()
+                continue
+            self._send_batch(batch)
+
+    def _send_batch(self, batch):
+        import smtplib
+        server, current_sender = None, None
+        for delivery_id, patient_id, report_type, recipient_email, sender_email, pdf_path, attempts in batch:
+            try:
+                if server is not None and sender_email != current_sender:
+                    self.pool.release(current_sender, server); server = None
+                if server is None:
+                    with timed('smtp_connect'):
+                        server, current_sender = self.pool.acquire(sender_email, self._credentials[sender_email]), sender_email
+                msg = build_report_message(sender_email, recipient_email, patient_id, pdf_path, report_type)
+                with timed('smtp_send'):
+                    server.sendmail(sender_email, recipient_email, msg.as_string())
+                self._mark(delivery_id, 'sent', attempts + 1, None)
+                metrics.inc('emails_sent_total')
+            except Exception as e:
+                permanent = isinstance(e, (smtplib.SMTPAuthenticationError, smtplib.SMTPRecipientsRefused))
+                metrics.inc('email_failures_total', permanent=str(permanent or attempts + 1 >= MAIL_MAX_ATTEMPTS).lower())
+                message = "SMTP驗證錯誤，請檢查寄件Email和應用程式密碼。" if isinstance(e, smtplib.SMTPAuthenticationError) else f"郵件發送失敗: {e}"
+                self._mark(delivery_id, 'failed' if permanent or attempts + 1 >= MAIL_MAX_ATTEMPTS else 'pending', attempts + 1, message)
+                if server is not None and not isinstance(e, smtplib.SMTPRecipientsRefused):
+                    self.pool.discard(server); server = None
+        if server: self.pool.release(current_sender, server)
+
+    def _mark(self, delivery_id, status, attempts, error):
+        delay = MAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+        conn = get_db()
+        with conn:
+            conn.execute(f'''UPDATE email_outbox SET status = ?, attempts = ?, last_error = ?, claim_token = NULL,
+                sent_at = CASE WHEN ? = 'sent' THEN CURRENT_TIMESTAMP END,
+                next_attempt_at = datetime('now', '+{int(delay)} seconds') WHERE id = ?''', (status, attempts, error, status, delivery_id))
+
+    def drain(self, timeout=60):
+        """等待本程序可寄送的郵件全部處理完畢 (CLI 結束前使用)；等待重試中的郵件也算未完成，逾時回傳 False"""
+        deadline = time.time() + timeout
+        senders = list(self._credentials)
+        while senders and time.time() < deadline:
+            pending = get_db().execute(f"SELECT COUNT(*) FROM email_outbox WHERE status IN ('pending','sending') AND sender_email IN ({','.join('?'*len(senders))})", senders).fetchone()[0]
+            if not pending: return True
+            self._wakeup.set(); time.sleep(0.2)
+        return not senders
+
+    def shutdown(self):
+        self._stop.set(); self._wakeup.set()
+        for worker in self._workers: worker.join(timeout=5)
+        self.pool.close_all()
+
+def get_deliveries(report_id):
+    rows = get_db().execute('SELECT id, report_type, recipient_email, status, attempts, last_error, created_at, sent_at, next_attempt_at FROM email_outbox WHERE report_id = ? ORDER BY id', (report_id,)).fetchall()
+    return [dict(zip(['delivery_id','recipient','recipient_email','status','attempts','last_error','created_at','sent_at','next_attempt_at'], r)) for r in rows]
+
+mail_sender = MailSender()
+atexit.register(mail_sender.shutdown)
+
+# --- 健康評分引擎 ---
+# 以 NumPy 陣列一次計算整個族群的評分與建議代碼；儀表板、PDF 與 /api/cohort/scores 共用
+SCORE_LABELS = {'heart_rate':'心率', 'bmi':'BMI', 'exercise':'運動', 'blood_pressure':'血壓'}
+BP_VALID_RANGE = {'systolic':(40, 300), 'diastolic':(20, 200)}  # 超出範圍視為輸入錯誤
+RECOMMENDATION_TEXT = {
+    'HR_HIGH':'1. 您的靜息心率偏高...', 'HR_LOW':'1. 您的靜息心率偏低...', 'HR_OK':'1. 您的靜息心率在理想範圍', 'HR_MISSING':'1. 您的靜息心率未提供',
+    'BMI_UNDER':'2. 您的BMI過低...', 'BMI_NORMAL':'2. 您的BMI正常', 'BMI_OVER':'2. 您的BMI過重...', 'BMI_OBESE':'2. 您的BMI肥胖...', 'BMI_MISSING':'2. 您的BMI未提供',
+    'BP_IDEAL':'3. 您的血壓理想', 'BP_ELEVATED':'3. 您的血壓偏高...', 'BP_HIGH':'3. 您的血壓高血壓...', 'BP_INVALID':'3. 血壓資料未提供或格式錯誤',
+    'EX_LOW':'4. 本週運動時間({minutes}分鐘)不足...', 'EX_OK':'4. 本週運動時間({minutes}分鐘)達標', 'EX_HIGH':'4. 本週運動時間({minutes}分鐘)充足...',
+}
+GENERAL_RECOMMENDATION = "5. 通用建議：規律作息，均衡飲食。"
+
+def parse_blood_pressure_array(values):
+    """批次解析 "收縮壓/舒張壓" 字串，回傳 (systolic, diastolic, valid)；無效者為 NaN"""
+    text = np.char.strip(np.array(['' if v is None else str(v) for v in values], dtype=str))
+    parts = np.char.partition(text, '/')
+    sys_text, dia_text = np.char.strip(parts[..., 0]), np.char.strip(parts[..., 2])
+    valid = (parts[..., 1] == '/') & np.char.isdigit(sys_text) & np.char.isdigit(dia_text)
+    systolic = np.where(valid, sys_text, '0').astype(float)
+    diastolic = np.where(valid, dia_text, '0').astype(float)
+    return _validate_blood_pressure(systolic, diastolic, valid)
+
+def _validate_blood_pressure(systolic, diastolic, valid=None):
+    valid = ~(np.isnan(systolic) | np.isnan(diastolic)) if valid is None else valid
+    (s_lo, s_hi), (d_lo, d_hi) = BP_VALID_RANGE['systolic'], BP_VALID_RANGE['diastolic']
+    with np.errstate(invalid='ignore'):
+        valid = valid & (systolic >= s_lo) & (systolic <= s_hi) & (diastolic >= d_lo) & (diastolic <= d_hi)
+    return np.where(valid, systolic, np.nan), np.where(valid, diastolic, np.nan), valid
+
+def score_arrays(heart_rate, bmi, exercise_duration, systolic, diastolic, bp_valid=None):
+    """以陣列計算評分 (0-100) 與建議代碼；缺值以 NaN 表示"""
+    hr, bmi = np.asarray(heart_rate, dtype=float), np.asarray(bmi, dtype=float)
+    exercise = np.nan_to_num(np.asarray(exercise_duration, dtype=float), nan=0.0)
+    systolic, diastolic, bp_valid = _validate_blood_pressure(np.asarray(systolic, dtype=float), np.asarray(diastolic, dtype=float), bp_valid)
+    hr_missing, bmi_missing = np.isnan(hr), np.isnan(bmi)
+    with np.errstate(invalid='ignore'):
+        result = {
+            'heart_rate_score': np.select([(hr >= 60) & (hr <= 80), (hr >= 50) & (hr <= 100), ~hr_missing & (hr != 0)], [100.0, 80.0, 60.0], 0.0),
+            'bmi_score': np.select([(bmi >= 18.5) & (bmi < 24), ((bmi >= 24) & (bmi < 27)) | ((bmi >= 17) & (bmi < 18.5)), ~bmi_missing & (bmi != 0)], [100.0, 70.0, 50.0], 0.0),
+            'exercise_score': np.minimum(100.0, exercise / 300 * 100),
+            'blood_pressure_score': np.select([~bp_valid, (systolic < 120) & (diastolic < 80), (systolic < 140) & (diastolic < 90)], [0.0, 100.0, 70.0], 50.0),
+            'heart_rate_code': np.select([hr_missing, hr > 100, hr < 60], ['HR_MISSING', 'HR_HIGH', 'HR_LOW'], 'HR_OK'),
+            'bmi_code': np.select([bmi_missing, bmi < 18.5, bmi < 24, bmi < 27], ['BMI_MISSING', 'BMI_UNDER', 'BMI_NORMAL', 'BMI_OVER'], 'BMI_OBESE'),
+            'blood_pressure_code': np.select([~bp_valid, (systolic < 120) & (diastolic < 80), (systolic < 140) & (diastolic < 90)], ['BP_INVALID', 'BP_IDEAL', 'BP_ELEVATED'], 'BP_HIGH'),
+            'exercise_code': np.select([exercise < 150, exercise <= 300], ['EX_LOW', 'EX_OK'], 'EX_HIGH'),
+        }
+    result['overall_score'] = (result['heart_rate_score'] + result['bmi_score'] + result['exercise_score'] + result['blood_pressure_score']) / 4
+    result.update(exercise_minutes=exercise.astype(int), systolic=systolic, diastolic=diastolic, bp_valid=bp_valid)
+    return result
+
+def score_members(records):
+    """對會員量測資料清單 (normalize_report_data 格式) 批次評分"""
+    def column(key): return np.array([np.nan if r.get(key) is None else r.get(key) for r in records], dtype=float)
+    systolic, diastolic, valid = parse_blood_pressure_array([r.get('blood_pressure') for r in records])
+    result = score_arrays(column('heart_rate'), column('bmi'), column('exercise_duration'), systolic, diastolic, valid)
+    result['patient_id'] = [r.get('patient_id') for r in records]
+    return result
+
+def recommendations_for(result, index=0):
+    """依建議代碼產生第 index 位會員的建議文字"""
+    minutes = int(result['exercise_minutes'][index])
+    return [RECOMMENDATION_TEXT[result[f'{key}_code'][index]].format(minutes=minutes) for key in ('heart_rate', 'bmi', 'blood_pressure', 'exercise')] + [GENERAL_RECOMMENDATION]
+
+def cohort_rows(result):
+    """將評分結果轉成 JSON 友善的逐筆資料"""
+    columns = {k: (v.tolist() if isinstance(v, np.ndarray) else v) for k, v in result.items()}
+    return [{'patient_id':columns['patient_id'][i],
+             'scores':dict({key: round(columns[f'{key}_score'][i], 1) for key in SCORE_LABELS}, overall=round(columns['overall_score'][i], 1)),
+             'codes':[columns[f'{key}_code'][i] for key in ('heart_rate', 'bmi', 'blood_pressure', 'exercise')],
+             'blood_pressure_valid':columns['bp_valid'][i]}
+            for i in range(len(columns['patient_id']))]
+
+def cohort_summary(result):
+    """族群的平均評分與各建議代碼人數"""
+    summary = {'count':len(result['patient_id'])}
+    if not summary['count']: return summary
+    summary['mean_scores'] = dict({key: round(float(result[f'{key}_score'].mean()), 1) for key in SCORE_LABELS}, overall=round(float(result['overall_score'].mean()), 1))
+    codes, counts = np.unique(np.concatenate([result[f'{key}_code'] for key in ('heart_rate', 'bmi', 'blood_pressure', 'exercise')]), return_counts=True)
+    summary['code_counts'] = dict(zip(codes.tolist(), counts.tolist()))
+    return summary
+
+def _latest_metrics_sql(where=''):
+    """每位會員一列：各項量測分別取最新的非空值 (血壓兩值一組)，measured_at 為最新量測時間，report_count 只計報告"""
+    def latest(column, key=None):
+        return f'FIRST_VALUE({column}) OVER (PARTITION BY patient_id ORDER BY {key or column} IS NULL, measured_at DESC, id DESC) AS {column}'
+    return f'''SELECT patient_id, report_id, measured_at, heart_rate, bmi, exercise_duration, systolic, diastolic, report_count FROM (
+            SELECT patient_id, measured_at, {latest('report_id')}, {latest('heart_rate')}, {latest('bmi')}, {latest('exercise_duration')},
+                   {latest('systolic')}, {latest('diastolic', 'systolic')}, COUNT(report_id) OVER (PARTITION BY patient_id) AS report_count,
+                   ROW_NUMBER() OVER (PARTITION BY patient_id ORDER BY measured_at DESC, id DESC) AS rn
+            FROM measurements {where}) WHERE rn = 1 ORDER BY patient_id'''
+
+def get_latest_measurements(patient_ids=None, coach_id=None):
+    """每位會員各項最新量測 (欄位陣列)，可依會員ID或教練篩選"""
+    where, params = [], []
+    if patient_ids:
+        where.append(f"patient_id IN ({','.join('?' * len(patient_ids))})"); params += list(patient_ids)
+    if coach_id is not None:
+        where.append('patient_id IN (SELECT patient_id FROM members WHERE coach_id = ?)'); params.append(coach_id)
+    rows = get_db().execute(_latest_metrics_sql('WHERE ' + ' AND '.join(where) if where else ''), params).fetchall()
+    columns = list(zip(*rows)) if rows else [()] * 9
+    numeric = [np.array([np.nan if v is None else v for v in col], dtype=float) for col in columns[3:8]]
+    return list(columns[0]), list(columns[2]), numeric
+
+def score_latest_measurements(patient_ids=None, coach_id=None):
+    patient_ids, measured_at, (heart_rate, bmi, exercise, systolic, diastolic) = get_latest_measurements(patient_ids, coach_id)
+    result = score_arrays(heart_rate, bmi, exercise, systolic, diastolic)
+    result.update(patient_id=patient_ids, measured_at=measured_at)
+    return result
+
+# --- 教練儀表板 (member_summary 彙總表) ---
+# 每位會員一列最新量測與評分，於報告寫入的同一交易中更新；教練頁面只讀這張表，不掃描 health_reports
+WHO_EXERCISE_MINUTES = 150  # WHO 建議成人每週至少 150 分鐘中等強度運動
+SCORE_DISTRIBUTION_BINS = (0, 20, 40, 60, 80, 100)
+MEMBER_SUMMARY_COLUMNS = ('patient_id', 'report_id', 'measured_at', 'heart_rate', 'bmi', 'systolic', 'diastolic', 'exercise_duration',
+                          'heart_rate_score', 'bmi_score', 'exercise_score', 'blood_pressure_score', 'overall_score')
+MEMBER_SUMMARY_GROUPS = (('report_id',), ('heart_rate',), ('bmi',), ('systolic', 'diastolic'), ('exercise_duration',))  # 分別取最新非空值的欄位
+
+def _member_summary_rows(patient_ids, report_ids, measured_at, heart_rate, bmi, exercise, systolic, diastolic, bp_valid=None):
+    result = score_arrays(heart_rate, bmi, exercise, systolic, diastolic, bp_valid)
+    columns = [np.asarray(c, dtype=float).tolist() for c in (heart_rate, bmi, result['systolic'], result['diastolic'], exercise)]
+    columns += [result[f'{key}_score'].tolist() for key in SCORE_LABELS] + [result['overall_score'].tolist()]
+    return [(pid, rid, at, *[None if v != v else v for v in values])
+            for pid, rid, at, *values in zip(patient_ids, report_ids, measured_at, *columns)]
+
+def _merge_summary(current, new):
+    """合併同一會員的兩筆量測：各欄位群組取較新的非空值，只缺值時才由較舊的一筆補上"""
+    if current is None: return new
+    newer, older = (new, current) if new['measured_at'] >= current['measured_at'] else (current, new)
+    merged = dict(newer, report_count=current['report_count'] + new['report_count'])
+    for group in MEMBER_SUMMARY_GROUPS:
+        if merged[group[0]] is None: merged.update({c: older[c] for c in group})
+    return merged
+
+def update_member_summary(conn, entries, measured_at=None):
+    """以新寫入的量測更新彙總表 (呼叫端負責交易)；entries 為 (patient_id, report_id, report_data)。
+    各項量測分別保留最新的非空值，只有帶 report_id 的項目計入 report_count；measured_at 可為單一時間 (None 表示現在) 或與 entries 等長的清單"""
+    if not entries: return
+    now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    if not isinstance(measured_at, (list, tuple)): measured_at = [measured_at] * len(entries)
+    records = [data for _, _, data in entries]
+    systolic, diastolic, _ = parse_blood_pressure_array([r.get('blood_pressure') for r in records])
+    fields = [f for group in MEMBER_SUMMARY_GROUPS for f in group]
+    merged, patient_ids = {}, sorted({e[0] for e in entries})
+    for i in range(0, len(patient_ids), 500):
+        chunk = patient_ids[i:i + 500]
+        for row in conn.execute(f'SELECT patient_id, measured_at, report_count, {", ".join(fields)} FROM member_summary WHERE patient_id IN ({",".join("?" * len(chunk))})', chunk):
+            merged[row[0]] = dict(zip(['measured_at', 'report_count'] + fields, row[1:]))
+    for (patient_id, report_id, data), at, sys_value, dia_value in zip(entries, measured_at, systolic.tolist(), diastolic.tolist()):
+        new = {'report_id':report_id, 'measured_at':at or now, 'report_count':int(report_id is not None),
+               'heart_rate':data.get('heart_rate'), 'bmi':data.get('bmi'), 'exercise_duration':data.get('exercise_duration'),
+               'systolic':None if sys_value != sys_value else sys_value, 'diastolic':None if dia_value != dia_value else dia_value}
+        merged[patient_id] = _merge_summary(merged.get(patient_id), new)
+    ids = list(merged)
+    def column(key): return [np.nan if merged[pid][key] is None else merged[pid][key] for pid in ids]
+    rows = _member_summary_rows(ids, [merged[pid]['report_id'] for pid in ids], [merged[pid]['measured_at'] for pid in ids],
+                                *(column(key) for key in ('heart_rate', 'bmi', 'exercise_duration', 'systolic', 'diastolic')))
+    conn.executemany(f'''INSERT INTO member_summary ({', '.join(MEMBER_SUMMARY_COLUMNS)}, report_count) VALUES ({', '.join('?' * (len(MEMBER_SUMMARY_COLUMNS) + 1))})
+        ON CONFLICT (patient_id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in MEMBER_SUMMARY_COLUMNS[1:])}, report_count = excluded.report_count, updated_at = CURRENT_TIMESTAMP''',
+        [row + (merged[row[0]]['report_count'],) for row in rows])
+
+def rebuild_member_summary(conn):
+    """由 measurements 重建整張彙總表 (升級既有資料庫或大量匯入後使用)"""
+    rows = conn.execute(_latest_metrics_sql()).fetchall()
+    columns = list(zip(*rows)) if rows else [()] * 9
+    numeric = [[np.nan if v is None else v for v in col] for col in columns[3:8]]
+    summary = _member_summary_rows(columns[0], columns[1], columns[2], *numeric)
+    with conn:
+        conn.execute('DELETE FROM member_summary')
+        conn.executemany(f'INSERT INTO member_summary ({", ".join(MEMBER_SUMMARY_COLUMNS)}, report_count) VALUES ({", ".join("?" * (len(MEMBER_SUMMARY_COLUMNS) + 1))})',
+                         [row + (count,) for row, count in zip(summary, columns[8])])
+    return len(summary)
+
+def get_coach_dashboard(coach_id):
+    """教練旗下會員的最新量測、評分分布與未達 WHO 運動建議的會員；教練不存在時回傳 None"""
+    conn = get_db()
+    coach = conn.execute('SELECT id, name, email, phone FROM coaches WHERE id = ?', (coach_id,)).fetchone()
+    if coach is None: return None
+    fields = ['patient_id', 'name', 'report_id', 'measured_at', 'heart_rate', 'bmi', 'systolic', 'diastolic', 'exercise_duration', 'overall_score', 'report_count']
+    rows = conn.execute('''SELECT m.patient_id, m.name, s.report_id, s.measured_at, s.heart_rate, s.bmi, s.systolic, s.diastolic, s.exercise_duration, s.overall_score, s.report_count
+        FROM members m LEFT JOIN member_summary s ON s.patient_id = m.patient_id WHERE m.coach_id = ?
+        ORDER BY s.overall_score IS NULL, s.overall_score, m.patient_id''', (coach_id,)).fetchall()
+    members = []
+    for row in rows:
+        member = dict(zip(fields, row))
+        member['blood_pressure'] = f"{member['systolic']}/{member['diastolic']}" if member['systolic'] is not None else None
+        member['overall_score'] = round(member['overall_score'], 1) if member['overall_score'] is not None else None
+        member['report_count'] = member['report_count'] or 0
+        member['below_who_exercise'] = member['exercise_duration'] is not None and member['exercise_duration'] < WHO_EXERCISE_MINUTES
+        members.append(member)
+    scored = np.array([m['overall_score'] for m in members if m['overall_score'] is not None], dtype=float)
+    counts, _ = np.histogram(scored, bins=SCORE_DISTRIBUTION_BINS)
+    below = [m for m in members if m['below_who_exercise']]
+    return {'coach':dict(zip(['id', 'name', 'email', 'phone'], coach)), 'members':members,
+            'summary':{'member_count':len(members), 'reported_count':len(scored), 'below_who_exercise_count':len(below),
+                       'mean_overall_score':round(float(scored.mean()), 1) if len(scored) else None, 'who_exercise_minutes':WHO_EXERCISE_MINUTES},
+            'score_distribution':[{'range':f'{lo}-{hi}', 'count':int(n)} for lo, hi, n in zip(SCORE_DISTRIBUTION_BINS, SCORE_DISTRIBUTION_BINS[1:], counts)],
+            'below_who_exercise':[{'patient_id':m['patient_id'], 'name':m['name'], 'exercise_duration':m['exercise_duration']} for m in below]}
+
 # --- 視覺化 Class (保持不變) ---
+DASHBOARD_RENDER_MODE = os.environ.get('DASHBOARD_RENDER_MODE', 'template')  # 'template' 或 'full'
+DASHBOARD_DPI = 300
+DASHBOARD_FIGSIZE = (18, 12)  # 英吋
+
+def _trend_history(patient_id, as_of=None):
+    """as_of (預設今天) 之前 30 天 (不含當天) 的每日平均；當天的資料由本次量測代表"""
+    today = as_of or datetime.utcnow().date()
+    return get_trend(patient_id, (today-timedelta(days=TREND_DAYS)).isoformat(), today.isoformat(), 'day')
+
+def _trend_series(data, history=None, as_of=None):
+    """as_of 為報告日期：補畫舊報告的其他輸出規格時，趨勢圖仍與產生當天相同"""
+    as_of = as_of or datetime.utcnow().date()
+    if history is None: history = _trend_history(data.get('patient_id'), as_of)
+    nan = float('nan')
+    def value(v): return v if v is not None else nan
+    dates = [datetime.strptime(h['period_start'], '%Y-%m-%d') for h in history] + [datetime.combine(as_of, datetime.min.time())]
+    hr_trend = [value(h['heart_rate']) for h in history] + [value(data.get('heart_rate'))]
+    w_trend = [value(h['weight']) for h in history] + [value(data.get('weight'))]
+    return dates, hr_trend, w_trend
+
+def _compute_health_scores(data):
+    """單一會員的各項評分 (圖表用)，與 score_members 使用同一套規則"""
+    result = score_members([data])
+    return {label: float(result[f'{key}_score'][0]) for key, label in SCORE_LABELS.items()}
+
 class HealthDataVisualizer:
     def __init__(self, output_dir):
         self.output_dir = output_dir
@@ -133,8 +1041,24 @@ class HealthDataVisualizer:
         }
     
     def create_dashboard_chart(self, data):
-        plt.rcParams['font.family'] = 'Noto Sans TC'
-        fig = plt.figure(figsize=(18, 12))
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        dashboard_path = os.path.join(self.output_dir, f'dashboard_{data["patient_id"]}_{timestamp}.png')
+        self.render_dashboard(data, dashboard_path)
+        return dashboard_path
+
+    def render_dashboard_png(self, data):
+        """在記憶體中渲染儀表板，回傳 PNG 位元組"""
+        buffer = BytesIO()
+        self.render_dashboard(data, buffer)
+        return buffer.getvalue()
+
+    def render_dashboard(self, data, target, fmt='png', width=None, as_of=None):
+        """將儀表板寫入檔案路徑或檔案物件；fmt 為 png/jpg/svg，width 為輸出寬度 (px，預設依 DASHBOARD_DPI)"""
+        if DASHBOARD_RENDER_MODE == 'template':
+            with dashboard_templates.checkout(self.colors) as template:
+                template.render(data, target, fmt=fmt, width=width, as_of=as_of)
+            return
+        fig = new_figure(DASHBOARD_FIGSIZE)
         fig.suptitle(f'{data["patient_id"]} 健康數據儀表板', fontsize=20, fontweight='bold')
         gs = fig.add_gridspec(2, 3)
         ax1, ax2, ax3 = fig.add_subplot(gs[0, 0]), fig.add_subplot(gs[0, 1]), fig.add_subplot(gs[0, 2])
@@ -143,14 +1067,12 @@ class HealthDataVisualizer:
         self._create_bmi_chart(ax2, data['bmi'], data['weight'], data['height'])
         self._create_blood_pressure_chart(ax3, data['blood_pressure'])
         self._create_exercise_chart(ax4, data['exercise_duration'])
-        self._create_trend_chart(ax5, data)
+        self._create_trend_chart(ax5, data, as_of)
         self._create_health_score_chart(ax6, data)
-        plt.tight_layout(rect=[0, 0.03, 1, 0.95])
-        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        dashboard_path = os.path.join(self.output_dir, f'dashboard_{data["patient_id"]}_{timestamp}.png')
-        plt.savefig(dashboard_path, dpi=300, bbox_inches='tight')
-        plt.close(fig)
-        return dashboard_path
+        with timed('dashboard_tight_layout'):
+            fig.tight_layout(rect=[0, 0.03, 1, 0.95])
+        with timed('dashboard_savefig'):
+            fig.savefig(target, format=fmt, dpi=width / DASHBOARD_FIGSIZE[0] if width else DASHBOARD_DPI, bbox_inches='tight', **_savefig_options(fmt))
     
     def _create_gauge_chart(self, ax, value, metric_type, title):
         ranges, max_val = [(0,60,'#FF6B6B'),(60,100,'#4ECDC4'),(100,160,'#FFE66D'),(160,220,'#FF6B6B')], 220
@@ -196,10 +1118,8 @@ class HealthDataVisualizer:
         ax.set_ylabel('運動時間 (分鐘)'); ax.set_title('每週運動時間分析',fontsize=14,fontweight='bold'); ax.grid(axis='y',alpha=0.3)
         ax.axhline(150,c='r',ls='--',alpha=0.7,label='WHO 最低建議'); ax.axhline(300,c='g',ls='--',alpha=0.7,label='WHO 理想目標'); ax.legend()
 
-    def _create_trend_chart(self, ax, data):
-        dates = [datetime.now()-timedelta(days=x) for x in range(30,0,-1)]
-        hr = data.get('heart_rate') or 75; hr_trend = [max(50,hr+np.random.normal(0,5)) for _ in dates]
-        w = data.get('weight') or 70; w_trend = [max(40,w+np.random.normal(0,0.5)) for _ in dates]
+    def _create_trend_chart(self, ax, data, as_of=None):
+        dates, hr_trend, w_trend = _trend_series(data, as_of=as_of)
         ax2 = ax.twinx()
         l1 = ax.plot(dates,hr_trend,c=self.colors['primary'],lw=2,marker='o',ms=3,label='心率')
         l2 = ax2.plot(dates,w_trend,c=self.colors['secondary'],lw=2,marker='s',ms=3,label='體重')
@@ -208,12 +1128,7 @@ class HealthDataVisualizer:
         ax.grid(True,alpha=0.3); ax.tick_params(axis='x',rotation=45)
 
     def _create_health_score_chart(self, ax, data):
-        scores = {}
-        hr = data.get('heart_rate'); scores['心率'] = 100 if 60<=hr<=80 else 80 if 50<=hr<=100 else 60 if hr else 0
-        bmi = data.get('bmi'); scores['BMI'] = 100 if 18.5<=bmi<24 else 70 if 24<=bmi<27 or 17<=bmi<18.5 else 50 if bmi else 0
-        scores['運動'] = min(100, ((data.get('exercise_duration') or 0) / 300) * 100)
-        try: sys,dia = map(int, str(data.get('blood_pressure')).split('/')); scores['血壓'] = 100 if sys<120 and dia<80 else 70 if sys<140 and dia<90 else 50
-        except: scores['血壓'] = 0
+        scores = _compute_health_scores(data)
         cats, vals = list(scores.keys()), list(scores.values())
         if not cats: ax.text(0.5,0.5,'無足夠數據評分',ha='center',va='center'); ax.set_title('綜合健康評分',fontsize=14,fontweight='bold'); ax.axis('off'); return
         angles = np.linspace(0,2*np.pi,len(cats),endpoint=False).tolist()
@@ -225,78 +1140,1474 @@ class HealthDataVisualizer:
         score = sum(vals)/len(vals) if vals else 0
         ax.text(0,0,f'綜合評分\n{score:.1f}',ha='center',va='center',fontsize=14,fontweight='bold',bbox=dict(boxstyle="round,pad=0.3",facecolor="yellow",alpha=0.5),zorder=4)
 
+class DashboardTemplate:
+    """預先繪製靜態背景的儀表板；每次渲染只更新與會員數據相關的圖元"""
+    BMI_CATS = ['過輕','正常','過重','肥胖']
+    BP_CATS = {'理想':{'sys':(0,120),'dia':(0,80),'c':'#51CF66'}, '正常':{'sys':(120,130),'dia':(80,85),'c':'#A9E0A9'}, '偏高':{'sys':(130,140),'dia':(85,90),'c':'#FFD43B'}, '高血壓':{'sys':(140,200),'dia':(90,120),'c':'#FF6B6B'}}
+    SCORE_CATS = ['心率','BMI','運動','血壓']
+    LAYOUT_PARAMS = ('left', 'right', 'bottom', 'top', 'wspace', 'hspace')
+
+    def __init__(self, colors):
+        self.colors = colors
+        self.fig = fig = new_figure(DASHBOARD_FIGSIZE)
+        self.title = fig.suptitle('', fontsize=20, fontweight='bold')
+        gs = fig.add_gridspec(2, 3)
+        ax1, ax2, ax3 = fig.add_subplot(gs[0, 0]), fig.add_subplot(gs[0, 1]), fig.add_subplot(gs[0, 2])
+        ax4, ax5, ax6 = fig.add_subplot(gs[1, 0]), fig.add_subplot(gs[1, 1]), fig.add_subplot(gs[1, 2], polar=True)
+        self._build_gauge(ax1); self._build_bmi(ax2); self._build_blood_pressure(ax3)
+        self._build_exercise(ax4); self._build_trend(ax5); self._build_health_score(ax6)
+        # 每次由同一組初始版面參數重新計算版面，輸出只取決於本次資料，與先前渲染過哪些會員無關
+        self._base_layout = {k: getattr(fig.subplotpars, k) for k in self.LAYOUT_PARAMS}
+        self.update({'patient_id':'', 'heart_rate':75.0, 'weight':70.0, 'height':170.0, 'bmi':22.0, 'blood_pressure':'120/80', 'exercise_duration':150.0}, history=[])  # 建立模板不查詢資料庫
+        self.bbox = self._layout()
+
+    def _layout(self):
+        """依目前的標籤寬度重新計算 tight_layout 並回傳裁切範圍 (只量測文字，不需完整繪製)"""
+        with timed('dashboard_layout'):
+            self.fig.subplots_adjust(**self._base_layout)
+            self.fig.tight_layout(rect=[0, 0.03, 1, 0.95])
+            return self.fig.get_tightbbox(self.fig.canvas.get_renderer()).padded(0.1)
+
+    def _build_gauge(self, ax):
+        ranges, max_val = [(0,60,'#FF6B6B'),(60,100,'#4ECDC4'),(100,160,'#FFE66D'),(160,220,'#FF6B6B')], 220
+        theta = np.linspace(0, np.pi, 200)
+        for s,e,c in ranges:
+            m = (theta >= s/max_val*np.pi) & (theta <= e/max_val*np.pi)
+            if np.any(m): ax.fill_between(theta[m], 0.8, 1.0, color=c, alpha=0.7)
+        self.gauge_max = max_val
+        self.needle, = ax.plot([0,0],[0,0.9],'k-',lw=4); self.needle_hub, = ax.plot(0,0,'ko',ms=8)
+        self.gauge_text = ax.text(np.pi/2,0.5,'',ha='center',va='center',fontsize=16,fontweight='bold')
+        ax.set_xlim(0,np.pi); ax.set_ylim(0,1); ax.set_title('心率 (BPM)',fontsize=14,fontweight='bold'); ax.axis('off')
+
+    def _build_bmi(self, ax):
+        colors, widths, starts = ['#74C0FC','#51CF66','#FFD43B','#FF6B6B'], [18.5,5.5,3,23], [0,18.5,24,27]
+        y_pos = np.arange(len(self.BMI_CATS))
+        ax.barh(y_pos, widths, left=starts, color=colors, alpha=0.7, height=0.6, align='center')
+        self.bmi_line = ax.axvline(x=22,c='r',ls='--',lw=3,label='您的 BMI')
+        self.bmi_text = ax.text(22,len(self.BMI_CATS)-0.5,'',ha='center',va='bottom',fontweight='bold',fontsize=12,color='r')
+        ax.set_yticks(y_pos); ax.set_yticklabels(self.BMI_CATS); ax.set_xlabel('BMI 數值')
+        ax.set_title('BMI 分析圖',fontsize=14,fontweight='bold'); self.bmi_legend = ax.legend(); ax.grid(axis='x',alpha=0.3); ax.set_xlim(10,40)
+
+    def _build_blood_pressure(self, ax):
+        self.bp_ax = ax
+        self.bp_patches = [ax.add_patch(Rectangle((r['sys'][0],r['dia'][0]),r['sys'][1]-r['sys'][0],r['dia'][1]-r['dia'][0],alpha=0.3,color=r['c'],label=cat)) for cat, r in self.BP_CATS.items()]
+        self.bp_star = ax.scatter([120],[80],s=200,c='r',marker='*',edgecolors='k',lw=2,label='您的血壓')
+        self.bp_message = ax.text(0.5,0.5,'',ha='center',va='center',transform=ax.transAxes,fontsize=14)
+        ax.set_xlabel('收縮壓 (mmHg)'); ax.set_ylabel('舒張壓 (mmHg)'); ax.set_title('血壓分析圖',fontsize=14,fontweight='bold')
+        self.bp_legend = ax.legend(bbox_to_anchor=(1.05,1),loc='upper left'); ax.grid(True,alpha=0.3); ax.set_xlim(80,200); ax.set_ylim(50,120)
+
+    def _build_exercise(self, ax):
+        self.exercise_ax = ax
+        cats, vals = ['最低標準','理想目標','當週運動'], [150,300,0]
+        self.exercise_bars = ax.bar(cats, vals, color=['#FFD43B','#4ECDC4','#2E86AB'], alpha=0.8)
+        self.exercise_texts = [ax.text(bar.get_x()+bar.get_width()/2.,bar.get_height()+5,f'{int(val)} 分鐘',ha='center',va='bottom',fontweight='bold') for bar,val in zip(self.exercise_bars,vals)]
+        ax.set_ylabel('運動時間 (分鐘)'); ax.set_title('每週運動時間分析',fontsize=14,fontweight='bold'); ax.grid(axis='y',alpha=0.3)
+        ax.axhline(150,c='r',ls='--',alpha=0.7,label='WHO 最低建議'); ax.axhline(300,c='g',ls='--',alpha=0.7,label='WHO 理想目標'); ax.legend()
+
+    def _build_trend(self, ax):
+        self.trend_axes = (ax, ax.twinx())
+        ax.xaxis_date()
+        self.hr_line, = ax.plot([],[],c=self.colors['primary'],lw=2,marker='o',ms=3,label='心率')
+        self.weight_line, = self.trend_axes[1].plot([],[],c=self.colors['secondary'],lw=2,marker='s',ms=3,label='體重')
+        ax.set_xlabel('日期'); ax.set_ylabel('心率 (BPM)',c=self.colors['primary']); self.trend_axes[1].set_ylabel('體重 (kg)',c=self.colors['secondary'])
+        ax.set_title('30 天健康趨勢',fontsize=14,fontweight='bold'); lines=[self.hr_line,self.weight_line]; ax.legend(lines,[l.get_label() for l in lines],loc='upper left')
+        ax.grid(True,alpha=0.3); ax.tick_params(axis='x',rotation=45)
+
+    def _build_health_score(self, ax):
+        angles = np.linspace(0,2*np.pi,len(self.SCORE_CATS),endpoint=False).tolist()
+        self.score_angles = angles+angles[:1]
+        ax.set_theta_offset(np.pi/2); ax.set_theta_direction(-1)
+        self.score_line, = ax.plot(self.score_angles,[0]*len(self.score_angles),'o-',lw=2,color=self.colors['info'],zorder=3)
+        self.score_fill, = ax.fill(self.score_angles,[0]*len(self.score_angles),alpha=0.25,color=self.colors['info'],zorder=2)
+        ax.set_thetagrids(np.degrees(angles),self.SCORE_CATS); ax.set_rgrids([20,40,60,80,100]); ax.set_ylim(0,100)
+        ax.set_title('綜合健康評分',fontsize=14,fontweight='bold',y=1.1)
+        self.score_text = ax.text(0,0,'',ha='center',va='center',fontsize=14,fontweight='bold',bbox=dict(boxstyle="round,pad=0.3",facecolor="yellow",alpha=0.5),zorder=4)
+
+    def update(self, data, as_of=None, history=None):
+        """只更新與會員相關的圖元"""
+        self.title.set_text(f'{data["patient_id"]} 健康數據儀表板')
+        # 心率儀表
+        value = data['heart_rate']
+        has_hr = value is not None and value > 0
+        if has_hr:
+            a = min(value/self.gauge_max*np.pi, np.pi)
+            self.needle.set_data([a,a],[0,0.9]); self.needle_hub.set_data([a],[0])
+        self.needle.set_visible(has_hr); self.needle_hub.set_visible(has_hr)
+        self.gauge_text.set_text(f'{int(value)}' if has_hr else 'N/A')
+        # BMI
+        bmi = data['bmi']
+        has_bmi = bmi is not None and bmi > 0
+        if has_bmi:
+            self.bmi_line.set_xdata([bmi,bmi]); self.bmi_text.set_x(bmi); self.bmi_text.set_text(f'{bmi:.1f}')
+            self.bmi_legend.get_texts()[0].set_text(f'您的 BMI: {bmi:.1f}')
+        for artist in (self.bmi_line, self.bmi_text, self.bmi_legend): artist.set_visible(has_bmi)
+        # 血壓
+        blood_pressure = data['blood_pressure']
+        message = None
+        if not blood_pressure or '/' not in str(blood_pressure): message = '血壓數據無效'
+        else:
+            try: sys, dia = map(int, str(blood_pressure).split('/'))
+            except (ValueError,TypeError): message = '血壓格式錯誤'
+        if message is None:
+            self.bp_star.set_offsets([[sys,dia]]); self.bp_legend.get_texts()[-1].set_text(f'您的血壓: {blood_pressure}')
+        for artist in self.bp_patches+[self.bp_star, self.bp_legend]: artist.set_visible(message is None)
+        self.bp_message.set_text(message or '')
+        self.bp_ax.set_title('血壓分析圖' if message is None else '血壓分析',fontsize=14,fontweight='bold')
+        # 運動時間
+        minutes = data['exercise_duration'] or 0
+        bar, text = self.exercise_bars[2], self.exercise_texts[2]
+        bar.set_height(minutes); text.set_y(minutes+5); text.set_text(f'{int(minutes)} 分鐘')
+        self.exercise_ax.relim(); self.exercise_ax.autoscale_view()
+        # 趨勢
+        dates, hr_trend, w_trend = _trend_series(data, history=history, as_of=as_of)
+        self.hr_line.set_data(dates, hr_trend); self.weight_line.set_data(dates, w_trend)
+        for ax in self.trend_axes: ax.relim(); ax.autoscale_view()
+        # 綜合評分
+        scores = _compute_health_scores(data)
+        vals = [scores[c] for c in self.SCORE_CATS]
+        vals_c = vals+vals[:1]
+        self.score_line.set_ydata(vals_c); self.score_fill.set_xy(np.column_stack([self.score_angles, vals_c]))
+        self.score_text.set_text(f'綜合評分\n{sum(vals)/len(vals):.1f}')
+
+    def render(self, data, target, fmt='png', width=None, as_of=None):
+        with timed('dashboard_update'):
+            self.update(data, as_of)
+            self.bbox = self._layout()
+        with timed('dashboard_savefig'):
+            self.fig.savefig(target, format=fmt, dpi=width / self.bbox.width if width else DASHBOARD_DPI, bbox_inches=self.bbox, **_savefig_options(fmt))
+        return target
+
+def _savefig_options(fmt):
+    if fmt == 'jpg': return {'pil_kwargs':{'quality':PDF_IMAGE_QUALITY, 'optimize':True}}
+    if fmt == 'svg': return {'metadata':{'Date':None}}  # 不寫入產生時間，相同內容得到相同位元組
+    return {}
+
+DASHBOARD_TEMPLATE_POOL_SIZE = int(os.environ.get('DASHBOARD_TEMPLATE_POOL_SIZE', max(2, os.cpu_count() or 1)))
+
+class TemplatePool:
+    """有上限的儀表板模板池：模板在 render 時會被改寫，同一時間只借給一個執行緒，用完歸還給後續請求重複使用
+    (每個請求一個執行緒的伺服器下，模板不會隨執行緒結束而重建)；全部借出時等待歸還"""
+    def __init__(self, size):
+        self.size = max(1, size)
+        self.built = 0
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def checkout(self, colors):
+        try: template = self._idle.get_nowait()
+        except queue.Empty: template = self._build(colors) or self._idle.get()
+        try: yield template
+        finally: self._idle.put(template)
+
+    def _build(self, colors):
+        with self._lock:
+            if self.built >= self.size: return None
+            self.built += 1
+        try:
+            with timed('dashboard_template_build'):
+                return DashboardTemplate(colors)
+        except BaseException:
+            with self._lock: self.built -= 1
+            raise
+
+dashboard_templates = TemplatePool(DASHBOARD_TEMPLATE_POOL_SIZE)
+
 # --- 報告生成邏輯 (保持不變) ---
 def _generate_recommendations(data):
-    recs = []
-    hr = data.get('heart_rate'); recs.append(f"1. 您的靜息心率{'偏高...' if hr > 100 else '偏低...' if hr < 60 else '在理想範圍' if hr else '未提供'}")
-    bmi = data.get('bmi'); recs.append(f"2. 您的BMI{'過低...' if bmi < 18.5 else '正常' if bmi < 24 else '過重...' if bmi < 27 else '肥胖...' if bmi else '未提供'}")
-    try: sys,dia=map(int,str(data.get('blood_pressure')).split('/')); recs.append(f"3. 您的血壓{'理想' if sys<120 and dia<80 else '偏高...' if sys<140 and dia<90 else '高血壓...'}")
-    except: recs.append("3. 血壓資料未提供或格式錯誤")
-    ex = data.get('exercise_duration') or 0; recs.append(f"4. 本週運動時間({int(ex)}分鐘){'不足...' if ex < 150 else '達標' if ex <= 300 else '充足...'}")
-    recs.append("5. 通用建議：規律作息，均衡飲食。")
-    return recs
+    return recommendations_for(score_members([data]))
 
-@app.route('/generate_report', methods=['POST'])
-def generate_report():
-    try:
-        data = request.get_json()
-        patient_id, coach_email, patient_email = data.get('patient_id','未知'), data.get('coach_email'), data.get('patient_email')
-        send_email, sender_email, sender_password = data.get('send_email',False), data.get('sender_email'), data.get('sender_password')
-        if send_email and (not sender_email or not sender_password):
-            return jsonify({"status":"error", "message":"需提供寄件Email和密碼"}), 400
-        def safe_float(v): return float(v) if v is not None else None
-        p_data = {"patient_id":patient_id, "heart_rate":safe_float(data.get('heart_rate')), "weight":safe_float(data.get('weight')), "height":safe_float(data.get('height')), "bmi":safe_float(data.get('bmi')), "blood_pressure":data.get('blood_pressure'), "exercise_duration":safe_float(data.get('exercise_duration'))}
-        output_dir='output'; os.makedirs(output_dir,exist_ok=True)
-        visualizer = HealthDataVisualizer(output_dir=output_dir)
-        dashboard_path = visualizer.create_dashboard_chart(p_data)
-        recs = _generate_recommendations(p_data)
+class ReportError(Exception):
+    """報告產生失敗，附帶對應的 HTTP 狀態碼"""
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.status_code = status_code
+
+PDF_MODE = os.environ.get('PDF_MODE', 'compact')  # 'compact' | 'legacy'
+PDF_IMAGE_WIDTH_MM = 190        # 儀表板在 A4 頁面上的寬度
+PDF_IMAGE_DPI = int(os.environ.get('PDF_IMAGE_DPI', 200))
+PDF_IMAGE_QUALITY = 85
+
+_simple_pdf_class = None
+
+def _load_simple_pdf():
+    """第一次產生 PDF 時才載入 fpdf 並定義報告頁首頁尾"""
+    global _simple_pdf_class
+    if _simple_pdf_class is None:
+        from fpdf import FPDF
         class SimplePDF(FPDF):
-            def header(self): self.set_font('NotoSansTC','B',16); self.cell(0,10,f'個人化健康報告 - {patient_id}',0,1,'C'); self.set_font('NotoSansTC','',10); self.cell(0,8,f'報告生成時間：{datetime.now().strftime("%Y-%m-%d %H:%M:%S")}',0,1,'C'); self.ln(10)
+            def __init__(self, patient_id, single_font=False):
+                super().__init__()
+                self.patient_id = patient_id
+                self.single_font = single_font
+            def set_font(self, family, style='', size=0):
+                # 粗體與一般樣式本來就是同一個 TTF：精簡模式只嵌入一份子集字型
+                if self.single_font and family == 'NotoSansTC': style = style.upper().replace('B', '')
+                super().set_font(family, style, size)
+            def header(self): self.set_font('NotoSansTC','B',16); self.cell(0,10,f'個人化健康報告 - {self.patient_id}',0,1,'C'); self.set_font('NotoSansTC','',10); self.cell(0,8,f'報告生成時間：{datetime.now().strftime("%Y-%m-%d %H:%M:%S")}',0,1,'C'); self.ln(10)
             def footer(self): self.set_y(-15); self.set_font('NotoSansTC','',8); self.cell(0,10,f'第 {self.page_no()} 頁',0,0,'C')
-        pdf = SimplePDF()
-        if not os.path.exists(FONT_PATH): return jsonify({"status":"error", "message":f"字體檔案 '{FONT_PATH}' 不存在"}), 500
-        pdf.add_font('NotoSansTC','',FONT_PATH,uni=True); pdf.add_font('NotoSansTC','B',FONT_PATH,uni=True)
+        _simple_pdf_class = SimplePDF
+    return _simple_pdf_class
+
+_pdf_font_cache = {}
+_pdf_font_lock = threading.Lock()  # 多執行緒同時產生 PDF 時只載入一次字型
+
+def new_report_pdf(patient_id, mode=None):
+    """建立已註冊字型的 PDF；字型只在每個程序第一次使用時載入"""
+    if not os.path.exists(FONT_PATH): raise ReportError(f"字體檔案 '{FONT_PATH}' 不存在", 500)
+    mode = mode or PDF_MODE
+    pdf = _load_simple_pdf()(patient_id, single_font=(mode == 'compact'))
+    with _pdf_font_lock:
+        cached = _pdf_font_cache.get(mode)
+        if cached is None:
+            pdf.add_font('NotoSansTC','',FONT_PATH,uni=True)
+            if mode != 'compact': pdf.add_font('NotoSansTC','B',FONT_PATH,uni=True)
+            _pdf_font_cache[mode] = {'fonts': {k: dict(v, subset=list(v['subset'])) for k,v in pdf.fonts.items()}, 'font_files': dict(pdf.font_files)}
+            return pdf
+    # 字寬表等唯讀資料共用，只有子集清單需要每份文件各自一份
+    pdf.fonts = {k: dict(v, subset=list(v['subset'])) for k,v in cached['fonts'].items()}
+    pdf.font_files = dict(cached['font_files'])
+    return pdf
+
+def validate_report_request(data):
+    """在排入產生流程前檢查請求內容"""
+    if not isinstance(data, dict):
+        raise ReportError("請求內容必須是 JSON 物件", 400)
+    if data.get('send_email',False) and (not data.get('sender_email') or not data.get('sender_password')):
+        raise ReportError("需提供寄件Email和密碼", 400)
+
+def normalize_report_data(data):
+    """將請求中的量測值整理成報告使用的 p_data"""
+    def safe_float(v): return float(v) if v not in (None, '') else None
+    return {"patient_id":str(data.get('patient_id') or '未知'), "heart_rate":safe_float(data.get('heart_rate')), "weight":safe_float(data.get('weight')), "height":safe_float(data.get('height')), "bmi":safe_float(data.get('bmi')), "blood_pressure":data.get('blood_pressure'), "exercise_duration":safe_float(data.get('exercise_duration'))}
+
+# --- 產物儲存 (內容定址、檔案系統或 SQLite BLOB) ---
+# 報告的 pdf_path / dashboard_path 欄位存放「產物參照」：'cas:' 開頭為內容定址物件 (相對於 ARTIFACT_ROOT)，
+# 'blob:' 開頭表示 artifacts 資料表中的 BLOB，其餘為一般檔案路徑 (舊版)
+ARTIFACT_STORE = os.environ.get('ARTIFACT_STORE', 'cas')  # 'cas' | 'file' | 'sqlite'
+ARTIFACT_ROOT = os.environ.get('ARTIFACT_ROOT', 'output')
+BLOB_REF_PREFIX = 'blob:'
+CAS_REF_PREFIX = 'cas:'
+# 保留政策：每位會員最新 N 份報告的產物保持為鬆散檔案；其餘超過天數者封存進壓縮包，超過刪除天數者移除 (0 表示永不刪除)
+ARTIFACT_KEEP_LATEST = int(os.environ.get('ARTIFACT_KEEP_LATEST', 3))
+ARTIFACT_PACK_AFTER_DAYS = float(os.environ.get('ARTIFACT_PACK_AFTER_DAYS', 30))
+ARTIFACT_DELETE_AFTER_DAYS = float(os.environ.get('ARTIFACT_DELETE_AFTER_DAYS', 0))
+ARTIFACT_MAX_BYTES = int(os.environ.get('ARTIFACT_MAX_BYTES', 0))  # 超過時由最舊的報告開始移除產物 (0 表示不限制)
+ARTIFACT_PACK_MAX_BYTES = 256 * 1024**2
+ARTIFACT_GC_GRACE_SECONDS = 24 * 3600  # 剛寫入 (可能尚未存進報告) 的物件不回收
+COMPACTION_INTERVAL_SECONDS = int(os.environ.get('COMPACTION_INTERVAL_SECONDS', 3600))
+COMPACTION_BATCH = 500
+
+class FileBlobStore:
+    """將產物寫成目錄下的檔案，參照即檔案路徑"""
+    def __init__(self, root='output'):
+        self.root = root
+
+    def put(self, name, data):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f: f.write(data)
+        os.replace(tmp_path, path)
+        return path
+
+    def get(self, ref):
+        try:
+            with open(ref, 'rb') as f: return f.read()
+        except OSError:
+            return None
+
+    def exists(self, ref):
+        return os.path.exists(ref)
+
+    def delete(self, ref):
+        try: os.remove(ref)
+        except OSError: pass
+        _remove_variants(ref)
+
+class SQLiteBlobStore:
+    """將產物以 BLOB 存在 artifacts 資料表，整個流程不寫入任何檔案"""
+    def put(self, name, data):
+        conn = get_db()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO artifacts (name, data, size, sha256) VALUES (?, ?, ?, ?)',
+                         (name, sqlite3.Binary(data), len(data), hashlib.sha256(data).hexdigest()))
+        return BLOB_REF_PREFIX + name
+
+    def get(self, ref):
+        row = get_db().execute('SELECT data FROM artifacts WHERE name = ?', (ref[len(BLOB_REF_PREFIX):],)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def stat(self, ref):
+        """回傳 (size, sha256, created_at)，不讀取內容"""
+        return get_db().execute('SELECT size, sha256, created_at FROM artifacts WHERE name = ?', (ref[len(BLOB_REF_PREFIX):],)).fetchone()
+
+    def exists(self, ref):
+        return get_db().execute('SELECT 1 FROM artifacts WHERE name = ?', (ref[len(BLOB_REF_PREFIX):],)).fetchone() is not None
+
+    def delete(self, ref):
+        name = ref[len(BLOB_REF_PREFIX):]
+        conn = get_db()
+        with conn:
+            conn.execute('DELETE FROM artifacts WHERE name = ? OR name LIKE ?', (name, f'variants/{os.path.splitext(name)[0]}_%'))
+
+    def evict(self, max_bytes=None, max_age_days=None):
+        """依建立時間與總大小清理 BLOB (最舊者優先)，回傳被刪除的參照"""
+        conn = get_db()
+        rows = conn.execute("SELECT name, size, created_at FROM artifacts WHERE name NOT LIKE 'variants/%' ORDER BY created_at, name").fetchall()
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM artifacts').fetchone()[0]
+        cutoff = (datetime.utcnow() - timedelta(days=max_age_days)).strftime('%Y-%m-%d %H:%M:%S') if max_age_days else None
+        removed, removed_bytes = [], 0
+        for name, size, created_at in rows:
+            if not ((cutoff and created_at < cutoff) or (max_bytes and total > max_bytes)): continue
+            self.delete(BLOB_REF_PREFIX + name)
+            removed.append(BLOB_REF_PREFIX + name); removed_bytes += size; total -= size
+        return removed, removed_bytes, conn.execute('SELECT COALESCE(SUM(size), 0) FROM artifacts').fetchone()[0]
+
+class ContentAddressedStore:
+    """內容定址儲存：物件以 SHA-256 命名並放在兩層分片目錄 (objects/ab/cd/abcd....pdf)，相同內容只存一份；
+    參照只含雜湊，不含目錄，整個 ARTIFACT_ROOT 搬移後設定新路徑即可。舊物件可封存進 packs/ 下的 zip 壓縮包"""
+    @property
+    def root(self):
+        return ARTIFACT_ROOT
+
+    def object_path(self, key):
+        return os.path.join(self.root, 'objects', key[:2], key[2:4], key)
+
+    def variant_path(self, key, variant, fmt):
+        sha = os.path.splitext(key)[0]
+        return os.path.join(self.root, 'variants', sha[:2], f'{sha}_{variant}.{fmt}')
+
+    def put(self, name, data):
+        key = hashlib.sha256(data).hexdigest() + os.path.splitext(name)[1].lower()
+        path = self.object_path(key)
+        conn = get_db()
+        row = conn.execute('SELECT pack FROM artifact_objects WHERE key = ?', (key,)).fetchone()
+        if row is None or (row[0] is None and not os.path.exists(path)):
+            FileBlobStore(os.path.dirname(path)).put(key, data)
+        with conn:
+            conn.execute('''INSERT INTO artifact_objects (key, size, stored_size) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET last_used_at = CURRENT_TIMESTAMP''', (key, len(data), len(data)))
+            if row is not None: _bump_cache_counter(conn, 'artifact_dedup_hits')
+        return CAS_REF_PREFIX + key
+
+    def _pack_of(self, key):
+        row = get_db().execute('SELECT pack FROM artifact_objects WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, ref):
+        key = ref[len(CAS_REF_PREFIX):]
+        try:
+            with open(self.object_path(key), 'rb') as f: return f.read()
+        except OSError:
+            pass
+        pack = self._pack_of(key)
+        if not pack: return None
+        try:
+            with zipfile.ZipFile(os.path.join(self.root, 'packs', pack)) as zf: return zf.read(key)
+        except (OSError, KeyError, zipfile.BadZipFile):
+            return None
+
+    def stat(self, ref):
+        """回傳 (size, sha256, created_at)，不讀取內容"""
+        key = ref[len(CAS_REF_PREFIX):]
+        row = get_db().execute('SELECT size, created_at FROM artifact_objects WHERE key = ?', (key,)).fetchone()
+        return (row[0], os.path.splitext(key)[0], row[1]) if row else None
+
+    def exists(self, ref):
+        key = ref[len(CAS_REF_PREFIX):]
+        return os.path.exists(self.object_path(key)) or self._pack_of(key) is not None
+
+    def delete(self, ref):
+        """直接移除物件 (不檢查其他報告是否共用；一般清理請用 compact_artifacts 的回收)"""
+        key = ref[len(CAS_REF_PREFIX):]
+        conn = get_db()
+        with conn: conn.execute('DELETE FROM artifact_objects WHERE key = ?', (key,))
+        self._remove_loose(key)
+
+    def _remove_loose(self, key):
+        for path in [self.object_path(key)] + [self.variant_path(key, v, f) for v in DASHBOARD_PROFILES for f in IMAGE_MIMETYPES]:
+            try: os.remove(path)
+            except OSError: pass
+
+    def pack(self, keys):
+        """把鬆散物件寫進新的 zip 壓縮包後刪除原檔，回傳 (封存數, 原始位元組, 壓縮後位元組)"""
+        keys = [k for k in keys if os.path.exists(self.object_path(k))]
+        if not keys: return 0, 0, 0
+        pack_dir = os.path.join(self.root, 'packs')
+        os.makedirs(pack_dir, exist_ok=True)
+        name = f'pack-{datetime.utcnow().strftime("%Y%m%d%H%M%S")}-{uuid.uuid4().hex[:8]}.zip'
+        tmp_path = os.path.join(pack_dir, name + '.tmp')
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=9) as zf:
+            for key in keys: zf.write(self.object_path(key), key)
+            infos = {info.filename: info for info in zf.infolist()}
+        os.replace(tmp_path, os.path.join(pack_dir, name))
+        conn = get_db()
+        with conn:
+            conn.executemany('UPDATE artifact_objects SET pack = ?, stored_size = ? WHERE key = ? AND pack IS NULL',
+                             [(name, infos[k].compress_size, k) for k in keys])
+        for key in keys:
+            try: os.remove(self.object_path(key))  # 已渲染的輸出規格保留，封存報告再次瀏覽時不必重新渲染
+            except OSError: pass
+        return len(keys), sum(infos[k].file_size for k in keys), sum(infos[k].compress_size for k in keys)
+
+    def repack(self, min_live_ratio=0.5):
+        """回收後存活比例過低的壓縮包重新打包，釋放已刪除物件佔用的空間，回傳釋放的位元組"""
+        pack_dir, freed = os.path.join(self.root, 'packs'), 0
+        if not os.path.isdir(pack_dir): return 0
+        conn = get_db()
+        live = dict(conn.execute('SELECT pack, SUM(stored_size) FROM artifact_objects WHERE pack IS NOT NULL GROUP BY pack').fetchall())
+        with os.scandir(pack_dir) as it:
+            packs = [(e.name, e.stat().st_size, e.stat().st_mtime) for e in it if e.name.endswith('.zip')]
+        recent = time.time() - ARTIFACT_GC_GRACE_SECONDS
+        for name, size, mtime in packs:
+            # 剛寫好的壓縮包可能還沒記錄進資料庫；死空間太小也不值得重寫
+            if mtime > recent or live.get(name, 0) >= size * min_live_ratio or size - live.get(name, 0) < 1024**2: continue
+            keys = [r[0] for r in conn.execute('SELECT key FROM artifact_objects WHERE pack = ?', (name,))]
+            if keys:
+                with zipfile.ZipFile(os.path.join(pack_dir, name)) as zf:
+                    for key in keys: FileBlobStore(os.path.dirname(self.object_path(key))).put(key, zf.read(key))
+                with conn: conn.execute('UPDATE artifact_objects SET pack = NULL, stored_size = size WHERE pack = ?', (name,))
+                self.pack(keys)
+            os.remove(os.path.join(pack_dir, name))
+            freed += size
+        return freed
+
+_sqlite_blob_store = SQLiteBlobStore()
+_cas_store = ContentAddressedStore()
+
+def artifact_store(output_dir='output'):
+    """目前設定的產物儲存後端 (寫入用)；內容定址儲存一律寫入 ARTIFACT_ROOT"""
+    if ARTIFACT_STORE == 'cas': return _cas_store
+    return _sqlite_blob_store if ARTIFACT_STORE == 'sqlite' else FileBlobStore(output_dir)
+
+def is_blob_ref(ref):
+    return bool(ref) and ref.startswith(BLOB_REF_PREFIX)
+
+def is_cas_ref(ref):
+    return bool(ref) and ref.startswith(CAS_REF_PREFIX)
+
+def is_file_ref(ref):
+    return bool(ref) and not is_blob_ref(ref) and not is_cas_ref(ref)
+
+def _store_for(ref):
+    # 讀取依參照本身決定後端，切換 ARTIFACT_STORE 後舊報告仍可讀取
+    if is_cas_ref(ref): return _cas_store
+    return _sqlite_blob_store if is_blob_ref(ref) else FileBlobStore()
+
+def read_artifact(ref):
+    return _store_for(ref).get(ref) if ref else None
+
+def artifact_exists(ref):
+    return bool(ref) and _store_for(ref).exists(ref)
+
+def delete_artifact(ref):
+    if ref: _store_for(ref).delete(ref)
+
+def artifact_name(ref):
+    if is_blob_ref(ref): return os.path.basename(ref[len(BLOB_REF_PREFIX):])
+    return ref[len(CAS_REF_PREFIX):] if is_cas_ref(ref) else os.path.basename(ref)
+
+def report_filename(patient_id, created_at):
+    return f'health_report_{patient_id}_{format_dt(created_at, "%Y%m%d%H%M%S")}.pdf'
+
+def send_artifact(ref, mimetype=None, as_attachment=False, max_age=None, download_name=None):
+    """以串流回應送出產物；檔案、內容定址物件與 BLOB 都支援 ETag/Last-Modified 條件式請求"""
+    if is_file_ref(ref):
+        return send_file(os.path.abspath(ref), mimetype=mimetype, as_attachment=as_attachment, download_name=download_name, conditional=True, etag=True, max_age=max_age)
+    store = _store_for(ref)
+    if is_cas_ref(ref) and os.path.exists(store.object_path(artifact_name(ref))):
+        return send_file(os.path.abspath(store.object_path(artifact_name(ref))), mimetype=mimetype, as_attachment=as_attachment,
+                         download_name=download_name or artifact_name(ref), conditional=True, etag=os.path.splitext(artifact_name(ref))[0], max_age=max_age)
+    stat = store.stat(ref)
+    if stat is None: abort(404)  # 物件已被回收
+    size, sha256, created_at = stat
+    return send_file(BytesIO(store.get(ref)), mimetype=mimetype or 'application/octet-stream', as_attachment=as_attachment,
+                     download_name=download_name or artifact_name(ref), conditional=True, etag=sha256,
+                     last_modified=datetime.fromisoformat(created_at).replace(tzinfo=timezone.utc), max_age=max_age)
+
+# --- 產物壓縮整理 (保留政策、封存與回收) ---
+def _add_artifact_ref_indexes(conn):
+    # 回收與路徑更新以參照查詢報告/快取
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_reports_pdf_path ON health_reports (pdf_path)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_reports_dashboard_path ON health_reports (dashboard_path)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_render_cache_pdf ON render_cache (pdf_path)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_render_cache_dashboard ON render_cache (dashboard_path)')
+
+def _replace_artifact_refs(conn, mapping):
+    """把報告、快取與寄件匣中的舊參照改成新參照 (呼叫端負責交易)"""
+    for table, columns in (('health_reports', ('pdf_path', 'dashboard_path')), ('render_cache', ('pdf_path', 'dashboard_path')), ('email_outbox', ('pdf_path',))):
+        for column in columns:
+            conn.executemany(f'UPDATE {table} SET {column} = ? WHERE {column} = ?', [(new, old) for old, new in mapping.items()])
+
+def _import_legacy_artifacts(conn, after, limit):
+    """將舊版平面目錄中的檔案匯入內容定址儲存並更新所有參照；只使用報告記錄的路徑 (含 Windows 分隔符號的寫法)，
+    不以同名檔代替，避免把無關的檔案綁到報告上再刪除。
+    依路徑遞增分批 (after 為上一批最後的路徑)，回傳 (匯入數, 找不到的檔案數, 本批最後路徑)"""
+    rows = conn.execute(f'''SELECT DISTINCT path FROM (SELECT pdf_path AS path FROM health_reports UNION ALL SELECT dashboard_path FROM health_reports)
+        WHERE path > ? AND path NOT LIKE '{CAS_REF_PREFIX}%' AND path NOT LIKE '{BLOB_REF_PREFIX}%' ORDER BY path LIMIT ?''', (after, limit)).fetchall()
+    mapping, missing = {}, 0
+    for (path,) in rows:
+        name = os.path.basename(path.replace('\\', '/'))  # 也接受在 Windows 上寫入的路徑
+        source = next((p for p in (path, path.replace('\\', '/')) if os.path.isfile(p)), None)
+        if source is None:
+            missing += 1; continue
+        mapping[path] = (source, _cas_store.put(name, FileBlobStore().get(source)))
+    with conn: _replace_artifact_refs(conn, {old: new for old, (_, new) in mapping.items()})
+    for source, _ in mapping.values():
+        FileBlobStore().delete(source)
+    return len(mapping), missing, rows[-1][0] if rows else None
+
+def _ranked_reports_sql(where):
+    return f'''SELECT id, pdf_path, dashboard_path, created_at FROM (
+        SELECT id, pdf_path, dashboard_path, created_at, ROW_NUMBER() OVER (PARTITION BY patient_id ORDER BY created_at DESC, id DESC) AS rn
+        FROM health_reports WHERE pdf_path IS NOT NULL OR dashboard_path IS NOT NULL) WHERE rn > ? AND {where} ORDER BY created_at, id'''
+
+def _drop_report_artifacts(conn, rows):
+    with conn:
+        conn.executemany('UPDATE health_reports SET pdf_path = NULL, dashboard_path = NULL WHERE id = ?', [(r[0],) for r in rows])
+        # 報告頁與歷史列表的縮圖都取決於產物是否存在
+        conn.executemany('DELETE FROM report_snapshots WHERE report_id = ?', [(r[0],) for r in rows])
+        bump_history_versions(conn, [conn.execute('SELECT patient_id FROM health_reports WHERE id = ?', (r[0],)).fetchone()[0] for r in rows])
+        refs = [(ref, ref) for r in rows for ref in r[1:3] if ref]
+        conn.executemany('DELETE FROM render_cache WHERE pdf_path = ? OR dashboard_path = ?', refs)
+
+def collect_garbage(conn=None, grace_seconds=ARTIFACT_GC_GRACE_SECONDS):
+    """刪除沒有任何報告、快取或待寄郵件引用的內容定址物件，回傳 (物件數, 位元組)"""
+    conn = conn or get_db()
+    cutoff = (datetime.utcnow() - timedelta(seconds=grace_seconds)).strftime('%Y-%m-%d %H:%M:%S')
+    ref = f"'{CAS_REF_PREFIX}' || o.key"
+    rows = conn.execute(f'''SELECT key, stored_size FROM artifact_objects o WHERE last_used_at < ?
+        AND NOT EXISTS (SELECT 1 FROM health_reports WHERE pdf_path = {ref}) AND NOT EXISTS (SELECT 1 FROM health_reports WHERE dashboard_path = {ref})
+        AND NOT EXISTS (SELECT 1 FROM render_cache WHERE pdf_path = {ref}) AND NOT EXISTS (SELECT 1 FROM render_cache WHERE dashboard_path = {ref})
+        AND NOT EXISTS (SELECT 1 FROM email_outbox WHERE status IN ('pending', 'sending') AND pdf_path = {ref})''', (cutoff,)).fetchall()
+    for key, _ in rows: _cas_store.delete(CAS_REF_PREFIX + key)
+    return len(rows), sum(size for _, size in rows)
+
+def compact_artifacts(keep_latest=None, pack_after_days=None, delete_after_days=None, max_bytes=None, grace_seconds=ARTIFACT_GC_GRACE_SECONDS, import_legacy=False):
+    """依保留政策整理內容定址儲存：移除過期報告的產物 → 封存舊物件 → 回收未引用物件 → 重新打包，回傳統計。
+    import_legacy 時先把舊版檔案搬進內容定址儲存並刪除原檔 (不可復原，只由 CLI 或管理 API 明確要求時執行)"""
+    keep_latest = ARTIFACT_KEEP_LATEST if keep_latest is None else int(keep_latest)
+    pack_after_days = ARTIFACT_PACK_AFTER_DAYS if pack_after_days is None else float(pack_after_days)
+    delete_after_days = ARTIFACT_DELETE_AFTER_DAYS if delete_after_days is None else float(delete_after_days)
+    max_bytes = ARTIFACT_MAX_BYTES if max_bytes is None else int(max_bytes)
+    started = time.perf_counter()
+    conn = get_db()
+    def cutoff(days): return (datetime.utcnow() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+    result = {'imported':0, 'missing_legacy':0, 'dropped_reports':0, 'packed_objects':0, 'packed_bytes':0, 'packed_stored_bytes':0}
+    last_path = '' if import_legacy else None
+    while last_path is not None:
+        imported, missing, last_path = _import_legacy_artifacts(conn, last_path, COMPACTION_BATCH)
+        result['imported'] += imported; result['missing_legacy'] += missing
+    if delete_after_days:
+        rows = conn.execute(_ranked_reports_sql('created_at < ?'), (keep_latest, cutoff(delete_after_days))).fetchall()
+        _drop_report_artifacts(conn, rows); result['dropped_reports'] += len(rows)
+    if max_bytes:
+        total = conn.execute('SELECT COALESCE(SUM(stored_size), 0) FROM artifact_objects').fetchone()[0]
+        sizes = dict(conn.execute('SELECT key, stored_size FROM artifact_objects').fetchall())
+        dropped = []
+        for row in conn.execute(_ranked_reports_sql('1'), (keep_latest,)):
+            if total <= max_bytes: break
+            dropped.append(row); total -= sum(sizes.pop(ref[len(CAS_REF_PREFIX):], 0) for ref in row[1:3] if is_cas_ref(ref))
+        _drop_report_artifacts(conn, dropped); result['dropped_reports'] += len(dropped)
+    if pack_after_days:
+        rows = conn.execute(_ranked_reports_sql('created_at < ?'), (keep_latest, cutoff(pack_after_days))).fetchall()
+        sizes = dict(conn.execute('SELECT key, size FROM artifact_objects WHERE pack IS NULL').fetchall())
+        keys = list(dict.fromkeys(ref[len(CAS_REF_PREFIX):] for r in rows for ref in r[1:3] if is_cas_ref(ref) and ref[len(CAS_REF_PREFIX):] in sizes))
+        batch, batch_bytes = [], 0
+        for key in keys + [None]:
+            if key is None or batch_bytes + sizes.get(key, 0) > ARTIFACT_PACK_MAX_BYTES:
+                count, raw, stored = _cas_store.pack(batch)
+                result['packed_objects'] += count; result['packed_bytes'] += raw; result['packed_stored_bytes'] += stored
+                batch, batch_bytes = [], 0
+            if key is not None: batch.append(key); batch_bytes += sizes.get(key, 0)
+    result['collected_objects'], result['collected_bytes'] = collect_garbage(conn, grace_seconds)
+    result['repacked_bytes'] = _cas_store.repack()
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    return result
+
+def get_artifact_stats():
+    conn = get_db()
+    loose_count, loose_bytes = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifact_objects WHERE pack IS NULL').fetchone()
+    packed_count, packed_bytes, packed_stored = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(stored_size), 0) FROM artifact_objects WHERE pack IS NOT NULL').fetchone()
+    packs = conn.execute('SELECT COUNT(DISTINCT pack) FROM artifact_objects WHERE pack IS NOT NULL').fetchone()[0]
+    dedup = conn.execute("SELECT value FROM render_cache_counters WHERE name = 'artifact_dedup_hits'").fetchone()
+    return {'loose_objects':loose_count, 'loose_bytes':loose_bytes, 'packed_objects':packed_count, 'packed_bytes':packed_bytes,
+            'packed_stored_bytes':packed_stored, 'packs':packs, 'dedup_hits':dedup[0] if dedup else 0,
+            'policy':{'keep_latest':ARTIFACT_KEEP_LATEST, 'pack_after_days':ARTIFACT_PACK_AFTER_DAYS, 'delete_after_days':ARTIFACT_DELETE_AFTER_DAYS, 'max_bytes':ARTIFACT_MAX_BYTES}}
+
+class ArtifactCompactor:
+    """背景整理執行緒：定期執行 compact_artifacts (不匯入舊版檔案)；多程序部署時以資料庫租約確保同一時間只有一個程序在整理"""
+    def __init__(self, interval=COMPACTION_INTERVAL_SECONDS):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.last_result = None
+
+    def ensure_started(self):
+        if ARTIFACT_STORE != 'cas' or multiprocessing.parent_process() is not None: return  # 批次渲染的工作程序不整理
+        with self._lock:
+            if self._thread: return
+            self._thread = threading.Thread(target=self._run, name='artifact-compactor', daemon=True)
+            self._thread.start()
+
+    def _acquire_lease(self):
+        conn = get_db()
+        now = time.time()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO artifact_leases (name) VALUES ('compaction')")
+            return conn.execute("UPDATE artifact_leases SET owner = ?, expires_at = ? WHERE name = 'compaction' AND expires_at < ?",
+                                (f'{os.getpid()}', int(now + self.interval), int(now))).rowcount == 1
+
+    def _run(self):
+        while not self._stop.wait(min(60, self.interval) if self.last_result is None else self.interval):
+            try:
+                if self._acquire_lease(): self.last_result = compact_artifacts()
+                else: self.last_result = {}
+            except (sqlite3.Error, OSError) as e:
+                print(f"產物整理失敗: {e}"); self.last_result = {'error':str(e)}
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread: self._thread.join(timeout=5)
+
+artifact_compactor = ArtifactCompactor()
+atexit.register(artifact_compactor.shutdown)
+
+# --- 渲染快取 ---
+RENDER_CACHE_VERSION = 3  # 圖表或 PDF 版面變更時遞增，使舊快取失效
+OUTPUT_MAX_BYTES = int(os.environ.get('OUTPUT_MAX_BYTES', 2 * 1024**3))
+OUTPUT_MAX_AGE_DAYS = float(os.environ.get('OUTPUT_MAX_AGE_DAYS', 90))
+EVICTION_INTERVAL_SECONDS = 300
+_last_eviction = 0.0
+
+def render_cache_key(p_data):
+    """以正規化後的量測資料與版面版本計算內容雜湊"""
+    def norm(v):
+        if isinstance(v, float): return round(v, 4)
+        if isinstance(v, str): return v.strip()
+        return v
+    canonical = {k: norm(v) for k,v in p_data.items()}
+    canonical['_version'] = [RENDER_CACHE_VERSION, DASHBOARD_RENDER_MODE, DASHBOARD_DPI, PDF_MODE, PDF_IMAGE_DPI]
+    # 趨勢圖取自歷史量測：以當天日期與歷史彙總作為指紋，同一天內重送仍可命中
+    canonical['_trend'] = [datetime.utcnow().date().isoformat(), _trend_history(p_data.get('patient_id'))]
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(',',':')).encode('utf-8')).hexdigest()
+
+def _bump_cache_counter(conn, name):
+    conn.execute('INSERT INTO render_cache_counters (name, value) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,))
+
+def lookup_render_cache(cache_key):
+    """回傳快取中的 (dashboard_path, pdf_path)；產物已不存在時視為未命中"""
+    conn = get_db()
+    with conn:
+        row = conn.execute('SELECT dashboard_path, pdf_path FROM render_cache WHERE cache_key = ?', (cache_key,)).fetchone()
+        if row and all(artifact_exists(p) for p in row):
+            conn.execute('UPDATE render_cache SET hits = hits + 1, last_used_at = CURRENT_TIMESTAMP WHERE cache_key = ?', (cache_key,))
+            _bump_cache_counter(conn, 'hits')
+            return row
+        if row: conn.execute('DELETE FROM render_cache WHERE cache_key = ?', (cache_key,))
+        _bump_cache_counter(conn, 'misses')
+        return None
+
+def store_render_cache(cache_key, dashboard_path, pdf_path):
+    conn = get_db()
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO render_cache (cache_key, dashboard_path, pdf_path) VALUES (?, ?, ?)', (cache_key, dashboard_path, pdf_path))
+
+def _local_path(ref):
+    return os.path.abspath(ref.replace('\\', '/'))
+
+def evict_output_dir(output_dir='output', max_bytes=None, max_age_days=None):
+    """依檔案年齡與目錄總大小清理產出檔案 (最久未使用者優先)，回傳清理結果
+
+    只清理渲染快取擁有、且沒有任何報告或待寄郵件引用的檔案；報告仍在使用的 PDF/圖片與其他檔案一律保留。
+    """
+    max_bytes = OUTPUT_MAX_BYTES if max_bytes is None else max_bytes
+    max_age_days = OUTPUT_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    if not os.path.isdir(output_dir): return {'removed_files':0, 'removed_bytes':0}
+    conn = get_db()
+    owned = {_local_path(ref): ref for (ref,) in conn.execute('SELECT dashboard_path FROM render_cache UNION SELECT pdf_path FROM render_cache') if is_file_ref(ref)}
+    referenced = {_local_path(ref) for (ref,) in conn.execute('''SELECT pdf_path FROM health_reports UNION SELECT dashboard_path FROM health_reports
+        UNION SELECT pdf_path FROM email_outbox WHERE status IN ('pending', 'sending')''') if is_file_ref(ref)}
+    files = []
+    with os.scandir(output_dir) as it:
+        for entry in it:
+            if entry.is_file():
+                st = entry.stat()
+                files.append((max(st.st_atime, st.st_mtime), st.st_size, entry.path))
+    files.sort()
+    total = sum(size for _,size,_ in files)
+    cutoff = time.time() - max_age_days * 86400 if max_age_days else None
+    removed, removed_bytes = [], 0
+    for used_at, size, path in files:
+        path = os.path.abspath(path)
+        if path not in owned or path in referenced: continue
+        if not ((cutoff and used_at < cutoff) or (max_bytes and total > max_bytes)): continue
+        try: os.remove(path)
+        except OSError: continue
+        removed.append(owned[path]); removed_bytes += size; total -= size
+        _remove_variants(path)
+    if removed:
+        with conn:
+            conn.executemany('DELETE FROM render_cache WHERE dashboard_path = ? OR pdf_path = ?', [(p, p) for p in removed])
+    return {'removed_files':len(removed), 'removed_bytes':removed_bytes, 'remaining_bytes':total}
+
+def evict_blob_store(max_bytes=None, max_age_days=None):
+    """清理 SQLite 產物儲存，規則與 evict_output_dir 相同"""
+    removed, removed_bytes, total = _sqlite_blob_store.evict(OUTPUT_MAX_BYTES if max_bytes is None else max_bytes,
+                                                             OUTPUT_MAX_AGE_DAYS if max_age_days is None else max_age_days)
+    if removed:
+        conn = get_db()
+        with conn:
+            conn.executemany('DELETE FROM render_cache WHERE dashboard_path = ? OR pdf_path = ?', [(r, r) for r in removed])
+    return {'removed_files':len(removed), 'removed_bytes':removed_bytes, 'remaining_bytes':total}
+
+def evict_cas_store(max_bytes=None, max_age_days=None):
+    """內容定址儲存的清理：移除超過天數未使用的快取項目後，只回收沒有任何引用的物件。
+    報告引用的產物依 ARTIFACT_DELETE_AFTER_DAYS 由 compact_artifacts 處理，max_bytes 不適用"""
+    max_age_days = OUTPUT_MAX_AGE_DAYS if max_age_days is None else float(max_age_days)
+    conn = get_db()
+    if max_age_days:
+        with conn:
+            conn.execute('DELETE FROM render_cache WHERE last_used_at < ?', ((datetime.utcnow() - timedelta(days=max_age_days)).strftime('%Y-%m-%d %H:%M:%S'),))
+    removed, removed_bytes = collect_garbage(conn)
+    remaining = conn.execute('SELECT COALESCE(SUM(stored_size), 0) FROM artifact_objects').fetchone()[0]
+    return {'removed_files':removed, 'removed_bytes':removed_bytes, 'remaining_bytes':remaining}
+
+def _maybe_evict(output_dir):
+    global _last_eviction
+    if ARTIFACT_STORE == 'cas':
+        artifact_compactor.ensure_started(); return
+    if time.time() - _last_eviction < EVICTION_INTERVAL_SECONDS: return
+    _last_eviction = time.time()
+    if ARTIFACT_STORE == 'sqlite': evict_blob_store()
+    else: evict_output_dir(output_dir)
+
+def get_render_cache_stats(output_dir='output'):
+    conn = get_db()
+    counters = dict(conn.execute('SELECT name, value FROM render_cache_counters').fetchall())
+    entries = conn.execute('SELECT COUNT(*) FROM render_cache').fetchone()[0]
+    hits, misses = counters.get('hits', 0), counters.get('misses', 0)
+    files = [e for e in os.scandir(output_dir) if e.is_file()] if os.path.isdir(output_dir) else []
+    blob_count, blob_bytes = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts').fetchone()
+    return {'hits':hits, 'misses':misses, 'hit_rate':round(hits/(hits+misses),4) if hits+misses else 0.0, 'entries':entries,
+            'artifact_store':ARTIFACT_STORE, 'output_files':len(files), 'output_bytes':sum(e.stat().st_size for e in files),
+            'blob_count':blob_count, 'blob_bytes':blob_bytes, 'cas':get_artifact_stats(),
+            'report_snapshots':conn.execute('SELECT COUNT(*) FROM report_snapshots').fetchone()[0], 'history_pages_cached':len(history_page_cache),
+            'max_bytes':OUTPUT_MAX_BYTES, 'max_age_days':OUTPUT_MAX_AGE_DAYS}
+
+_visualizers = {}
+
+def get_visualizer(output_dir='output'):
+    visualizer = _visualizers.get(output_dir)
+    if visualizer is None: visualizer = _visualizers[output_dir] = HealthDataVisualizer(output_dir=output_dir)
+    return visualizer
+
+def _embed_dashboard(pdf, dashboard_image, dashboard_path):
+    """以 fpdf 公開的 image() 放入儀表板 (精簡模式為 'pdf' 輸出規格的 JPEG)；fpdf 1.7 只接受檔名，非本機檔案先寫入暫存檔"""
+    if is_file_ref(dashboard_path) and os.path.isfile(dashboard_path):
+        pdf.image(dashboard_path, x=10, w=PDF_IMAGE_WIDTH_MM); return
+    import tempfile
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(artifact_name(dashboard_path))[1] or '.png') as f:
+        f.write(dashboard_image); f.flush()
+        pdf.image(f.name, x=10, w=PDF_IMAGE_WIDTH_MM)
+
+def render_report_artifacts(p_data, output_dir='output', stage=None, use_cache=True):
+    """產生儀表板圖片與 PDF 並寫入產物儲存，回傳 (dashboard_path, report_path, cache_hit)
+
+    圖表渲染到記憶體、直接嵌入 PDF，PDF 也在記憶體中產生，每個產物只寫入儲存一次。
+    只渲染 PDF 需要的輸出規格 (精簡模式為 'pdf'，舊版模式為 'print')，網頁用的規格等第一次瀏覽時才產生。
+    """
+    if use_cache:
+        with timed('cache_lookup'):
+            cache_key = render_cache_key(p_data)
+            cached = lookup_render_cache(cache_key)
+        if cached: return cached[0], cached[1], True
+    if stage: stage('rendering_dashboard')
+    patient_id = p_data['patient_id']
+    store = artifact_store(output_dir)
+    profile = 'pdf' if PDF_MODE == 'compact' else 'print'
+    with timed('dashboard'):
+        dashboard_image = render_dashboard_profile(p_data, profile, output_dir=output_dir)
+    with timed('artifact_store'):
+        dashboard_path = store.put(f'dashboard_{patient_id}_{datetime.now().strftime("%Y%m%d%H%M%S")}.{DASHBOARD_PROFILES[profile]["format"]}', dashboard_image)
+    scores = score_members([p_data])
+    recs = recommendations_for(scores)
+    if stage: stage('building_pdf')
+    with timed('pdf_fonts'):
+        pdf = new_report_pdf(patient_id)
+    with timed('pdf_layout'):
         pdf.add_page(); 
         pdf.set_font('NotoSansTC','B',14); 
         pdf.cell(0,10,'您的個人化健康建議',ln=1);
-        pdf.set_font('NotoSansTC','',12); pdf.ln(5)
+        pdf.set_font('NotoSansTC','',12); pdf.cell(0,8,f"綜合健康評分：{scores['overall_score'][0]:.1f} / 100",ln=1); pdf.ln(5)
         for r in recs: pdf.multi_cell(0,8,r,border=0); pdf.ln(2)
         pdf.add_page(); pdf.set_font('NotoSansTC','B',14); pdf.cell(0,10,'附錄：健康數據視覺化圖表',ln=1,align='C'); pdf.ln(5)
-        if os.path.exists(dashboard_path): pdf.image(dashboard_path,x=10,w=190)
-        report_path = os.path.join(output_dir,f'health_report_{patient_id}_{datetime.now().strftime("%Y%m%d%H%M%S")}.pdf')
-        pdf.output(report_path)
-        report_id = save_report_to_db(patient_id,p_data,report_path,dashboard_path,None,coach_email,patient_email)
-        res_data = {'status':'success','message':'報告生成成功','report_id':report_id,'patient_name':patient_id,'view_url':f'/view_report/{report_id}','download_url':f'/download_report/{report_id}'}
+    with timed('pdf_image'):
+        # 精簡模式嵌入依頁面尺寸直接渲染的 JPEG，而不是原始解析度的無損 PNG
+        _embed_dashboard(pdf, dashboard_image, dashboard_path)
+    with timed('pdf_output'):
+        pdf_bytes = pdf.output(dest='S').encode('latin1')
+    with timed('artifact_store'):
+        report_path = store.put(f'health_report_{patient_id}_{datetime.now().strftime("%Y%m%d%H%M%S")}.pdf', pdf_bytes)
+    if use_cache:
+        store_render_cache(cache_key, dashboard_path, report_path)
+        _maybe_evict(output_dir)
+    return dashboard_path, report_path, False
+
+def run_report_pipeline(data, progress=None, queue_emails=True):
+    """完整的報告產生流程：儀表板 → PDF → 資料庫 → 郵件，回傳 API 結果
+
+    queue_emails=False 用於工作程序：工作程序收不到寄件欄位，郵件改由主程序依結果中的 _report_path 排入佇列。
+    """
+    def stage(name):
+        if progress is not None: progress(name)
+    validate_report_request(data)
+    coach_email, patient_email = data.get('coach_email'), data.get('patient_email')
+    send_email, sender_email, sender_password = data.get('send_email',False), data.get('sender_email'), data.get('sender_password')
+    p_data = normalize_report_data(data)
+    patient_id = p_data['patient_id']
+    started = time.perf_counter()
+    with timed('render_total'):
+        dashboard_path, report_path, cache_hit = render_report_artifacts(p_data, stage=stage, use_cache=not data.get('no_cache'))
+    render_seconds = time.perf_counter() - started
+    metrics.inc('reports_generated_total', cache='hit' if cache_hit else 'miss')
+    stage('saving')
+    report_id = save_report_to_db(patient_id,p_data,report_path,dashboard_path,None,coach_email,patient_email)
+    res_data = {'status':'success','message':'報告生成成功','report_id':report_id,'patient_name':patient_id,'view_url':f'/view_report/{report_id}','download_url':f'/download_report/{report_id}','cache_hit':cache_hit,
+                'pdf_size_bytes':len(read_artifact(report_path) or b''),'render_seconds':round(render_seconds,3)}
+    if not queue_emails:
+        res_data['_report_path'] = report_path
+    elif send_email:
+        stage('sending_email')
+        with timed('email_queue'):
+            res_data['email_results'] = _queue_report_emails(report_id, sender_email, sender_password, patient_id, report_path, coach_email, patient_email)
+        res_data['deliveries_url'] = f'/api/reports/{report_id}/deliveries'
+    return res_data
+
+def _queue_report_emails(report_id, sender_email, sender_password, patient_id, report_path, coach_email, patient_email):
+    recipients = [(t, e) for t, e in (("coach", coach_email), ("patient", patient_email)) if e]
+    return mail_sender.enqueue(report_id, patient_id, report_path, sender_email, sender_password, recipients) if recipients else []
+
+# --- 批次報告產生 ---
+BATCH_MAX_MEMBERS = int(os.environ.get('BATCH_MAX_MEMBERS', 1000))
+
+def parse_batch_members(text, fmt='json'):
+    """解析批次輸入 (JSON 陣列/物件或 CSV)，回傳會員量測資料清單"""
+    if fmt == 'csv':
+        return [{k.strip(): (v.strip() if isinstance(v, str) else v) for k,v in row.items() if k} for row in csv.DictReader(StringIO(text))]
+    payload = json.loads(text) if isinstance(text, str) else text
+    members = payload.get('members') if isinstance(payload, dict) else payload
+    if not isinstance(members, list):
+        raise ReportError("批次資料必須是會員清單或包含 members 欄位的物件", 400)
+    return members
+
+def lookup_members(patient_ids):
+    """從 members/coaches 表查詢會員姓名與預設收件人"""
+    if not patient_ids: return {}
+    conn = get_db()
+    found = {}
+    ids = list(patient_ids)
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i+500]
+        rows = conn.execute(f'SELECT m.patient_id, m.name, m.email, c.email FROM members m LEFT JOIN coaches c ON m.coach_id = c.id WHERE m.patient_id IN ({",".join("?"*len(chunk))})', chunk).fetchall()
+        found.update({r[0]: {'name':r[1], 'patient_email':r[2], 'coach_email':r[3]} for r in rows})
+    return found
+
+def save_reports_to_db(rows):
+    """在單一交易中批次寫入報告，rows 為 save_report_to_db 參數的 tuple，回傳報告ID清單"""
+    conn = get_db()
+    with timed('db_save'), conn:
+        ids = []
+        for patient_id, report_data, pdf_path, dashboard_path, table_path, coach_email, patient_email in rows:
+            cursor = conn.execute(
+                'INSERT INTO health_reports (patient_id, report_data, pdf_path, dashboard_path, table_path, coach_email, patient_email) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (patient_id, json.dumps(report_data), pdf_path, dashboard_path, table_path, coach_email, patient_email))
+            ids.append(cursor.lastrowid)
+            _insert_measurement(conn, cursor.lastrowid, patient_id, report_data)
+        update_member_summary(conn, [(row[0], report_id, row[1]) for row, report_id in zip(rows, ids)])
+        bump_history_versions(conn, [row[0] for row in rows])
+    return ids
+
+def _render_batch_item(p_data):
+    """批次的渲染階段 (可在工作程序中執行)，回傳 (路徑, 耗時) 或錯誤訊息"""
+    started = time.perf_counter()
+    with metrics.capture() as events:
+        try:
+            with timed('render_total'):
+                dashboard_path, report_path, cache_hit = render_report_artifacts(p_data)
+            metrics.inc('reports_generated_total', cache='hit' if cache_hit else 'miss')
+            return {'dashboard_path':dashboard_path, 'report_path':report_path, 'cache_hit':cache_hit, 'render_seconds':time.perf_counter()-started,
+                    'pdf_size_bytes':len(read_artifact(report_path) or b''), 'metrics':events}
+        except Exception as e:
+            return {'error':str(e), 'render_seconds':time.perf_counter()-started, 'metrics':events}
+
+def run_batch_pipeline(members, executor=None, send_email=False, sender_email=None, sender_password=None):
+    """批次產生報告：驗證 → 渲染/PDF (串流) → 單一交易寫入 → 郵件"""
+    started = time.perf_counter()
+    if len(members) > BATCH_MAX_MEMBERS:
+        raise ReportError(f"單次批次最多 {BATCH_MAX_MEMBERS} 位會員", 400)
+    if send_email and (not sender_email or not sender_password):
+        raise ReportError("需提供寄件Email和密碼", 400)
+    results, pending = [], []
+    known = lookup_members({str(m.get('patient_id')) for m in members if isinstance(m, dict) and m.get('patient_id')})
+    for index, member in enumerate(members):
+        result = {'index':index, 'patient_id':member.get('patient_id') if isinstance(member, dict) else None}
+        results.append(result)
+        try:
+            if not isinstance(member, dict) or not member.get('patient_id'): raise ValueError("缺少會員ID")
+            p_data = normalize_report_data(member)
+        except (ValueError, TypeError) as e:
+            result.update(status='error', message=f"資料格式錯誤: {e}")
+            continue
+        info = known.get(p_data['patient_id'], {})
+        result.update(member_name=info.get('name'), member_found=bool(info))
+        pending.append((result, p_data, member.get('coach_email') or info.get('coach_email'), member.get('patient_email') or info.get('patient_email')))
+    # 渲染在工作程序中進行，主程序依序取回結果後交給資料庫階段
+    rendered = executor.map(_render_batch_item, [p for _,p,_,_ in pending]) if executor else map(_render_batch_item, [p for _,p,_,_ in pending])
+    rows, row_results, render_seconds = [], [], 0.0
+    for (result, p_data, coach_email, patient_email), artifacts in zip(pending, rendered):
+        render_seconds += artifacts['render_seconds']
+        metrics.replay(artifacts.pop('metrics', None))  # 工作程序的指標併入本程序
+        if 'error' in artifacts:
+            result.update(status='error', message=artifacts['error'])
+            continue
+        rows.append((p_data['patient_id'], p_data, artifacts['report_path'], artifacts['dashboard_path'], None, coach_email, patient_email))
+        row_results.append((result, artifacts, coach_email, patient_email))
+    render_done = time.perf_counter()
+    report_ids = save_reports_to_db(rows) if rows else []
+    db_done = time.perf_counter()
+    for (result, artifacts, coach_email, patient_email), report_id in zip(row_results, report_ids):
+        result.update(status='success', report_id=report_id, cache_hit=artifacts['cache_hit'], pdf_size_bytes=artifacts['pdf_size_bytes'], view_url=f'/view_report/{report_id}', download_url=f'/download_report/{report_id}')
         if send_email:
-            email_res = []
-            if coach_email: success,msg=send_email_report(sender_email,sender_password,coach_email,patient_id,report_path,"coach"); email_res.append({"recipient":"coach","status":success,"message":msg})
-            if patient_email: success,msg=send_email_report(sender_email,sender_password,patient_email,patient_id,report_path,"patient"); email_res.append({"recipient":"patient","status":success,"message":msg})
-            res_data['email_results'] = email_res
-        return jsonify(res_data), 200
+            result['email_results'] = _queue_report_emails(report_id, sender_email, sender_password, result['patient_id'], artifacts['report_path'], coach_email, patient_email)
+    finished = time.perf_counter()
+    succeeded = sum(1 for r in results if r.get('status') == 'success')
+    return {'status':'success' if succeeded == len(results) else 'partial' if succeeded else 'error',
+            'total':len(results), 'succeeded':succeeded, 'failed':len(results)-succeeded, 'results':results,
+            'timing':{'total_seconds':round(finished-started,3), 'render_pdf_wall_seconds':round(render_done-started,3),
+                      'render_pdf_cpu_seconds':round(render_seconds,3), 'db_seconds':round(db_done-render_done,3),
+                      'email_seconds':round(finished-db_done,3),
+                      'avg_seconds_per_member':round((finished-started)/len(results),3) if results else 0}}
+
+# --- 量測資料批次匯入 (穿戴裝置/健身器材匯出的 CSV 或 JSON Lines) ---
+# 逐行串流解析，每 IMPORT_CHUNK_ROWS 筆驗證、比對會員並在單一交易中寫入，記憶體用量與檔案大小無關
+IMPORT_CHUNK_ROWS = int(os.environ.get('IMPORT_CHUNK_ROWS', 5000))
+IMPORT_MAX_ERRORS = 100  # 摘要中保留的錯誤明細筆數上限
+IMPORT_EARLIEST_MEASURED_AT = datetime(2000, 1, 1)  # 早於此時間的量測 (多半是時間戳單位或格式錯誤) 視為無效
+IMPORT_MAX_FUTURE_SKEW_SECONDS = int(os.environ.get('IMPORT_MAX_FUTURE_SKEW_SECONDS', 600))  # 容許裝置時鐘超前的秒數
+IMPORT_FIELD_ALIASES = {
+    'member_id':'patient_id', 'user_id':'patient_id', 'timestamp':'measured_at', 'time':'measured_at', 'date':'measured_at',
+    'datetime':'measured_at', 'hr':'heart_rate', 'bpm':'heart_rate', 'resting_heart_rate':'heart_rate', 'weight_kg':'weight',
+    'height_cm':'height', 'bp':'blood_pressure', 'exercise_minutes':'exercise_duration', 'active_minutes':'exercise_duration',
+}
+IMPORT_NUMERIC_FIELDS = ('heart_rate', 'weight', 'height', 'bmi', 'systolic', 'diastolic', 'exercise_duration')
+
+def iter_import_records(stream, fmt='csv'):
+    """逐筆讀取文字串流，產生 (行號, 原始欄位 dict)；JSON Lines 解析失敗的行以 ValueError 物件代替"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, {k.strip().lower(): v for k, v in row.items() if k}
+        return
+    for line_no, line in enumerate(stream, start=1):
+        if not line.strip(): continue
+        try:
+            row = json.loads(line)
+            yield line_no, ({str(k).strip().lower(): v for k, v in row.items()} if isinstance(row, dict) else ValueError('每行必須是 JSON 物件'))
+        except ValueError as e:
+            yield line_no, ValueError(f'JSON 格式錯誤: {e}')
+
+def _parse_measured_at(value):
+    """ISO 8601 或 Unix 時間戳 (秒/毫秒) 轉為 UTC 'YYYY-MM-DD HH:MM:SS'；缺少、過早或超過現在 (含容許偏差) 的時間拋出 ValueError"""
+    if value in (None, '') or (isinstance(value, str) and not value.strip()): raise ValueError('缺少量測時間')
+    earliest, latest = IMPORT_EARLIEST_MEASURED_AT, datetime.utcnow() + timedelta(seconds=IMPORT_MAX_FUTURE_SKEW_SECONDS)
+    moment, text = None, str(value).strip()
+    numeric = isinstance(value, (int, float)) or text.replace('.', '', 1).isdigit()
+    if numeric:
+        seconds = float(value)
+        if seconds > 1e11: seconds /= 1000
+        # 只接受落在合理範圍內的時間戳；'20250101' 之類的純數字日期改以 ISO 格式解析
+        if earliest.replace(tzinfo=timezone.utc).timestamp() <= seconds <= latest.replace(tzinfo=timezone.utc).timestamp():
+            moment = datetime.fromtimestamp(seconds, timezone.utc)
+    if moment is None:
+        try: moment = datetime.fromisoformat(text)
+        except ValueError: raise ValueError(f'量測時間{"超出合理範圍" if numeric else "格式錯誤"}: {value!r}') from None
+    if moment.tzinfo: moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    if moment < earliest: raise ValueError(f'量測時間早於 {earliest:%Y-%m-%d}: {value!r}')
+    if moment > latest: raise ValueError(f'量測時間晚於現在: {value!r}')
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+def normalize_measurement_row(row):
+    """驗證並整理一筆匯入資料，格式錯誤時拋出 ValueError"""
+    if isinstance(row, ValueError): raise row
+    row = {IMPORT_FIELD_ALIASES.get(k, k): v for k, v in row.items()}
+    patient_id = str(row.get('patient_id') or '').strip()
+    if not patient_id: raise ValueError('缺少會員ID')
+    record = {'patient_id':patient_id, 'measured_at':_parse_measured_at(row.get('measured_at'))}
+    for key in IMPORT_NUMERIC_FIELDS:
+        value = row.get(key)
+        try: record[key] = float(value) if value not in (None, '') else None
+        except (TypeError, ValueError): raise ValueError(f'{key} 不是數字: {value!r}') from None
+        if record[key] is not None and (record[key] < 0 or record[key] != record[key]): raise ValueError(f'{key} 數值無效: {value!r}')
+    if row.get('blood_pressure') not in (None, '') and record['systolic'] is None:
+        record['systolic'], record['diastolic'] = parse_blood_pressure(str(row['blood_pressure']).replace(' ', ''))
+        if record['systolic'] is None: raise ValueError(f"血壓格式錯誤: {row['blood_pressure']!r}")
+    if record['bmi'] is None and record['weight'] and record['height']:
+        record['bmi'] = round(record['weight'] / (record['height'] / 100) ** 2, 1)
+    if all(record[key] is None for key in IMPORT_NUMERIC_FIELDS): raise ValueError('沒有任何量測值')
+    return record
+
+def _import_chunk(conn, records, known, unknown_members, summary):
+    """比對會員後在單一交易中寫入一批量測；已存在的 (會員, 時間) 視為重複略過"""
+    ids = {r['patient_id'] for r in records} - known
+    if ids:
+        known.update(lookup_members(ids))
+        missing = ids - known
+        if missing and unknown_members == 'create':
+            with conn: conn.executemany('INSERT OR IGNORE INTO members (patient_id, name) VALUES (?, ?)', [(pid, pid) for pid in sorted(missing)])
+            known.update(missing); summary['members_created'] += len(missing)
+    inserted = []
+    with timed('db_import'), conn:
+        for record in records:
+            if record['patient_id'] not in known:
+                summary['unknown_member'] += 1; continue
+            measured_at = record['measured_at']
+            cursor = conn.execute(
+                '''INSERT INTO measurements (patient_id, measured_at, heart_rate, weight, height, bmi, systolic, diastolic, exercise_duration)
+                   SELECT ?, ?, ?, ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM measurements WHERE patient_id = ? AND measured_at = ?)''',
+                (record['patient_id'], measured_at, *(record[k] for k in IMPORT_NUMERIC_FIELDS), record['patient_id'], measured_at))
+            if cursor.rowcount: inserted.append((record, measured_at))
+            else: summary['duplicates'] += 1
+        update_member_summary(conn, [(r['patient_id'], None, dict(r, blood_pressure=f"{r['systolic']:.0f}/{r['diastolic']:.0f}" if r['systolic'] is not None and r['diastolic'] is not None else None))
+                                     for r, _ in inserted], [at for _, at in inserted])
+    summary['inserted'] += len(inserted)
+    metrics.inc('measurements_imported_total', len(inserted))
+
+def validate_import_options(fmt, unknown_members):
+    if fmt not in ('csv', 'jsonl'): raise ReportError(f'不支援的匯入格式: {fmt}', 400)
+    if unknown_members not in ('skip', 'create'): raise ReportError('unknown_members 必須是 skip 或 create', 400)
+
+def iter_import_progress(stream, fmt='csv', unknown_members='skip', chunk_size=IMPORT_CHUNK_ROWS):
+    """逐批匯入並在每批寫入後產生目前的摘要 (同一個 dict)；unknown_members='skip' 略過不存在的會員，'create' 自動建立"""
+    validate_import_options(fmt, unknown_members)
+    started = time.perf_counter()
+    summary = {'rows':0, 'inserted':0, 'duplicates':0, 'invalid':0, 'unknown_member':0, 'members_created':0, 'chunks':0, 'errors':[]}
+    conn, known, records = get_db(), set(), iter_import_records(stream, fmt)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk: break
+        valid = []
+        for line_no, row in chunk:
+            try: valid.append(normalize_measurement_row(row))
+            except ValueError as e:
+                summary['invalid'] += 1
+                if len(summary['errors']) < IMPORT_MAX_ERRORS: summary['errors'].append({'line':line_no, 'message':str(e)})
+        if valid: _import_chunk(conn, valid, known, unknown_members, summary)
+        summary['rows'] += len(chunk); summary['chunks'] += 1
+        summary['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+        yield summary
+    summary['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+    summary['rows_per_second'] = round(summary['rows'] / summary['elapsed_seconds'], 1) if summary['elapsed_seconds'] else None
+    summary['finished'] = True
+    yield summary
+
+def import_measurements(stream, fmt='csv', unknown_members='skip', chunk_size=IMPORT_CHUNK_ROWS, progress=None):
+    """從文字串流批次匯入量測並回傳最終摘要；progress(summary) 於每批寫入後呼叫"""
+    for summary in iter_import_progress(stream, fmt, unknown_members, chunk_size):
+        if progress and not summary.get('finished'): progress(summary)
+    return summary
+
+def open_import_file(path):
+    """以文字串流開啟匯入檔 (支援 .gz)，依副檔名判斷格式"""
+    name = path.lower()[:-3] if path.lower().endswith('.gz') else path.lower()
+    fmt = 'jsonl' if name.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+    opener = gzip.open if path.lower().endswith('.gz') else open
+    return opener(path, 'rt', encoding='utf-8-sig', newline=''), fmt
+
+# --- 非同步報告工作佇列 ---
+EMAIL_CREDENTIAL_FIELDS = ('send_email', 'sender_email', 'sender_password')  # 不傳給工作程序的欄位
+REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', os.cpu_count() or 1))
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', 3600))
+
+def _run_report_job(job_id, data, progress):
+    """在工作程序中執行報告流程 (每個程序擁有獨立的 matplotlib/字型狀態)；郵件由主程序排入佇列"""
+    def report(stage): progress[job_id] = stage
+    with metrics.capture() as events:
+        try:
+            result = run_report_pipeline(data, report, queue_emails=False)
+        except ReportError as e:
+            result = {'status':'error','message':str(e),'status_code':e.status_code}
+    result['_metrics'] = events
+    return result
+
+class ReportJobQueue:
+    """以程序池平行產生報告，並在主程序追蹤每個工作的狀態"""
+    def __init__(self, max_workers):
+        self.max_workers = max(1, max_workers)
+        self._executor = None
+        self._manager = None
+        self._progress = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # spawn：工作程序不繼承主程序的 pyplot 狀態與 Flask 執行緒
+        ctx = multiprocessing.get_context('spawn')
+        if self._manager is None:
+            self._manager = ctx.Manager()
+            self._progress = self._manager.dict()
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=ctx)
+
+    def executor(self):
+        with self._lock:
+            self._ensure_started()
+            return self._executor
+
+    def _reset_broken(self, executor):
+        """工作程序異常結束 (例如被 OOM 終止) 後程序池無法再使用：丟棄它，下一次 submit 重新建立 (呼叫端持有鎖)"""
+        if self._executor is executor:
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, data):
+        # 郵件帳密只留在主程序，工作完成後由 _mark_finished 排入寄送佇列；傳給工作程序的資料不含寄件欄位
+        job_data = {k: v for k, v in data.items() if k not in EMAIL_CREDENTIAL_FIELDS}
+        with self._lock:
+            self._prune()
+            job_id = uuid.uuid4().hex
+            self._ensure_started()
+            self._progress[job_id] = 'queued'
+            for attempt in range(2):
+                self._ensure_started()
+                executor = self._executor
+                try:
+                    future = executor.submit(_run_report_job, job_id, job_data, self._progress)
+                    break
+                except BrokenProcessPool:
+                    self._reset_broken(executor)
+                    if attempt: raise
+            self._jobs[job_id] = {'future':future, 'executor':executor, 'patient_id':data.get('patient_id','未知'), 'submitted_at':time.time(), 'finished_at':None,
+                                  'email':data if data.get('send_email') else None}
+        # 在鎖外註冊：工作已完成時回呼會立即在本執行緒執行，而 _mark_finished 需要取得同一把鎖
+        future.add_done_callback(lambda f, job_id=job_id: self._mark_finished(job_id))
+        return job_id
+
+    def _mark_finished(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None: return
+            future = job['future']
+            exc = None if future.cancelled() else future.exception()
+            if isinstance(exc, BrokenProcessPool): self._reset_broken(job['executor'])
+            email = job.pop('email', None)
+        if not future.cancelled() and exc is None:
+            result = future.result()
+            metrics.replay(result.pop('_metrics', None))
+            report_path = result.pop('_report_path', None)
+            if email and result.get('status') == 'success':
+                try:
+                    result['email_results'] = _queue_report_emails(result['report_id'], email.get('sender_email'), email.get('sender_password'), result['patient_name'],
+                                                                   report_path, email.get('coach_email'), email.get('patient_email'))
+                    result['deliveries_url'] = f'/api/reports/{result["report_id"]}/deliveries'
+                except Exception as e:
+                    result['email_results'] = [{'status':'error', 'message':f'郵件排入佇列失敗: {e}'}]
+        # 郵件排入佇列後才標記完成：查詢不會讀到正在補上寄送資訊的結果
+        with self._lock: job['finished_at'] = time.time()
+
+    def active_count(self):
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job['finished_at'])
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [j for j,job in self._jobs.items() if job['finished_at'] and job['finished_at'] < cutoff]:
+            del self._jobs[job_id]
+            self._progress.pop(job_id, None)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None: return None
+        future = job['future']
+        if job['finished_at']:
+            exc = CancelledError('工作程序異常結束，工作已取消') if future.cancelled() else future.exception()
+            result = None if exc else {k:v for k,v in future.result().items() if not k.startswith('_')}
+            state = 'failed' if exc or result.get('status') != 'success' else 'succeeded'
+            stage = 'done'
+        else:
+            state = 'running' if future.running() or future.done() else 'queued'
+            exc, result, stage = None, None, self._progress.get(job_id, state)
+        info = {'job_id':job_id, 'state':state, 'stage':stage, 'patient_id':job['patient_id'],
+                'submitted_at':datetime.fromtimestamp(job['submitted_at']).isoformat(timespec='seconds'),
+                'elapsed_seconds':round((job['finished_at'] or time.time()) - job['submitted_at'], 3)}
+        if exc: info['error'] = str(exc)
+        elif result and result.get('status') != 'success': info['error'] = result.get('message')
+        return info, result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        if self._manager is not None:
+            self._manager.shutdown()
+
+job_queue = ReportJobQueue(REPORT_WORKERS)
+atexit.register(job_queue.shutdown)
+
+@app.route('/generate_report', methods=['POST'])
+def generate_report():
+    try:
+        data = request.get_json()
+        async_mode = request.args.get('async') in ('1','true') or (isinstance(data, dict) and bool(data.get('async')))
+        if async_mode:
+            validate_report_request(data)
+            job_id = job_queue.submit(data)
+            return jsonify({'status':'queued','job_id':job_id,'status_url':f'/jobs/{job_id}','result_url':f'/jobs/{job_id}/result'}), 202
+        return jsonify(run_report_pipeline(data)), 200
+    except ReportError as e:
+        return jsonify({"status":"error","message":str(e)}), e.status_code
     except Exception as e:
         traceback_str = traceback.format_exc(); print(traceback_str)
         return jsonify({"status":"error","message":str(e),"traceback":traceback_str}), 500
 
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    found = job_queue.get(job_id)
+    if found is None: return jsonify({'status':'error','message':'工作不存在或已過期'}), 404
+    info, _ = found
+    return jsonify(info), 200
 
-# --- 路由 (修改 HTML 格式) ---
-@app.route('/view_report/<int:report_id>')
-def view_report(report_id):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM health_reports WHERE id = ?', (report_id,))
-    report = cursor.fetchone()
-    conn.close()
-    if not report:
-        return "報告不存在", 404
-    
-    dashboard_base64 = ""
-    report_data = json.loads(report[2])
-    if report[4] and os.path.exists(report[4]):
-        with open(report[4], 'rb') as img_file:
-            dashboard_base64 = base64.b64encode(img_file.read()).decode('utf-8')
-
-    # --- HTML 模板整理開始 ---
-    html_template = """
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    found = job_queue.get(job_id)
+    if found is None: return jsonify({'status':'error','message':'工作不存在或已過期'}), 404
+    info, result = found
+    if info['state'] in ('queued','running'): return jsonify(info), 202
+    if info['state'] == 'failed':
+        return jsonify({'status':'error','message':info.get('error'),'job_id':job_id}), (result or {}).get('status_code', 500)
+    return jsonify(result), 200
+
+
+@app.route('/generate_reports/batch', methods=['POST'])
+def generate_reports_batch():
+    """批次產生報告：JSON (members 清單) 或 CSV (上傳檔案或 text/csv 內容)
+
+    text/csv 內容的寄件帳密以 X-Sender-Email / X-Sender-Password 標頭傳入；密碼不接受放在網址 (會留在存取紀錄中)。
+    """
+    try:
+        if 'sender_password' in request.args:
+            raise ReportError("sender_password 不可放在網址參數中，請改用 X-Sender-Password 標頭或請求內容", 400)
+        upload = request.files.get('file')
+        if upload is not None:
+            fmt = 'csv' if upload.filename.lower().endswith('.csv') else 'json'
+            members, options = parse_batch_members(upload.read().decode('utf-8-sig'), fmt), request.form
+        elif request.mimetype == 'text/csv':
+            members = parse_batch_members(request.get_data(as_text=True), 'csv')
+            options = dict(request.args.to_dict(), sender_email=request.headers.get('X-Sender-Email', request.args.get('sender_email')),
+                           sender_password=request.headers.get('X-Sender-Password'))
+        else:
+            payload = request.get_json(silent=True)
+            if payload is None: raise ReportError("請提供 JSON 或 CSV 格式的會員資料", 400)
+            members, options = parse_batch_members(payload), payload if isinstance(payload, dict) else {}
+        send_email = str(options.get('send_email', False)).lower() in ('1','true')
+        executor = job_queue.executor() if REPORT_WORKERS > 1 else None
+        result = run_batch_pipeline(members, executor, send_email, options.get('sender_email'), options.get('sender_password'))
+        return jsonify(result), 200
+    except ReportError as e:
+        return jsonify({"status":"error","message":str(e)}), e.status_code
+    except (ValueError, csv.Error) as e:
+        return jsonify({"status":"error","message":f"批次資料解析失敗: {e}"}), 400
+    except Exception as e:
+        traceback_str = traceback.format_exc(); print(traceback_str)
+        return jsonify({"status":"error","message":str(e),"traceback":traceback_str}), 500
+
+
+@app.route('/api/cache/stats')
+def render_cache_stats():
+    return jsonify(get_render_cache_stats()), 200
+
+@app.route('/api/cache/evict', methods=['POST'])
+def render_cache_evict():
+    data = request.get_json(silent=True) or {}
+    try:
+        evict = {'sqlite':evict_blob_store, 'cas':evict_cas_store}.get(ARTIFACT_STORE, evict_output_dir)
+        result = evict(max_bytes=data.get('max_bytes'), max_age_days=data.get('max_age_days'))
+    except (TypeError, ValueError) as e:
+        return jsonify({'status':'error','message':f'參數格式錯誤: {e}'}), 400
+    return jsonify(dict(result, status='success')), 200
+
+@app.route('/api/artifacts/compact', methods=['POST'])
+def artifacts_compact():
+    """立即執行產物整理，可覆寫 keep_latest、pack_after_days、delete_after_days、max_bytes；{"import_legacy": true} 時匯入舊版檔案"""
+    data = request.get_json(silent=True) or {}
+    try:
+        result = compact_artifacts(data.get('keep_latest'), data.get('pack_after_days'), data.get('delete_after_days'), data.get('max_bytes'),
+                                   import_legacy=data.get('import_legacy') is True)
+    except (TypeError, ValueError) as e:
+        return jsonify({'status':'error','message':f'參數格式錯誤: {e}'}), 400
+    return jsonify(dict(result, status='success', stats=get_artifact_stats())), 200
+
+@app.route('/api/cohort/scores', methods=['GET', 'POST'])
+def cohort_scores():
+    """族群評分：GET 依每位會員最新量測 (?coach_id=、可重複的 ?patient_id=)；POST {"members":[...]} 直接評分傳入的資料"""
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True)
+            members = data.get('members') if isinstance(data, dict) else data
+            if not isinstance(members, list): return jsonify({'status':'error','message':'需提供 members 陣列'}), 400
+            if len(members) > BATCH_MAX_MEMBERS * 10: return jsonify({'status':'error','message':f'單次最多 {BATCH_MAX_MEMBERS * 10} 位會員'}), 400
+            result = score_members([normalize_report_data(m) for m in members])
+        else:
+            result = score_latest_measurements(request.args.getlist('patient_id') or None, request.args.get('coach_id', type=int))
+    except (ValueError, TypeError, AttributeError) as e:
+        return jsonify({'status':'error','message':f'資料格式錯誤: {e}'}), 400
+    rows = cohort_rows(result)
+    if 'measured_at' in result:
+        for row, measured_at in zip(rows, result['measured_at']): row['measured_at'] = measured_at
+    return jsonify({'status':'success', 'summary':cohort_summary(result), 'members':rows}), 200
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 文字格式：本程序的延遲直方圖與計數器，加上資料庫中跨程序累計的快取與寄件匣狀態"""
+    conn = get_db()
+    counters = dict(conn.execute('SELECT name, value FROM render_cache_counters').fetchall())
+    lines = ['# HELP render_cache_lookups_total 渲染快取查詢次數 (所有程序)', '# TYPE render_cache_lookups_total counter']
+    lines += [f'render_cache_lookups_total{{result="{result}"}} {counters.get(name, 0)}' for result, name in (('hit','hits'), ('miss','misses'))]
+    lines += ['# HELP email_outbox_messages 寄件匣中各狀態的郵件數', '# TYPE email_outbox_messages gauge']
+    lines += [f'email_outbox_messages{{status="{status}"}} {count}' for status, count in conn.execute('SELECT status, COUNT(*) FROM email_outbox GROUP BY status')]
+    lines += ['# HELP report_jobs_active 尚未完成的非同步報告工作數', '# TYPE report_jobs_active gauge', f'report_jobs_active {job_queue.active_count()}']
+    return Response(metrics.render() + '\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/measurements/import', methods=['POST'])
+def import_measurements_route():
+    """批次匯入量測：請求本文或 multipart 的 file 欄位；?format=csv|jsonl、?unknown_members=skip|create、?progress=1 以 NDJSON 串流回報進度"""
+    upload = request.files.get('file')
+    raw, name = (upload.stream, upload.filename or '') if upload else (request.stream, '')
+    fmt = request.args.get('format') or ('jsonl' if name.lower().endswith(('.jsonl', '.ndjson')) or 'ndjson' in (request.mimetype or '') or 'jsonl' in (request.mimetype or '') else 'csv')
+    unknown_members = request.args.get('unknown_members', 'skip')
+    stream = TextIOWrapper(gzip.GzipFile(fileobj=raw) if request.headers.get('Content-Encoding') == 'gzip' or name.lower().endswith('.gz') else raw, encoding='utf-8-sig', newline='')
+    try:
+        validate_import_options(fmt, unknown_members)
+        if request.args.get('progress') in ('1', 'true'):
+            def generate():
+                try:
+                    for summary in iter_import_progress(stream, fmt, unknown_members):
+                        line = dict(summary, status='success') if summary.get('finished') else {k: v for k, v in summary.items() if k != 'errors'}
+                        yield json.dumps(line, ensure_ascii=False) + '\n'
+                except (UnicodeDecodeError, csv.Error, OSError) as e:
+                    yield json.dumps({'status':'error', 'message':f'無法讀取匯入資料: {e}'}, ensure_ascii=False) + '\n'
+            return Response(stream_with_context(generate()), content_type='application/x-ndjson')
+        summary = import_measurements(stream, fmt, unknown_members)
+    except ReportError as e:
+        return jsonify({'status':'error','message':str(e)}), e.status_code
+    except (UnicodeDecodeError, csv.Error, OSError) as e:
+        return jsonify({'status':'error','message':f'無法讀取匯入資料: {e}'}), 400
+    return jsonify(dict(summary, status='success')), 200
+
+@app.route('/api/reports/search')
+def report_search():
+    """指標門檻查詢：?bmi_min=27&exercise_duration_max=150、?blood_pressure_min=140/90&created_from=2025-06-01，
+    另有 created_to、patient_id、coach_id、sort (預設 -created_at)、cursor、limit"""
+    try:
+        reports, next_cursor = search_reports(request.args, request.args.get('sort', '-created_at'), request.args.get('cursor'), request.args.get('limit', REPORT_PAGE_SIZE))
+    except ValueError as e:
+        return jsonify({'status':'error','message':f'查詢參數錯誤: {e}'}), 400
+    return jsonify({'status':'success', 'reports':reports, 'next_cursor':next_cursor}), 200
+
+@app.route('/api/patients/<patient_id>/trend')
+def patient_trend(patient_id):
+    """會員量測趨勢：?start=&end= (ISO 日期)，bucket=day|week|month|raw|auto"""
+    start, end, bucket = request.args.get('start'), request.args.get('end'), request.args.get('bucket', 'auto')
+    for v in (start, end):
+        if v:
+            try: datetime.fromisoformat(v)
+            except ValueError: return jsonify({'status':'error','message':f'日期格式錯誤: {v}'}), 400
+    if bucket == 'auto': bucket = pick_trend_bucket(start, end)
+    if bucket not in TREND_BUCKETS and bucket != 'raw':
+        return jsonify({'status':'error','message':f'不支援的 bucket: {bucket}'}), 400
+    points = get_trend(patient_id, start, end, bucket)
+    return jsonify({'patient_id':patient_id, 'bucket':bucket, 'start':start, 'end':end, 'points':points}), 200
+
+
+@app.route('/api/reports/<int:report_id>/deliveries')
+def report_deliveries(report_id):
+    return jsonify({'report_id':report_id, 'deliveries':get_deliveries(report_id)}), 200
+
+
+# --- 儀表板輸出規格 ---
+# 每種用途直接以需要的格式與寬度 (px) 渲染，不再從列印解析度縮圖；width 為 None 表示依 DASHBOARD_DPI。
+# fpdf 1.7 無法嵌入 SVG，PDF 使用依頁面寬度與 PDF_IMAGE_DPI 渲染的 JPEG；SVG 提供給網頁放大檢視
+DASHBOARD_PROFILES = {
+    'print': {'format':'png', 'width':None},
+    'pdf': {'format':'jpg', 'width':round(PDF_IMAGE_WIDTH_MM / 25.4 * PDF_IMAGE_DPI)},
+    'screen': {'format':'png', 'width':1800},
+    'thumbnail': {'format':'png', 'width':480},
+    'svg': {'format':'svg', 'width':None},
+}
+IMAGE_MIMETYPES = {'png':'image/png', 'webp':'image/webp', 'jpg':'image/jpeg', 'svg':'image/svg+xml'}
+IMAGE_VARIANT_DIR = os.path.join('output', 'variants')
+IMAGE_MAX_AGE = 365 * 24 * 3600  # 報告圖片產生後不再變動
+
+def render_dashboard_profile(p_data, profile, as_of=None, output_dir='output'):
+    """以指定輸出規格渲染儀表板，回傳位元組；as_of 為報告日期 (預設今天)"""
+    spec = DASHBOARD_PROFILES[profile]
+    buffer = BytesIO()
+    get_visualizer(output_dir).render_dashboard(p_data, buffer, fmt=spec['format'], width=spec['width'], as_of=as_of)
+    return buffer.getvalue()
+
+def stored_profile(ref):
+    """報告產生時寫入的儀表板屬於哪個輸出規格 (舊版報告一律是列印解析度 PNG)"""
+    return 'pdf' if artifact_name(ref).endswith('.jpg') else 'print'
+
+def transcode_image(data, fmt):
+    """把 PNG 轉成 WebP 等其他點陣格式 (尺寸不變)"""
+    from PIL import Image
+    with Image.open(BytesIO(data)) as im:
+        buffer = BytesIO()
+        if fmt == 'webp': im.save(buffer, 'WEBP', quality=85, method=4)
+        else: im.save(buffer, 'PNG', optimize=True)
+        return buffer.getvalue()
+
+def get_dashboard_variant(path, variant, fmt, report_data=None, created_at=None):
+    """回傳指定輸出規格/格式的儀表板圖片參照；第一次請求時才以報告內容渲染，之後快取在同一個產物儲存中。
+    需要渲染但 report_data 不是 dict 或數值無法解析 (例如舊資料損毀) 時拋出 ReportError (422)"""
+    if variant == stored_profile(path) and fmt == DASHBOARD_PROFILES[variant]['format']: return path
+    def produce():
+        native = DASHBOARD_PROFILES[variant]['format']
+        if fmt != native: return transcode_image(read_artifact(get_dashboard_variant(path, variant, native, report_data, created_at)), fmt)
+        try: p_data = normalize_report_data(report_data)
+        except (AttributeError, TypeError, ValueError): raise ReportError('報告資料格式錯誤，無法產生此圖片規格', 422) from None
+        as_of = datetime.strptime(created_at[:10], '%Y-%m-%d').date() if created_at else None
+        metrics.inc('dashboard_profile_renders_total', profile=variant)
+        with timed('dashboard_profile'):
+            return render_dashboard_profile(p_data, variant, as_of)
+    if is_cas_ref(path):
+        variant_path = _cas_store.variant_path(artifact_name(path), variant, fmt)
+        if os.path.exists(variant_path): return variant_path
+        return FileBlobStore(os.path.dirname(variant_path)).put(os.path.basename(variant_path), produce())
+    name = os.path.splitext(artifact_name(path))[0]
+    if is_blob_ref(path):
+        variant_ref = f'{BLOB_REF_PREFIX}variants/{name}_{variant}.{fmt}'
+        if not _sqlite_blob_store.exists(variant_ref):
+            _sqlite_blob_store.put(variant_ref[len(BLOB_REF_PREFIX):], produce())
+        return variant_ref
+    variant_path = os.path.join(IMAGE_VARIANT_DIR, f'{name}_{variant}.{fmt}')
+    if os.path.exists(variant_path) and os.path.getmtime(variant_path) >= os.path.getmtime(path):
+        return variant_path
+    return FileBlobStore(IMAGE_VARIANT_DIR).put(os.path.basename(variant_path), produce())
+
+def _remove_variants(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    for variant in DASHBOARD_PROFILES:
+        for fmt in IMAGE_MIMETYPES:
+            try: os.remove(os.path.join(IMAGE_VARIANT_DIR, f'{name}_{variant}.{fmt}'))
+            except OSError: pass
+
+
+# --- HTML 模板 (啟動時編譯一次，請求時不再重新解析) ---
+VIEW_REPORT_TEMPLATE = app.jinja_env.from_string("""
     <!DOCTYPE html>
     <html lang="zh-Hant">
     <head>
@@ -394,8 +2705,10 @@ def view_report(report_id):
                 </div>
                 <div class="dashboard-container">
                     <h2>📈 健康數據儀表板</h2>
-                    {% if dashboard_image %}
-                        <img src="data:image/png;base64,{{ dashboard_image }}">
+                    {% if has_dashboard %}
+                        <a href="/dashboard_image/{{ report_id }}?variant=svg" target="_blank">
+                            <img src="/dashboard_image/{{ report_id }}?variant=screen" alt="健康數據儀表板">
+                        </a>
                     {% else %}
                         <p>儀表板圖片載入失敗</p>
                     {% endif %}
@@ -408,38 +2721,9 @@ def view_report(report_id):
         </div>
     </body>
     </html>
-    """
-    # --- HTML 模板整理結束 ---
-    
-    return render_template_string(html_template, 
-        report_id=report_id, 
-        created_at=report[6], 
-        dashboard_image=dashboard_base64, 
-        **report_data
-    )
-
-@app.route('/download_report/<int:report_id>')
-def download_report(report_id):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute('SELECT pdf_path FROM health_reports WHERE id = ?', (report_id,))
-    result = cursor.fetchone()
-    conn.close()
-    if not result or not result[0] or not os.path.exists(result[0]):
-        return "報告檔案不存在或路徑已失效", 404
-    return send_file(result[0], as_attachment=True)
+    """)
 
-@app.route('/reports/<patient_id>')
-def list_reports(patient_id):
-    reports = get_reports_by_patient(patient_id)
-    def format_dt(ts_str, fmt):
-        try:
-            return datetime.fromisoformat(ts_str.split('.')[0]).strftime(fmt)
-        except:
-            return ts_str
-            
-    # --- HTML 模板整理開始 ---
-    html_template = """
+REPORT_LIST_TEMPLATE = app.jinja_env.from_string("""
     <!DOCTYPE html>
     <html lang="zh-Hant">
     <head>
@@ -488,6 +2772,18 @@ def list_reports(patient_id):
                 font-weight: 700; 
                 color: #2E86AB; 
             }
+            .report-thumb { 
+                width: 160px; 
+                height: 107px; 
+                object-fit: contain; 
+                margin-right: 15px; 
+                border-radius: 5px; 
+                background: white; 
+            }
+            .report-summary { 
+                display: flex; 
+                align-items: center; 
+            }
             .btn { 
                 display: inline-block; 
                 padding: 8px 16px; 
@@ -508,65 +2804,443 @@ def list_reports(patient_id):
             .btn-secondary:hover { 
                 background: #545b62; 
             }
+            .load-more { 
+                display: block; 
+                margin: 10px auto; 
+                border: none; 
+                cursor: pointer; 
+                font-family: inherit; 
+            }
         </style>
     </head>
     <body>
         <div class="container">
             <div class="header">
                 <h1>📋 {{ patient_id }} 的歷史報告</h1>
-                <p>共 {{ reports|length }} 份報告</p>
+                <p>共 {{ total }} 份報告</p>
             </div>
             <div class="report-list">
+                <div id="report-items">
                 {% for report in reports %}
                     <div class="report-item">
-                        <div class="report-date">📅 {{ format_dt(report[6], '%Y-%m-%d %H:%M') }}</div>
+                        <div class="report-summary">
+                            {% if report.thumbnail_url %}<img class="report-thumb" src="{{ report.thumbnail_url }}" alt="儀表板縮圖" loading="lazy">{% endif %}
+                            <div class="report-date">📅 {{ report.display_date }}</div>
+                        </div>
                         <div>
-                            <a href="/view_report/{{ report[0] }}" class="btn">👀 查看</a>
-                            <a href="/download_report/{{ report[0] }}" class="btn btn-secondary">📥 下載</a>
+                            <a href="{{ report.view_url }}" class="btn">👀 查看</a>
+                            <a href="{{ report.download_url }}" class="btn btn-secondary">📥 下載</a>
                         </div>
                     </div>
                 {% else %}
                     <p style="text-align:center; color:#666; margin:50px 0;">📭 尚無報告記錄</p>
                 {% endfor %}
+                </div>
+                {% if next_cursor %}
+                    <button id="load-more" class="btn load-more" data-cursor="{{ next_cursor }}">⬇️ 載入更多</button>
+                {% endif %}
                 <div style="text-align:center; margin-top:30px;">
                     <a href="/" class="btn">🏠 返回首頁</a>
                 </div>
             </div>
         </div>
+        <script>
+            const patientId = {{ patient_id|tojson }};
+            const list = document.getElementById('report-items');
+            const loadMore = document.getElementById('load-more');
+
+            function appendReport(report) {
+                const item = document.createElement('div');
+                item.className = 'report-item';
+                const thumbnail = report.thumbnail_url ? `<img class="report-thumb" src="${report.thumbnail_url}" alt="儀表板縮圖" loading="lazy">` : '';
+                item.innerHTML = `
+                    <div class="report-summary">
+                        ${thumbnail}
+                        <div class="report-date">📅 ${report.display_date}</div>
+                    </div>
+                    <div>
+                        <a href="${report.view_url}" class="btn">👀 查看</a>
+                        <a href="${report.download_url}" class="btn btn-secondary">📥 下載</a>
+                    </div>`;
+                list.appendChild(item);
+            }
+
+            function fetchNextPage() {
+                if (!loadMore || loadMore.dataset.loading) return;
+                loadMore.dataset.loading = '1';
+                loadMore.textContent = '⏳ 載入中...';
+                fetch(`/api/patients/${encodeURIComponent(patientId)}/reports?cursor=${encodeURIComponent(loadMore.dataset.cursor)}`)
+                    .then(response => response.json())
+                    .then(data => {
+                        data.reports.forEach(appendReport);
+                        if (data.next_cursor) {
+                            loadMore.dataset.cursor = data.next_cursor;
+                            loadMore.textContent = '⬇️ 載入更多';
+                            delete loadMore.dataset.loading;
+                        } else {
+                            loadMore.remove();
+                        }
+                    })
+                    .catch(() => {
+                        loadMore.textContent = '⚠️ 載入失敗，點此重試';
+                        delete loadMore.dataset.loading;
+                    });
+            }
+
+            if (loadMore) {
+                loadMore.addEventListener('click', fetchNextPage);
+                if ('IntersectionObserver' in window) {
+                    new IntersectionObserver(entries => {
+                        if (entries.some(entry => entry.isIntersecting)) fetchNextPage();
+                    }).observe(loadMore);
+                }
+            }
+        </script>
     </body>
     </html>
-    """
-    # --- HTML 模板整理結束 ---
-    
-    return render_template_string(html_template, 
-        patient_id=patient_id, 
-        reports=reports, 
-        format_dt=format_dt
-    )
+    """)
+
+COACH_DASHBOARD_TEMPLATE = app.jinja_env.from_string("""
+    <!DOCTYPE html>
+    <html lang="zh-Hant">
+    <head>
+        <meta charset="UTF-8">
+        <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        <title>教練儀表板 - {{ coach.name }}</title>
+        <style>
+            body { 
+                font-family: 'Microsoft JhengHei', sans-serif; 
+                padding: 20px; 
+                background: #f5f5f5; 
+            }
+            .container { 
+                max-width: 1200px; 
+                margin: auto; 
+                background: white; 
+                border-radius: 10px; 
+                box-shadow: 0 5px 15px rgba(0,0,0,.1); 
+                overflow: hidden; 
+            }
+            .header { 
+                background: #2E86AB; 
+                color: white; 
+                padding: 20px; 
+                text-align: center; 
+            }
+            .content { 
+                padding: 20px; 
+            }
+            .cards { 
+                display: grid; 
+                grid-template-columns: repeat(auto-fit, minmax(200px, 1fr)); 
+                gap: 15px; 
+                margin-bottom: 25px; 
+            }
+            .card { 
+                background: #f8f9fa; 
+                border-radius: 8px; 
+                padding: 15px; 
+                border-left: 5px solid #2E86AB; 
+            }
+            .card p { 
+                font-size: 1.5em; 
+                font-weight: 700; 
+                margin: 8px 0 0; 
+            }
+            .distribution { 
+                display: flex; 
+                align-items: flex-end; 
+                gap: 10px; 
+                height: 140px; 
+                margin-bottom: 25px; 
+            }
+            .bar { 
+                flex: 1; 
+                background: #A23B72; 
+                color: white; 
+                text-align: center; 
+                border-radius: 5px 5px 0 0; 
+                min-height: 20px; 
+                font-size: 13px; 
+            }
+            table { 
+                width: 100%; 
+                border-collapse: collapse; 
+            }
+            th, td { 
+                padding: 8px 10px; 
+                border-bottom: 1px solid #ddd; 
+                text-align: left; 
+            }
+            th { 
+                background: #f0f2f5; 
+            }
+            tr.below-who { 
+                background: #fff3e0; 
+            }
+            a { 
+                color: #2E86AB; 
+            }
+        </style>
+    </head>
+    <body>
+        <div class="container">
+            <div class="header">
+                <h1>🏋️ 教練儀表板</h1>
+                <p>{{ coach.name }} ({{ coach.email }})</p>
+            </div>
+            <div class="content">
+                <div class="cards">
+                    <div class="card"><h3>會員數</h3><p>{{ summary.member_count }}</p></div>
+                    <div class="card"><h3>已有報告</h3><p>{{ summary.reported_count }}</p></div>
+                    <div class="card"><h3>平均綜合評分</h3><p>{{ summary.mean_overall_score if summary.mean_overall_score is not none else '—' }}</p></div>
+                    <div class="card"><h3>運動未達 {{ summary.who_exercise_minutes }} 分鐘/週</h3><p>{{ summary.below_who_exercise_count }}</p></div>
+                </div>
+                <h2>📊 綜合評分分布</h2>
+                {% set peak = score_distribution|map(attribute='count')|max %}
+                <div class="distribution">
+                    {% for bucket in score_distribution %}
+                    <div class="bar" style="height: {{ (bucket.count / peak * 100) if peak else 0 }}%">{{ bucket.range }}<br>{{ bucket.count }}</div>
+                    {% endfor %}
+                </div>
+                <h2>👥 會員最新量測</h2>
+                <table>
+                    <tr><th>會員</th><th>最新量測</th><th>心率</th><th>BMI</th><th>血壓</th><th>運動(分鐘/週)</th><th>綜合評分</th><th>報告數</th></tr>
+                    {% for m in members %}
+                    <tr class="{{ 'below-who' if m.below_who_exercise }}">
+                        <td><a href="/reports/{{ m.patient_id }}">{{ m.name }} ({{ m.patient_id }})</a></td>
+                        <td>{{ m.measured_at or '—' }}</td>
+                        <td>{{ m.heart_rate if m.heart_rate is not none else '—' }}</td>
+                        <td>{{ '%.1f'|format(m.bmi) if m.bmi is not none else '—' }}</td>
+                        <td>{{ m.blood_pressure or '—' }}</td>
+                        <td>{{ m.exercise_duration|int if m.exercise_duration is not none else '—' }}{{ ' ⚠️' if m.below_who_exercise }}</td>
+                        <td>{{ m.overall_score if m.overall_score is not none else '—' }}</td>
+                        <td>{{ m.report_count }}</td>
+                    </tr>
+                    {% endfor %}
+                </table>
+            </div>
+        </div>
+    </body>
+    </html>
+    """)
+
+# --- 頁面快照 ---
+# 報告產生後內容不再變動：報告頁第一次瀏覽時渲染一次存進 report_snapshots，之後直接送出並以強 ETag 回應條件式請求。
+# 歷史列表放在程序內 LRU，以會員的列表版本號 (儲存新報告時遞增，跨工作程序有效) 驗證
+PAGE_SNAPSHOT_VERSION = 1  # 報告頁模板變更時遞增，使舊快照失效
+HISTORY_CACHE_SIZE = int(os.environ.get('HISTORY_CACHE_SIZE', 1024))
+
+class PageCache:
+    """程序內 LRU 快取；項目附帶版本號，版本不符視為未命中"""
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version: return None
+            self._entries.move_to_end(key)
+            return entry[1:]
+
+    def put(self, key, version, etag, html):
+        with self._lock:
+            self._entries[key] = (version, etag, html)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries: self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock: self._entries.clear()
+
+history_page_cache = PageCache(HISTORY_CACHE_SIZE)
+
+def page_etag(html):
+    return hashlib.sha256(html.encode('utf-8')).hexdigest()
+
+def render_report_page(report_id):
+    """渲染報告頁 HTML，回傳 (html, 可否保存為快照)；報告不存在時回傳 None。
+    儀表板參照存在卻暫時讀不到時不保存，避免快照永遠顯示載入失敗"""
+    report = get_db().execute('SELECT report_data, dashboard_path, created_at FROM health_reports WHERE id = ?', (report_id,)).fetchone()
+    if not report: return None
+    has_dashboard = artifact_exists(report[1])
+    html = render_template(VIEW_REPORT_TEMPLATE, report_id=report_id, created_at=report[2], has_dashboard=has_dashboard, **json.loads(report[0]))
+    return html, has_dashboard or report[1] is None
+
+def get_report_snapshot(report_id):
+    """回傳報告頁快照 (etag, html)，第一次瀏覽時才渲染並保存；報告不存在時回傳 None"""
+    conn = get_db()
+    row = conn.execute('SELECT etag, html FROM report_snapshots WHERE report_id = ? AND version = ?', (report_id, PAGE_SNAPSHOT_VERSION)).fetchone()
+    if row:
+        metrics.inc('page_cache_requests_total', page='report', result='hit')
+        return row[0], row[1]
+    rendered = render_report_page(report_id)
+    if rendered is None: return None
+    html, complete = rendered
+    etag = page_etag(html)
+    if complete:
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO report_snapshots (report_id, version, etag, html) VALUES (?, ?, ?, ?)', (report_id, PAGE_SNAPSHOT_VERSION, etag, html))
+    metrics.inc('page_cache_requests_total', page='report', result='miss')
+    return etag, html
+
+def get_history_page(patient_id):
+    """歷史列表第一頁 (etag, html)；只有該會員儲存了新報告 (版本號改變) 才重新查詢與渲染"""
+    version = get_history_version(patient_id)  # 先讀版本號：渲染期間有新報告時，下一次請求仍會重新渲染
+    cached = history_page_cache.get(patient_id, version)
+    if cached:
+        metrics.inc('page_cache_requests_total', page='history', result='hit')
+        return cached
+    reports, next_cursor = get_reports_page(patient_id)
+    html = render_template(REPORT_LIST_TEMPLATE, patient_id=patient_id, reports=reports, next_cursor=next_cursor, total=count_reports(patient_id))
+    etag = page_etag(html)
+    history_page_cache.put(patient_id, version, etag, html)
+    metrics.inc('page_cache_requests_total', page='history', result='miss')
+    return etag, html
+
+def page_response(etag, html=None):
+    """以強 ETag 送出頁面；瀏覽器每次重新驗證，內容未變時只回 304"""
+    response = Response(html or '', mimetype='text/html')
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# --- 路由 (修改 HTML 格式) ---
+@app.route('/view_report/<int:report_id>')
+def view_report(report_id):
+    if request.if_none_match:
+        # 條件式請求只需比對 ETag，不讀取快照內容
+        row = get_db().execute('SELECT etag FROM report_snapshots WHERE report_id = ? AND version = ?', (report_id, PAGE_SNAPSHOT_VERSION)).fetchone()
+        if row and request.if_none_match.contains(row[0]): return page_response(row[0])
+    snapshot = get_report_snapshot(report_id)
+    if snapshot is None:
+        return "報告不存在", 404
+    return page_response(*snapshot)
+
+@app.route('/dashboard_image/<int:report_id>')
+def dashboard_image(report_id):
+    """儀表板圖片：?variant=thumbnail|screen|print|pdf|svg，format=auto|png|webp (只適用 PNG 規格)；支援 ETag/Last-Modified 條件式請求"""
+    variant, fmt = request.args.get('variant', 'screen'), request.args.get('format', 'auto')
+    if variant not in DASHBOARD_PROFILES or fmt not in ('auto', 'png', 'webp'):
+        return "不支援的圖片格式", 400
+    result = get_db().execute('SELECT dashboard_path, report_data, created_at FROM health_reports WHERE id = ?', (report_id,)).fetchone()
+    if not result or not artifact_exists(result[0]):
+        return "儀表板圖片不存在或路徑已失效", 404
+    native = DASHBOARD_PROFILES[variant]['format']
+    if native != 'png': fmt = native
+    elif fmt == 'auto': fmt = 'webp' if request.accept_mimetypes.quality('image/webp') > 0 else 'png'
+    try: report_data = json.loads(result[1])
+    except (TypeError, ValueError): report_data = None
+    try: path = get_dashboard_variant(result[0], variant, fmt, report_data, result[2])
+    except ReportError as e: return str(e), e.status_code
+    response = send_artifact(path, mimetype=IMAGE_MIMETYPES[fmt], max_age=IMAGE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    if native == 'png' and request.args.get('format', 'auto') == 'auto': response.vary.add('Accept')
+    return response
+
+@app.route('/download_report/<int:report_id>')
+def download_report(report_id):
+    result = get_db().execute('SELECT pdf_path, patient_id, created_at FROM health_reports WHERE id = ?', (report_id,)).fetchone()
+    if not result or not artifact_exists(result[0]):
+        return "報告檔案不存在或路徑已失效", 404
+    return send_artifact(result[0], mimetype='application/pdf', as_attachment=True, download_name=report_filename(result[1], result[2]))
+
+@app.route('/reports/<patient_id>')
+def list_reports(patient_id):
+    return page_response(*get_history_page(patient_id))
+
+@app.route('/api/patients/<patient_id>/reports')
+def list_reports_api(patient_id):
+    """歷史報告 JSON 分頁：?cursor=&limit= (最多 100)"""
+    try:
+        reports, next_cursor = get_reports_page(patient_id, request.args.get('cursor'), request.args.get('limit', REPORT_PAGE_SIZE))
+    except ValueError as e:
+        return jsonify({'status':'error','message':str(e)}), 400
+    return jsonify({'patient_id':patient_id, 'reports':reports, 'next_cursor':next_cursor}), 200
 
 @app.route('/api/coaches', methods=['GET', 'POST'])
 def manage_coaches():
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+    conn = get_db()
     if request.method == 'GET':
-        cursor.execute('SELECT id, name, email, phone, created_at FROM coaches ORDER BY name')
-        coaches = cursor.fetchall()
-        conn.close()
+        coaches = conn.execute('SELECT id, name, email, phone, created_at FROM coaches ORDER BY name').fetchall()
         return jsonify([dict(zip(['id','name','email','phone','created_at'], row)) for row in coaches])
     if request.method == 'POST':
         data = request.get_json()
         if not data or not data.get('name') or not data.get('email'):
             return jsonify({'error': '姓名和Email為必填項'}), 400
         try:
-            cursor.execute('INSERT INTO coaches (name, email, phone) VALUES (?, ?, ?)', (data.get('name'), data.get('email'), data.get('phone')))
-            conn.commit()
+            with conn:
+                cursor = conn.execute('INSERT INTO coaches (name, email, phone) VALUES (?, ?, ?)', (data.get('name'), data.get('email'), data.get('phone')))
             coach_id = cursor.lastrowid
             return jsonify({'id': coach_id, 'message': '教練新增成功'}), 201
         except sqlite3.IntegrityError:
             return jsonify({'error': '此Email已被註冊'}), 409
+
+@app.route('/coaches/<int:coach_id>/dashboard')
+def coach_dashboard(coach_id):
+    dashboard = get_coach_dashboard(coach_id)
+    if dashboard is None: return "教練不存在", 404
+    return render_template(COACH_DASHBOARD_TEMPLATE, **dashboard)
+
+@app.route('/api/coaches/<int:coach_id>/dashboard')
+def coach_dashboard_api(coach_id):
+    dashboard = get_coach_dashboard(coach_id)
+    if dashboard is None: return jsonify({'status':'error','message':'教練不存在'}), 404
+    return jsonify(dashboard), 200
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='健身數據報告產生器')
+    sub = parser.add_subparsers(dest='command')
+    batch = sub.add_parser('batch', help='從 JSON/CSV 檔案批次產生報告')
+    batch.add_argument('path', help='會員量測資料檔 (.json 或 .csv)')
+    batch.add_argument('--workers', type=int, default=REPORT_WORKERS, help='渲染程序數量 (1 表示在目前程序執行)')
+    batch.add_argument('--send-email', action='store_true', help='寄送報告 (寄件帳號取自 SENDER_EMAIL/SENDER_PASSWORD)')
+    batch.add_argument('--output', help='將結果 JSON 寫入此檔案')
+    compact = sub.add_parser('compact', help='依保留政策整理產物 (封存、回收)')
+    compact.add_argument('--keep-latest', type=int, help=f'每位會員保留為鬆散檔案的最新報告數 (預設 {ARTIFACT_KEEP_LATEST})')
+    compact.add_argument('--pack-after-days', type=float, help=f'超過天數的舊報告封存進壓縮包 (預設 {ARTIFACT_PACK_AFTER_DAYS})')
+    compact.add_argument('--delete-after-days', type=float, help='超過天數的舊報告移除產物 (預設不刪除)')
+    compact.add_argument('--import-legacy', action='store_true', help='先將舊版 output/ 檔案搬進內容定址儲存並刪除原檔 (不可復原)')
+    imports = sub.add_parser('import', help='從穿戴裝置/器材匯出的 CSV 或 JSON Lines 批次匯入量測資料')
+    imports.add_argument('path', help='匯入檔 (.csv、.jsonl/.ndjson，可再加 .gz)')
+    imports.add_argument('--format', choices=['csv', 'jsonl'], help='預設依副檔名判斷')
+    imports.add_argument('--create-members', action='store_true', help='自動建立不存在的會員 (預設略過)')
+    imports.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_ROWS)
+    args = parser.parse_args(argv)
+    init_database()
+    if args.command == 'batch':
+        with open(args.path, encoding='utf-8-sig') as f:
+            members = parse_batch_members(f.read(), 'csv' if args.path.lower().endswith('.csv') else 'json')
+        executor = ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context('spawn')) if args.workers > 1 else None
+        try:
+            result = run_batch_pipeline(members, executor, args.send_email, os.environ.get('SENDER_EMAIL'), os.environ.get('SENDER_PASSWORD'))
         finally:
-            conn.close()
+            if executor: executor.shutdown()
+        if args.send_email and not mail_sender.drain(timeout=300):
+            print("警告：仍有郵件未寄出，可稍後重新執行或透過 API 查詢寄送狀態")
+        text = json.dumps(result, ensure_ascii=False, indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f: f.write(text)
+        print(f"完成 {result['succeeded']}/{result['total']} 份報告，耗時 {result['timing']['total_seconds']} 秒")
+        if not args.output: print(text)
+    elif args.command == 'compact':
+        result = compact_artifacts(args.keep_latest, args.pack_after_days, args.delete_after_days, import_legacy=args.import_legacy)
+        print(json.dumps(dict(result, stats=get_artifact_stats()), ensure_ascii=False, indent=2))
+    elif args.command == 'import':
+        stream, fmt = open_import_file(args.path)
+        def progress(summary):
+            print(f"\r已處理 {summary['rows']} 筆，寫入 {summary['inserted']} 筆，{summary['elapsed_seconds']} 秒", end='', file=sys.stderr, flush=True)
+        with stream:
+            summary = import_measurements(stream, args.format or fmt, 'create' if args.create_members else 'skip', args.chunk_size, progress)
+        print(file=sys.stderr)
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        app.run(host='127.0.0.1', debug=True, port=5000)
 
 if __name__ == '__main__':
-    init_database()
-    app.run(host='127.0.0.1', debug=True, port=5000)
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,724 @@
+"""健身數據報告產生器的效能量測工具
+
+在 backend.py 所在目錄執行，例如：
+    python benchmark.py dashboard --runs 5
+    python benchmark.py threads --members 20 --threads 4
+    python benchmark.py db --rows 1000000 --readers 4 --writers 2
+    python benchmark.py startup --runs 5 --render
+    python benchmark.py pdf --runs 3
+    python benchmark.py seed --members 500 --reports-per-member 20
+    python benchmark.py stages --runs 5
+    python benchmark.py load --concurrency 1,4,8 --seconds 10
+    python benchmark.py smtp --messages 50
+    python benchmark.py pages --runs 50
+    python benchmark.py --output results.json suite
+    python benchmark.py compare base.json results.json
+
+每個指令都輸出 JSON (含 git commit 等中繼資料)，可用 compare 比較兩次提交的結果。
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import socketserver
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+SAMPLE_MEMBER = {"patient_id":"BENCH", "heart_rate":72.0, "weight":70.0, "height":175.0, "bmi":22.9, "blood_pressure":"118/76", "exercise_duration":160.0}
+
+
+def _summarize(samples):
+    """將秒數樣本整理成毫秒統計"""
+    ms = sorted(s * 1000 for s in samples)
+    def pct(p): return round(ms[min(len(ms) - 1, int(p / 100 * len(ms)))], 2)
+    return {'runs':len(ms), 'mean_ms':round(statistics.mean(ms),2), 'median_ms':round(statistics.median(ms),2),
+            'p95_ms':pct(95), 'p99_ms':pct(99), 'min_ms':round(ms[0],2), 'max_ms':round(ms[-1],2)}
+
+
+def _metadata():
+    """結果的中繼資料，方便跨提交比較"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'timestamp':datetime.now().isoformat(timespec='seconds'), 'git_commit':commit, 'python':platform.python_version(),
+            'platform':platform.platform(), 'cpu_count':os.cpu_count()}
+
+
+def _member(rng, patient_id):
+    return dict(SAMPLE_MEMBER, patient_id=patient_id, heart_rate=float(rng.randint(50, 110)), weight=round(rng.uniform(45, 110), 1),
+                bmi=round(rng.uniform(17, 35), 1), blood_pressure=f'{rng.randint(100,160)}/{rng.randint(60,100)}',
+                exercise_duration=float(rng.randint(0, 400)))
+
+
+@contextmanager
+def _workspace(dpi=None):
+    """在暫存目錄中以全新的資料庫與 output/ 執行 (只複製字型檔)，不影響目前的工作目錄"""
+    import backend
+    backend_dir = os.path.dirname(os.path.abspath(backend.__file__))
+    previous = os.getcwd(), backend.DATABASE_PATH, backend.DASHBOARD_DPI
+    workdir = tempfile.mkdtemp()
+    try:
+        if os.path.isdir(os.path.join(backend_dir, 'fonts')):
+            shutil.copytree(os.path.join(backend_dir, 'fonts'), os.path.join(workdir, 'fonts'))
+        os.chdir(workdir)
+        backend.DATABASE_PATH = os.path.join(workdir, 'health_reports.db')
+        if dpi: backend.DASHBOARD_DPI = dpi
+        backend.init_database()
+        yield backend
+    finally:
+        os.chdir(previous[0])
+        backend.DATABASE_PATH, backend.DASHBOARD_DPI = previous[1], previous[2]
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def seed_population(backend, members, reports_per_member, seed=42, members_per_coach=50):
+    """在 backend 目前的資料庫中建立教練、會員與每人數份歷史報告 (含量測時間序列與教練彙總表)，回傳會員ID清單"""
+    rng = random.Random(seed)
+    coaches = max(1, members // members_per_coach)
+    conn = backend.get_db()
+    started = time.perf_counter()
+    with conn:
+        conn.executemany('INSERT OR IGNORE INTO coaches (name, email) VALUES (?, ?)', [(f'Coach {c}', f'coach{c}@bench.local') for c in range(coaches)])
+        coach_ids = [r[0] for r in conn.execute("SELECT id FROM coaches WHERE email LIKE '%@bench.local' ORDER BY id")]
+        patient_ids = [f'M{m:05d}' for m in range(members)]
+        conn.executemany('INSERT OR IGNORE INTO members (patient_id, name, email, coach_id) VALUES (?, ?, ?, ?)',
+                         [(pid, f'Member {pid}', f'{pid.lower()}@bench.local', coach_ids[i % len(coach_ids)]) for i, pid in enumerate(patient_ids)])
+        now = datetime.utcnow()
+        for pid in patient_ids:
+            for n in range(reports_per_member):
+                data = _member(rng, pid)
+                created_at = (now - timedelta(days=(reports_per_member - n) * 7, minutes=rng.randrange(1440))).strftime('%Y-%m-%d %H:%M:%S')
+                cursor = conn.execute('INSERT INTO health_reports (patient_id, report_data, pdf_path, dashboard_path, created_at) VALUES (?, ?, ?, ?, ?)',
+                                      (pid, json.dumps(data), f'output/seed_{pid}_{n}.pdf', f'output/seed_{pid}_{n}.png', created_at))
+                backend._insert_measurement(conn, cursor.lastrowid, pid, data, created_at)
+    backend.rebuild_member_summary(conn)
+    return patient_ids, round(time.perf_counter() - started, 2)
+
+
+def bench_seed(db_path, members, reports_per_member):
+    """把合成會員資料寫入指定的資料庫 (預設為目前目錄的 health_reports.db)"""
+    import backend
+    backend.DATABASE_PATH = db_path
+    backend.init_database()
+    patient_ids, seconds = seed_population(backend, members, reports_per_member)
+    return {'database':os.path.abspath(db_path), 'members':len(patient_ids), 'reports':len(patient_ids) * reports_per_member, 'seed_seconds':seconds}
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        with server.lock: server.sessions += 1
+        self.wfile.write(b'220 bench ESMTP\r\n')
+        while True:
+            line = self.rfile.readline()
+            if not line: return
+            command = line[:4].upper()
+            if command == b'EHLO':
+                self.wfile.write(b'250-bench\r\n250 8BITMIME\r\n')
+            elif command == b'DATA':
+                self.wfile.write(b'354 end with .\r\n')
+                while self.rfile.readline() not in (b'.\r\n', b''): pass
+                if server.latency: time.sleep(server.latency)
+                with server.lock: server.messages += 1
+                self.wfile.write(b'250 OK\r\n')
+            elif command == b'QUIT':
+                self.wfile.write(b'221 bye\r\n'); return
+            else:
+                self.wfile.write(b'250 OK\r\n')
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """本機 SMTP 替身：接受所有郵件並計數，用來量測寄送階段而不連到真正的郵件伺服器"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, latency=0.0):
+        self.latency, self.messages, self.sessions, self.lock = latency, 0, 0, threading.Lock()
+        super().__init__(('127.0.0.1', 0), _SMTPHandler)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def point_backend(self, backend):
+        backend.SMTP_SERVER, backend.SMTP_PORT, backend.SMTP_STARTTLS = '127.0.0.1', self.server_address[1], False
+
+
+def bench_smtp(messages, latency=0.0, dpi=None):
+    """比較舊版「每封信一條 SMTP 連線」與寄件匣共用連線池的寄送吞吐量"""
+    with _workspace(dpi) as backend:
+        server = SMTPStandIn(latency)
+        server.point_backend(backend)
+        try:
+            _, report_path, _ = backend.render_report_artifacts(backend.normalize_report_data(SAMPLE_MEMBER), use_cache=False)
+            results = {'messages':messages, 'latency_ms':latency * 1000, 'attachment_bytes':len(backend.read_artifact(report_path))}
+            samples, started = [], time.perf_counter()
+            for i in range(messages):
+                t = time.perf_counter()
+                ok, message = backend.send_email_report('bench@bench.local', 'x', f'p{i}@bench.local', 'BENCH', report_path)
+                if not ok: raise RuntimeError(message)
+                samples.append(time.perf_counter() - t)
+            results['per_message_connection'] = dict(_summarize(samples), messages_per_second=round(messages / (time.perf_counter() - started), 1), smtp_sessions=server.sessions)
+            sessions, delivered = server.sessions, server.messages
+            started = time.perf_counter()
+            for i in range(0, messages, 2):
+                recipients = [('coach', f'c{i}@bench.local'), ('patient', f'p{i}@bench.local')][:messages - i]
+                backend.mail_sender.enqueue(None, 'BENCH', report_path, 'bench@bench.local', 'x', recipients)
+            deadline = started + 300
+            while server.messages - delivered < messages and time.perf_counter() < deadline: time.sleep(0.005)
+            elapsed = time.perf_counter() - started
+            if not backend.mail_sender.drain(timeout=10): raise RuntimeError('寄件匣未在時限內清空')
+            results['pooled_outbox'] = {'seconds':round(elapsed, 3), 'messages_per_second':round((server.messages - delivered) / elapsed, 1),
+                                        'smtp_sessions':server.sessions - sessions}
+            return results
+        finally:
+            server.shutdown(); server.server_close()
+
+
+def bench_stages(runs, dpi, members=200, reports_per_member=10, smtp_messages=20):
+    """分別量測 generate_report 各階段與讀取路徑的延遲 (階段時間取自 backend 的 timed 指標)"""
+    with _workspace(dpi) as backend:
+        patient_ids, seed_seconds = seed_population(backend, members, reports_per_member)
+        rng = random.Random(7)
+        client = backend.app.test_client()
+        backend.run_report_pipeline(dict(SAMPLE_MEMBER, no_cache=True))  # 暖機：模板與字型只在第一次建立
+        stages, pipeline, report_ids = {}, [], []
+        for _ in range(runs):
+            started = time.perf_counter()
+            with backend.metrics.capture() as events:
+                result = backend.run_report_pipeline(dict(_member(rng, rng.choice(patient_ids)), no_cache=True))
+            pipeline.append(time.perf_counter() - started)
+            report_ids.append(result['report_id'])
+            for kind, name, value, labels in events:
+                if name == 'report_stage_seconds': stages.setdefault(labels['stage'], []).append(value)
+        reads = {}
+        def timed_read(name, func):
+            samples = []
+            for _ in range(max(runs, 20)):
+                started = time.perf_counter(); func(); samples.append(time.perf_counter() - started)
+            reads[name] = _summarize(samples)
+        timed_read('get_reports_by_patient', lambda: backend.get_reports_by_patient(rng.choice(patient_ids)))
+        timed_read('get_reports_page', lambda: backend.get_reports_page(rng.choice(patient_ids)))
+        timed_read('view_report', lambda: client.get(f'/view_report/{rng.choice(report_ids)}'))
+        timed_read('list_reports', lambda: client.get(f'/reports/{rng.choice(patient_ids)}'))
+        coach_ids = [r[0] for r in backend.get_db().execute('SELECT id FROM coaches')]
+        timed_read('coach_dashboard', lambda: client.get(f'/api/coaches/{rng.choice(coach_ids)}/dashboard'))
+        results = {'dpi':backend.DASHBOARD_DPI, 'members':members, 'reports':members * reports_per_member, 'seed_seconds':seed_seconds,
+                   'pipeline':_summarize(pipeline), 'stages':{name: _summarize(v) for name, v in sorted(stages.items())}, 'reads':reads}
+    results['smtp'] = bench_smtp(smtp_messages, dpi=dpi)
+    return results
+
+
+def _legacy_coach_scan(backend, coach_id):
+    """舊做法：讀出教練所有會員的 health_reports JSON，在 Python 中挑出最新一筆並評分"""
+    latest = {}
+    for patient_id, report_data, created_at in backend.get_db().execute(
+            'SELECT r.patient_id, r.report_data, r.created_at FROM health_reports r JOIN members m ON m.patient_id = r.patient_id WHERE m.coach_id = ?', (coach_id,)):
+        if patient_id not in latest or created_at > latest[patient_id][0]: latest[patient_id] = (created_at, json.loads(report_data))
+    return backend.score_members([data for _, data in latest.values()])
+
+
+def bench_coach(runs, members, reports_per_member):
+    """教練儀表板：彙總表查詢 vs 掃描所有 health_reports JSON"""
+    with _workspace() as backend:
+        patient_ids, seed_seconds = seed_population(backend, members, reports_per_member, members_per_coach=members)
+        coach_id = backend.get_db().execute('SELECT coach_id FROM members WHERE patient_id = ?', (patient_ids[0],)).fetchone()[0]
+        client = backend.app.test_client()
+        results = {'members':members, 'reports':members * reports_per_member, 'seed_seconds':seed_seconds}
+        for name, func in (('json_scan', lambda: _legacy_coach_scan(backend, coach_id)),
+                           ('summary_query', lambda: backend.get_coach_dashboard(coach_id)),
+                           ('api', lambda: client.get(f'/api/coaches/{coach_id}/dashboard')),
+                           ('html', lambda: client.get(f'/coaches/{coach_id}/dashboard'))):
+            func()
+            samples = []
+            for _ in range(runs):
+                started = time.perf_counter(); func(); samples.append(time.perf_counter() - started)
+            results[name] = _summarize(samples)
+        member = _member(random.Random(3), patient_ids[0])
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            with backend.get_db() as conn: backend.update_member_summary(conn, [(member['patient_id'], None, backend.normalize_report_data(member))])
+            samples.append(time.perf_counter() - started)
+        results['incremental_update'] = _summarize(samples)
+    return results
+
+
+SEARCH_QUERIES = {
+    'hypertension_this_month': ({'blood_pressure_min':'140/90', 'created_from':None}, lambda d: (lambda bp: bp[0] is not None and (bp[0] >= 140 or bp[1] >= 90))(_parse_bp(d.get('blood_pressure')))),
+    'bmi27_low_exercise': ({'bmi_min':27, 'exercise_duration_max':150}, lambda d: (d.get('bmi') or 0) >= 27 and d.get('exercise_duration') is not None and d['exercise_duration'] < 150),
+}
+
+
+def _parse_bp(value):
+    try: return tuple(map(int, str(value).split('/')))
+    except ValueError: return None, None
+
+
+def bench_search(runs, members, reports_per_member):
+    """指標門檻查詢：索引化的 /api/reports/search vs 讀出所有 report_data 在 Python 過濾"""
+    with _workspace() as backend:
+        patient_ids, seed_seconds = seed_population(backend, members, reports_per_member)
+        conn = backend.get_db()
+        month_start = (datetime.utcnow() - timedelta(days=30)).strftime('%Y-%m-%d')
+        client = backend.app.test_client()
+        results = {'members':members, 'reports':members * reports_per_member, 'seed_seconds':seed_seconds}
+        for name, (filters, predicate) in SEARCH_QUERIES.items():
+            filters = {k: (month_start if v is None else v) for k, v in filters.items()}
+            def json_scan():
+                return [r[0] for r in conn.execute('SELECT id, report_data, created_at FROM health_reports')
+                        if r[2] >= filters.get('created_from', '') and predicate(json.loads(r[1]))]
+            def first_page():
+                return client.get('/api/reports/search', query_string=filters)
+            def all_pages():
+                ids, cursor = [], None
+                while True:
+                    reports, cursor = backend.search_reports(filters, cursor=cursor, limit=backend.REPORT_PAGE_MAX)
+                    ids += [r['id'] for r in reports]
+                    if not cursor: return ids
+            timings = {}
+            for label, func in (('json_scan', json_scan), ('api_first_page', first_page), ('indexed_all_pages', all_pages)):
+                samples = []
+                for _ in range(runs):
+                    started = time.perf_counter(); func(); samples.append(time.perf_counter() - started)
+                timings[label] = _summarize(samples)
+            timings['matches'] = len(json_scan())
+            timings['results_equal'] = sorted(json_scan()) == sorted(all_pages())
+            results[name] = timings
+    return results
+
+
+def bench_pages(runs, members, reports_per_member):
+    """報告頁與歷史列表：每次重新查詢與渲染 vs 快照/LRU 快取 vs 帶 If-None-Match 的 304"""
+    with _workspace() as backend:
+        patient_ids, seed_seconds = seed_population(backend, members, reports_per_member)
+        patient_id = patient_ids[0]
+        report_id = backend.get_db().execute('SELECT MAX(id) FROM health_reports WHERE patient_id = ?', (patient_id,)).fetchone()[0]
+        client = backend.app.test_client()
+        conn = backend.get_db()
+        def uncached_report():
+            with conn: conn.execute('DELETE FROM report_snapshots WHERE report_id = ?', (report_id,))
+            return client.get(f'/view_report/{report_id}')
+        def uncached_history():
+            backend.history_page_cache.clear()
+            return client.get(f'/reports/{patient_id}')
+        report_etag = client.get(f'/view_report/{report_id}').headers['ETag']
+        history_etag = client.get(f'/reports/{patient_id}').headers['ETag']
+        results = {'members':members, 'reports':members * reports_per_member, 'seed_seconds':seed_seconds}
+        for name, func in (('report_render', uncached_report),
+                           ('report_snapshot', lambda: client.get(f'/view_report/{report_id}')),
+                           ('report_304', lambda: client.get(f'/view_report/{report_id}', headers={'If-None-Match':report_etag})),
+                           ('history_render', uncached_history),
+                           ('history_cached', lambda: client.get(f'/reports/{patient_id}')),
+                           ('history_304', lambda: client.get(f'/reports/{patient_id}', headers={'If-None-Match':history_etag}))):
+            func()
+            samples = []
+            for _ in range(runs):
+                started = time.perf_counter(); func(); samples.append(time.perf_counter() - started)
+            results[name] = _summarize(samples)
+        results['report_304_status'] = client.get(f'/view_report/{report_id}', headers={'If-None-Match':report_etag}).status_code
+        # 儲存新報告後，列表必須重新渲染並包含新報告
+        new_id = backend.save_report_to_db(patient_id, backend.normalize_report_data(SAMPLE_MEMBER), None, None, None)
+        response = client.get(f'/reports/{patient_id}', headers={'If-None-Match':history_etag})
+        results['history_invalidated'] = response.status_code == 200 and f'/view_report/{new_id}' in response.get_data(as_text=True)
+    return results
+
+
+def _http_worker(base_url, patient_ids, report_ids, write_ratio, stop, seed, out):
+    rng = random.Random(seed)
+    while time.perf_counter() < stop:
+        if rng.random() < write_ratio:
+            kind, body = 'generate_report', json.dumps(_member(rng, rng.choice(patient_ids))).encode('utf-8')
+            req = urllib.request.Request(f'{base_url}/generate_report', data=body, headers={'Content-Type':'application/json'})
+        else:
+            kind, path = rng.choice([('view_report', f'/view_report/{rng.choice(report_ids)}'), ('list_reports', f'/reports/{rng.choice(patient_ids)}'),
+                                     ('reports_api', f'/api/patients/{rng.choice(patient_ids)}/reports'), ('trend_api', f'/api/patients/{rng.choice(patient_ids)}/trend')])
+            req = urllib.request.Request(base_url + path)
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=120) as response: response.read()
+            out.append((kind, time.perf_counter() - started, None))
+        except Exception as e:
+            out.append((kind, time.perf_counter() - started, str(e)))
+
+
+def bench_load(levels, seconds, dpi, members=200, reports_per_member=10, write_ratio=0.1):
+    """以真實 HTTP 伺服器與多個並行客戶端量測端到端吞吐量與延遲"""
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # 不逐筆輸出請求紀錄
+    with _workspace(dpi) as backend:
+        patient_ids, _ = seed_population(backend, members, reports_per_member)
+        report_ids = [r[0] for r in backend.get_db().execute('SELECT id FROM health_reports ORDER BY id DESC LIMIT 1000')]
+        server = make_server('127.0.0.1', 0, backend.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        backend.run_report_pipeline(dict(SAMPLE_MEMBER, no_cache=True))  # 暖機
+        results = {'dpi':backend.DASHBOARD_DPI, 'seconds':seconds, 'write_ratio':write_ratio, 'levels':{}}
+        try:
+            for level in levels:
+                out, stop = [], time.perf_counter() + seconds
+                threads = [threading.Thread(target=_http_worker, args=(base_url, patient_ids, report_ids, write_ratio, stop, level * 100 + i, out)) for i in range(level)]
+                started = time.perf_counter()
+                for t in threads: t.start()
+                for t in threads: t.join()
+                elapsed = time.perf_counter() - started
+                by_kind = {}
+                for kind, latency, error in out:
+                    if error is None: by_kind.setdefault(kind, []).append(latency)
+                errors = [e for _, _, e in out if e]
+                ok = [latency for _, latency, e in out if e is None]
+                results['levels'][str(level)] = {'requests':len(out), 'errors':len(errors), 'first_error':errors[0] if errors else None,
+                                                 'throughput_rps':round(len(ok) / elapsed, 2), 'latency':_summarize(ok) if ok else None,
+                                                 'by_endpoint':{kind: _summarize(v) for kind, v in sorted(by_kind.items())}}
+        finally:
+            server.shutdown()
+        return results
+
+
+def _flatten(value, prefix=''):
+    if isinstance(value, dict):
+        for k, v in value.items(): yield from _flatten(v, f'{prefix}.{k}' if prefix else str(k))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def compare_results(base_path, new_path, threshold=0.1):
+    """比較兩份結果 JSON：延遲/大小增加或吞吐量下降超過門檻者列為退步"""
+    with open(base_path, encoding='utf-8') as f: base = dict(_flatten(json.load(f)))
+    with open(new_path, encoding='utf-8') as f: new = dict(_flatten(json.load(f)))
+    lower_is_better = ('_ms', '_bytes', '_seconds', 'errors')
+    higher_is_better = ('per_second', '_rps', 'speedup', 'size_ratio')
+    changes, regressions = {}, []
+    for key in sorted(base.keys() & new.keys()):
+        if key.startswith('meta.') or not base[key]: continue
+        direction = -1 if key.endswith(lower_is_better) else 1 if key.endswith(higher_is_better) else 0
+        if not direction: continue
+        change = (new[key] - base[key]) / abs(base[key])
+        changes[key] = {'base':base[key], 'new':new[key], 'change':round(change, 4)}
+        if change * direction < -threshold: regressions.append(key)
+    return {'threshold':threshold, 'regressions':regressions, 'changes':changes}
+
+
+def bench_dashboard(runs, dpi):
+    """比較完整重繪與模板渲染的單張儀表板延遲"""
+    results = {'dpi':dpi}
+    with _workspace(dpi) as backend:
+        visualizer = backend.HealthDataVisualizer('.')
+        for mode in ('full', 'template'):
+            backend.DASHBOARD_RENDER_MODE = mode
+            started = time.perf_counter()
+            visualizer.create_dashboard_chart(SAMPLE_MEMBER)  # 暖機：模板建立成本另計
+            first_call = time.perf_counter() - started
+            samples = []
+            for i in range(runs):
+                member = dict(SAMPLE_MEMBER, patient_id=f'BENCH{i}', heart_rate=60.0 + i, exercise_duration=100.0 + 20 * i)
+                started = time.perf_counter()
+                visualizer.create_dashboard_chart(member)
+                samples.append(time.perf_counter() - started)
+            results[mode] = dict(_summarize(samples), first_call_ms=round(first_call * 1000, 2))
+        results['speedup'] = round(results['full']['mean_ms'] / results['template']['mean_ms'], 2)
+        # 各輸出規格直接渲染的成本 (模板模式)：網頁用的 screen/thumbnail 不必付出列印解析度的代價
+        results['profiles'] = {}
+        for profile in backend.DASHBOARD_PROFILES:
+            samples, size = [], 0
+            for i in range(runs):
+                started = time.perf_counter()
+                size = len(backend.render_dashboard_profile(dict(SAMPLE_MEMBER, patient_id=f'BENCH{i}'), profile))
+                samples.append(time.perf_counter() - started)
+            results['profiles'][profile] = dict(_summarize(samples), bytes=size)
+    return results
+
+
+def bench_threads(members, threads, rounds, dpi):
+    """多執行緒同時渲染儀表板：每張 PNG 必須與單執行緒渲染的結果逐位元組相同"""
+    from concurrent.futures import ThreadPoolExecutor
+    with _workspace(dpi) as backend:
+        patient_ids, _ = seed_population(backend, members, 5)
+        rng = random.Random(7)
+        data = {pid: backend.normalize_report_data(_member(rng, pid)) for pid in patient_ids}
+        visualizer = backend.HealthDataVisualizer('.')
+        results = {'members':members, 'threads':threads, 'rounds':rounds, 'dpi':dpi}
+        for mode in ('full', 'template'):
+            backend.DASHBOARD_RENDER_MODE = mode
+            visualizer.render_dashboard_png(SAMPLE_MEMBER)  # 暖機
+            started = time.perf_counter()
+            expected = {pid: visualizer.render_dashboard_png(data[pid]) for pid in patient_ids}
+            single = time.perf_counter() - started
+            jobs = [pid for _ in range(rounds) for pid in patient_ids]
+            rng.shuffle(jobs)
+            with ThreadPoolExecutor(threads) as pool:
+                list(pool.map(lambda _: visualizer.render_dashboard_png(SAMPLE_MEMBER), range(threads)))  # 暖機：模板池依並行數建立模板
+                started = time.perf_counter()
+                rendered = list(pool.map(lambda pid: (pid, visualizer.render_dashboard_png(data[pid])), jobs))
+                concurrent = time.perf_counter() - started
+            mismatches = sorted({pid for pid, png in rendered if png != expected[pid]})
+            results[mode] = {'single_renders_per_s':round(members / single, 2), 'threaded_renders_per_s':round(len(jobs) / concurrent, 2),
+                             'speedup':round(len(jobs) / concurrent / (members / single), 2), 'renders':len(jobs), 'mismatches':mismatches}
+        backend.DASHBOARD_RENDER_MODE = 'template'
+    results['outputs_identical'] = not results['full']['mismatches'] and not results['template']['mismatches']
+    return results
+
+
+def bench_pdf(runs, dpi):
+    """比較舊版 (兩份字型子集 + 原始 PNG) 與精簡模式 (單一字型子集 + 縮小 JPEG) 的 PDF 大小與產生時間"""
+    results = {'dpi':dpi}
+    with _workspace(dpi) as backend:
+        p_data = backend.normalize_report_data(SAMPLE_MEMBER)
+        for mode in ('legacy', 'compact'):
+            backend.PDF_MODE = mode
+            samples, sizes = [], []
+            for _ in range(runs):
+                started = time.perf_counter()
+                dashboard_path, report_path, _ = backend.render_report_artifacts(p_data, output_dir='.', use_cache=False)
+                samples.append(time.perf_counter() - started)
+                sizes.append(len(backend.read_artifact(report_path)))
+                backend.delete_artifact(report_path); backend.delete_artifact(dashboard_path)
+            results[mode] = dict(_summarize(samples), pdf_bytes=max(sizes))
+    results['size_ratio'] = round(results['legacy']['pdf_bytes'] / results['compact']['pdf_bytes'], 2)
+    results['speedup'] = round(results['legacy']['mean_ms'] / results['compact']['mean_ms'], 2)
+    return results
+
+
+def seed_reports(path, rows, patients=1000):
+    """建立含大量合成報告的資料庫 (只建立原始資料表，不加索引)"""
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE health_reports (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, patient_id TEXT NOT NULL,
+        report_data TEXT NOT NULL, pdf_path TEXT, dashboard_path TEXT,
+        table_path TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        coach_email TEXT, patient_email TEXT, status TEXT DEFAULT 'generated')''')
+    rng = random.Random(42)
+    def generate(n):
+        for i in range(n):
+            pid = f'P{rng.randrange(patients):05d}'
+            data = dict(SAMPLE_MEMBER, patient_id=pid, heart_rate=float(rng.randint(50, 110)), blood_pressure=f'{rng.randint(100,160)}/{rng.randint(60,100)}')
+            yield (pid, json.dumps(data), f'output/health_report_{pid}_{i}.pdf', f'output/dashboard_{pid}_{i}.png',
+                   time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(1.7e9 + i * 60)))
+    with conn:
+        conn.executemany('INSERT INTO health_reports (patient_id, report_data, pdf_path, dashboard_path, created_at) VALUES (?, ?, ?, ?, ?)', generate(rows))
+    conn.close()
+
+
+def _legacy_read(path, patient_id):
+    conn = sqlite3.connect(path)
+    conn.execute('SELECT * FROM health_reports WHERE patient_id = ? ORDER BY created_at DESC', (patient_id,)).fetchall()
+    conn.close()
+
+
+def _legacy_write(path, patient_id):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute('INSERT INTO health_reports (patient_id, report_data, pdf_path, dashboard_path) VALUES (?, ?, ?, ?)',
+                 (patient_id, json.dumps(SAMPLE_MEMBER), 'x.pdf', 'x.png'))
+    conn.commit()
+    conn.close()
+
+
+def _run_load(read_op, write_op, readers, writers, seconds, patients):
+    """在固定時間內以多執行緒同時讀寫，回傳吞吐量與延遲"""
+    stop = time.perf_counter() + seconds
+    stats = {'read':[], 'write':[], 'errors':0}
+    lock = threading.Lock()
+    def worker(kind, op, seed):
+        rng, samples, errors = random.Random(seed), [], 0
+        while time.perf_counter() < stop:
+            started = time.perf_counter()
+            try: op(f'P{rng.randrange(patients):05d}')
+            except sqlite3.Error: errors += 1; continue
+            samples.append(time.perf_counter() - started)
+        with lock:
+            stats[kind].extend(samples); stats['errors'] += errors
+    threads = [threading.Thread(target=worker, args=('read', read_op, i)) for i in range(readers)]
+    threads += [threading.Thread(target=worker, args=('write', write_op, 1000 + i)) for i in range(writers)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    result = {'errors':stats['errors']}
+    for kind in ('read', 'write'):
+        if stats[kind]: result[kind] = dict(_summarize(stats[kind]), ops_per_second=round(len(stats[kind]) / seconds, 1))
+    return result
+
+
+def bench_db(rows, readers, writers, seconds, patients=1000):
+    """比較舊版「每次開新連線、rollback journal、無索引」與共用 WAL 連線池加索引的併發讀寫吞吐量"""
+    import backend
+    workdir = tempfile.mkdtemp()
+    try:
+        seeded = os.path.join(workdir, 'seed.db')
+        started = time.perf_counter()
+        seed_reports(seeded, rows, patients)
+        results = {'rows':rows, 'readers':readers, 'writers':writers, 'seconds':seconds, 'seed_seconds':round(time.perf_counter() - started, 2)}
+
+        legacy = os.path.join(workdir, 'legacy.db')
+        shutil.copy(seeded, legacy)
+        results['legacy'] = _run_load(lambda pid: _legacy_read(legacy, pid), lambda pid: _legacy_write(legacy, pid), readers, writers, seconds, patients)
+
+        pooled = os.path.join(workdir, 'pooled.db')
+        shutil.copy(seeded, pooled)
+        backend.DATABASE_PATH = pooled
+        started = time.perf_counter()
+        backend.init_database()
+        results['migration_seconds'] = round(time.perf_counter() - started, 2)
+        def write(pid): backend.save_report_to_db(pid, dict(SAMPLE_MEMBER, patient_id=pid), 'x.pdf', 'x.png', None)
+        results['pooled'] = _run_load(backend.get_reports_by_patient, write, readers, writers, seconds, patients)
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+_STARTUP_PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import backend
+result = {'import_ms': (time.perf_counter() - started) * 1000}
+result['heavy_modules_after_import'] = [m for m in ('pandas', 'seaborn', 'matplotlib', 'fpdf', 'smtplib') if m in sys.modules]
+started = time.perf_counter()
+backend.app.test_client().get('/reports/BENCH')
+result['first_request_ms'] = (time.perf_counter() - started) * 1000
+if sys.argv[1] == 'render':
+    backend.DASHBOARD_DPI = int(sys.argv[2])
+    started = time.perf_counter()
+    backend.render_report_artifacts(backend.normalize_report_data(json.loads(sys.argv[3])), use_cache=False)
+    result['first_render_ms'] = (time.perf_counter() - started) * 1000
+print(json.dumps(result))
+'''
+
+
+def bench_startup(runs, render=False, dpi=300):
+    """在全新的 Python 程序中量測 import backend、第一個請求與 (選擇性) 第一次渲染的冷啟動時間"""
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [backend_dir, os.environ.get('PYTHONPATH')])))
+    samples = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        # 每次都用空的資料庫與輸出目錄，只共用字型檔
+        shutil.copytree(os.path.join(backend_dir, 'fonts'), os.path.join(workdir, 'fonts'))
+        for _ in range(runs):
+            for name in ('health_reports.db', 'health_reports.db-wal', 'health_reports.db-shm'):
+                if os.path.exists(os.path.join(workdir, name)): os.remove(os.path.join(workdir, name))
+            started = time.perf_counter()
+            out = subprocess.run([sys.executable, '-c', _STARTUP_PROBE, 'render' if render else 'import', str(dpi), json.dumps(SAMPLE_MEMBER)],
+                                 cwd=workdir, env=env, capture_output=True, text=True, check=True).stdout
+            probe = json.loads(out.strip().splitlines()[-1])
+            probe['process_ms'] = (time.perf_counter() - started) * 1000
+            for key, value in probe.items():
+                if key.endswith('_ms'): samples.setdefault(key, []).append(value / 1000)
+            heavy = probe['heavy_modules_after_import']
+    results = {'runs':runs, 'heavy_modules_after_import':heavy}
+    if render: results['dpi'] = dpi
+    results.update({key: _summarize(values) for key, values in samples.items()})
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='報告產生流程效能量測')
+    parser.add_argument('--output', help='將結果 JSON 寫入此檔案')
+    sub = parser.add_subparsers(dest='command', required=True)
+    dashboard = sub.add_parser('dashboard', help='儀表板渲染延遲 (full vs template) 與各輸出規格的渲染成本')
+    dashboard.add_argument('--runs', type=int, default=5)
+    dashboard.add_argument('--dpi', type=int, default=300)
+    threads = sub.add_parser('threads', help='多執行緒同時渲染儀表板 (輸出須與單執行緒一致)')
+    threads.add_argument('--members', type=int, default=20)
+    threads.add_argument('--threads', type=int, default=4)
+    threads.add_argument('--rounds', type=int, default=3, help='每位會員在並行階段渲染的次數')
+    threads.add_argument('--dpi', type=int, default=100)
+    db = sub.add_parser('db', help='SQLite 併發讀寫吞吐量 (舊版連線方式 vs 連線池)')
+    db.add_argument('--rows', type=int, default=1_000_000)
+    db.add_argument('--readers', type=int, default=4)
+    db.add_argument('--writers', type=int, default=2)
+    db.add_argument('--seconds', type=float, default=10)
+    startup = sub.add_parser('startup', help='冷啟動：import、第一個請求與第一次渲染時間')
+    startup.add_argument('--runs', type=int, default=5)
+    startup.add_argument('--render', action='store_true', help='一併量測第一次產生儀表板與 PDF')
+    startup.add_argument('--dpi', type=int, default=300)
+    pdf = sub.add_parser('pdf', help='PDF 大小與產生時間 (legacy vs compact)')
+    pdf.add_argument('--runs', type=int, default=3)
+    pdf.add_argument('--dpi', type=int, default=300)
+    seed = sub.add_parser('seed', help='在資料庫中建立合成會員與歷史報告')
+    seed.add_argument('--db', default='health_reports.db')
+    seed.add_argument('--members', type=int, default=500)
+    seed.add_argument('--reports-per-member', type=int, default=20)
+    stages = sub.add_parser('stages', help='generate_report 各階段與讀取路徑延遲 (含 SMTP 替身)')
+    stages.add_argument('--runs', type=int, default=5)
+    stages.add_argument('--dpi', type=int, default=300)
+    stages.add_argument('--members', type=int, default=200)
+    stages.add_argument('--reports-per-member', type=int, default=10)
+    load = sub.add_parser('load', help='以多個並行客戶端對 Flask 伺服器做端到端負載測試')
+    load.add_argument('--concurrency', default='1,4,8', help='逗號分隔的並行數')
+    load.add_argument('--seconds', type=float, default=10)
+    load.add_argument('--dpi', type=int, default=300)
+    load.add_argument('--write-ratio', type=float, default=0.1, help='產生新報告的請求比例，其餘為讀取')
+    load.add_argument('--members', type=int, default=200)
+    load.add_argument('--reports-per-member', type=int, default=10)
+    smtp = sub.add_parser('smtp', help='郵件寄送吞吐量 (本機 SMTP 替身)')
+    smtp.add_argument('--messages', type=int, default=50)
+    smtp.add_argument('--latency-ms', type=float, default=0, help='替身伺服器每封信的模擬延遲')
+    coach = sub.add_parser('coach', help='教練儀表板讀取延遲 (彙總表 vs 掃描報告 JSON)')
+    coach.add_argument('--runs', type=int, default=20)
+    coach.add_argument('--members', type=int, default=500, help='單一教練旗下的會員數')
+    coach.add_argument('--reports-per-member', type=int, default=20)
+    search = sub.add_parser('search', help='指標門檻查詢延遲 (索引化虛擬欄位 vs 掃描報告 JSON)')
+    search.add_argument('--runs', type=int, default=5)
+    search.add_argument('--members', type=int, default=2000)
+    search.add_argument('--reports-per-member', type=int, default=50)
+    pages = sub.add_parser('pages', help='報告頁與歷史列表延遲 (每次渲染 vs 快照/快取 vs 304)')
+    pages.add_argument('--runs', type=int, default=50)
+    pages.add_argument('--members', type=int, default=200)
+    pages.add_argument('--reports-per-member', type=int, default=50)
+    suite = sub.add_parser('suite', help='依序執行 stages 與 load')
+    suite.add_argument('--dpi', type=int, default=300)
+    suite.add_argument('--seconds', type=float, default=10)
+    compare = sub.add_parser('compare', help='比較兩份結果 JSON')
+    compare.add_argument('base')
+    compare.add_argument('new')
+    compare.add_argument('--threshold', type=float, default=0.1)
+    compare.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args(argv)
+    if args.command == 'compare':
+        result = compare_results(args.base, args.new, args.threshold)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        if args.fail_on_regression and result['regressions']: sys.exit(1)
+        return
+    if args.command == 'dashboard':
+        result = bench_dashboard(args.runs, args.dpi)
+    elif args.command == 'threads':
+        result = bench_threads(args.members, args.threads, args.rounds, args.dpi)
+    elif args.command == 'db':
+        result = bench_db(args.rows, args.readers, args.writers, args.seconds)
+    elif args.command == 'pdf':
+        result = bench_pdf(args.runs, args.dpi)
+    elif args.command == 'startup':
+        result = bench_startup(args.runs, args.render, args.dpi)
+    elif args.command == 'seed':
+        result = bench_seed(args.db, args.members, args.reports_per_member)
+    elif args.command == 'stages':
+        result = bench_stages(args.runs, args.dpi, args.members, args.reports_per_member)
+    elif args.command == 'load':
+        result = bench_load([int(c) for c in args.concurrency.split(',')], args.seconds, args.dpi, args.members, args.reports_per_member, args.write_ratio)
+    elif args.command == 'smtp':
+        result = bench_smtp(args.messages, args.latency_ms / 1000)
+    elif args.command == 'coach':
+        result = bench_coach(args.runs, args.members, args.reports_per_member)
+    elif args.command == 'search':
+        result = bench_search(args.runs, args.members, args.reports_per_member)
+    elif args.command == 'pages':
+        result = bench_pages(args.runs, args.members, args.reports_per_member)
+    elif args.command == 'suite':
+        result = {'stages':bench_stages(5, args.dpi), 'load':bench_load([1, 4, 8], args.seconds, args.dpi)}
+    result['meta'] = _metadata()
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f: f.write(text)
+    print(text)
+    if args.command == 'threads' and not result['outputs_identical']: sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import os
+import shutil
+import sys
+import threading
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FONT_FILE = os.path.join(APP_DIR, 'fonts', 'NotoSansTC-Regular.ttf')
+sys.path.insert(0, APP_DIR)
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    """在暫存目錄中以全新的資料庫與 output/ 執行 (只複製字型檔)，不影響專案目錄"""
+    import backend
+    if os.path.isdir(os.path.join(APP_DIR, 'fonts')):
+        shutil.copytree(os.path.join(APP_DIR, 'fonts'), tmp_path / 'fonts')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(backend, 'DATABASE_PATH', str(tmp_path / 'health_reports.db'))
+    monkeypatch.setattr(backend, 'DASHBOARD_DPI', 30)
+    backend.init_database()
+    return backend
+
+
+@pytest.fixture
+def coach(backend):
+    """一位教練與其旗下會員 M1"""
+    conn = backend.get_db()
+    with conn:
+        coach_id = conn.execute("INSERT INTO coaches (name, email) VALUES ('教練', 'coach@example.com')").lastrowid
+        conn.execute("INSERT INTO members (patient_id, name, coach_id) VALUES ('M1', '會員一', ?)", (coach_id,))
+    return coach_id
+
+
+@pytest.fixture
+def pdf_font(backend):
+    """產生 PDF 需要 fonts/NotoSansTC-Regular.ttf (不在版本庫中)，缺少時略過"""
+    if not os.path.exists(FONT_FILE): pytest.skip('缺少 fonts/NotoSansTC-Regular.ttf，無法產生 PDF')
+
+
+class FakeSMTP:
+    """記錄寄出的郵件；failures 中的例外依序在 sendmail 時拋出"""
+    def __init__(self):
+        self.sent, self.failures, self.logins = [], [], 0
+        self.lock = threading.Lock()
+
+    def open(self, sender_email, sender_password):
+        assert sender_password == 'secret'
+        with self.lock: self.logins += 1
+        return self
+
+    def sendmail(self, sender, recipient, message):
+        with self.lock:
+            if self.failures: raise self.failures.pop(0)
+            self.sent.append((sender, recipient, message))
+
+    def noop(self):
+        return 250, b'OK'
+
+    def quit(self):
+        pass
+
+
+@pytest.fixture
+def smtp(backend, monkeypatch):
+    """以 FakeSMTP 代替 SMTP 伺服器，並使用獨立的寄件匣執行緒 (重試間隔縮短)"""
+    server = FakeSMTP()
+    monkeypatch.setattr(backend, '_open_smtp', server.open)
+    monkeypatch.setattr(backend, 'MAIL_RETRY_BASE_SECONDS', 0.05)
+    sender = backend.MailSender(threads=2)
+    monkeypatch.setattr(backend, 'mail_sender', sender)
+    yield server
+    sender.shutdown()
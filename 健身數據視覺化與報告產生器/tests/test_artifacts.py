@@ -0,0 +1,81 @@
+import os
+
+REPORT = {'heart_rate':72, 'bmi':22, 'blood_pressure':'118/76', 'exercise_duration':60, 'weight':70, 'height':178}
+
+
+def _report(backend, patient_id, days_ago):
+    """以內容定址儲存寫入一份 days_ago 天前的報告 (內容依日期不同)，回傳 (報告ID, PDF 內容)"""
+    pdf = f'%PDF-1.3 {patient_id} {days_ago}'.encode()
+    pdf_ref = backend._cas_store.put('r.pdf', pdf)
+    dashboard_ref = backend._cas_store.put('d.png', b'\x89PNG ' + pdf)
+    data = backend.normalize_report_data(dict(REPORT, patient_id=patient_id))
+    report_id, = backend.save_reports_to_db([(patient_id, data, pdf_ref, dashboard_ref, None, None, None)])
+    conn = backend.get_db()
+    with conn: conn.execute("UPDATE health_reports SET created_at = datetime('now', ?) WHERE id = ?", (f'-{days_ago} days', report_id))
+    return report_id, pdf
+
+
+def _paths(backend, report_id):
+    return backend.get_db().execute('SELECT pdf_path, dashboard_path FROM health_reports WHERE id = ?', (report_id,)).fetchone()
+
+
+def test_compaction_never_drops_reports_when_delete_disabled(backend, monkeypatch):
+    """ARTIFACT_DELETE_AFTER_DAYS=0 (永不刪除)：背景整理只封存舊報告，不受渲染快取的大小上限影響，所有報告仍可下載"""
+    monkeypatch.setattr(backend, 'ARTIFACT_DELETE_AFTER_DAYS', 0)
+    monkeypatch.setattr(backend, 'ARTIFACT_KEEP_LATEST', 1)
+    monkeypatch.setattr(backend, 'OUTPUT_MAX_BYTES', 1)
+    reports = [_report(backend, 'M1', days) for days in (400, 300, 200)]
+    result = backend.compact_artifacts()
+    assert result['dropped_reports'] == 0
+    assert result['packed_objects'] == 4  # 最新一份之外的 PDF 與儀表板
+    client = backend.app.test_client()
+    for report_id, pdf in reports:
+        assert None not in _paths(backend, report_id)
+        response = client.get(f'/download_report/{report_id}')
+        assert response.status_code == 200 and response.data == pdf
+
+
+def test_max_bytes_drops_oldest_reports_beyond_keep_latest(backend, monkeypatch):
+    """明確設定大小上限時從最舊的報告開始移除產物，每位會員最新的報告不受影響"""
+    monkeypatch.setattr(backend, 'ARTIFACT_KEEP_LATEST', 1)
+    old, older, latest = (_report(backend, 'M1', days)[0] for days in (200, 300, 10))
+    latest_bytes = sum(backend._cas_store.stat(ref)[0] for ref in _paths(backend, latest))
+    result = backend.compact_artifacts(max_bytes=latest_bytes + 1, pack_after_days=0)
+    assert result['dropped_reports'] == 2
+    assert _paths(backend, old) == (None, None) and _paths(backend, older) == (None, None)
+    client = backend.app.test_client()
+    assert client.get(f'/download_report/{old}').status_code == 404
+    assert client.get(f'/download_report/{latest}').status_code == 200
+
+
+def test_garbage_collection_removes_only_unreferenced_objects(backend):
+    """回收只刪除沒有任何報告引用、且超過寬限時間的物件"""
+    report_id, pdf = _report(backend, 'M1', 1)
+    orphan = backend._cas_store.put('orphan.pdf', b'%PDF-1.3 orphan')
+    fresh = backend._cas_store.put('fresh.pdf', b'%PDF-1.3 fresh')
+    conn = backend.get_db()
+    with conn:
+        conn.execute("UPDATE artifact_objects SET last_used_at = datetime('now', '-2 days') WHERE key != ?", (backend.artifact_name(fresh),))
+    assert backend.collect_garbage(grace_seconds=3600)[0] == 1
+    assert not backend.artifact_exists(orphan)
+    assert backend.artifact_exists(fresh)
+    assert all(backend.artifact_exists(ref) for ref in _paths(backend, report_id))
+    assert backend.read_artifact(_paths(backend, report_id)[0]) == pdf
+
+
+def test_packing_keeps_rendered_variants(backend, monkeypatch):
+    """封存物件時保留已渲染的輸出規格，封存後的報告縮圖不必重新渲染"""
+    monkeypatch.setattr(backend, 'ARTIFACT_KEEP_LATEST', 0)
+    report_id, _ = _report(backend, 'M1', 60)
+    client = backend.app.test_client()
+    thumbnail = client.get(f'/dashboard_image/{report_id}?variant=thumbnail&format=png')
+    assert thumbnail.status_code == 200
+    dashboard_key = backend.artifact_name(_paths(backend, report_id)[1])
+    variant_path = backend._cas_store.variant_path(dashboard_key, 'thumbnail', 'png')
+    rendered_at = os.stat(variant_path).st_mtime_ns
+
+    assert backend.compact_artifacts()['packed_objects'] == 2
+    assert not os.path.exists(backend._cas_store.object_path(dashboard_key))
+    again = client.get(f'/dashboard_image/{report_id}?variant=thumbnail&format=png')
+    assert again.status_code == 200 and again.data == thumbnail.data
+    assert os.stat(variant_path).st_mtime_ns == rendered_at
@@ -0,0 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from io import BytesIO
+
+import pytest
+
+AS_OF = date(2025, 1, 15)
+MEMBERS = [{'patient_id':f'T{i}', 'heart_rate':55.0 + 7 * i, 'weight':60.0 + 4 * i, 'height':165.0 + i, 'bmi':19.0 + 1.5 * i,
+            'blood_pressure':f'{110 + 6 * i}/{70 + 3 * i}', 'exercise_duration':[20.0, 160.0, 320.0, 15000.0][i % 4]} for i in range(6)]
+
+
+def _render(backend, visualizer, data):
+    buffer = BytesIO()
+    visualizer.render_dashboard(backend.normalize_report_data(data), buffer, as_of=AS_OF)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('mode', ['full', 'template'])
+def test_concurrent_renders_match_serial(backend, monkeypatch, mode):
+    """多執行緒同時渲染的每張 PNG 都必須與單執行緒渲染的結果逐位元組相同"""
+    monkeypatch.setattr(backend, 'DASHBOARD_RENDER_MODE', mode)
+    visualizer = backend.HealthDataVisualizer('.')
+    expected = {m['patient_id']: _render(backend, visualizer, m) for m in MEMBERS}
+    jobs = MEMBERS * 3
+    with ThreadPoolExecutor(4) as pool:
+        rendered = list(pool.map(lambda m: (m['patient_id'], _render(backend, visualizer, m)), jobs))
+    assert len(rendered) == len(jobs)
+    assert [pid for pid, png in rendered if png != expected[pid]] == []
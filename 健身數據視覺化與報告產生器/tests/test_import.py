@@ -0,0 +1,61 @@
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+
+
+def _post(backend, body, query='', **headers):
+    return backend.app.test_client().post(f'/api/measurements/import{query}', data=body, headers=headers)
+
+
+def _count(backend, patient_id):
+    return backend.get_db().execute('SELECT COUNT(*) FROM measurements WHERE patient_id = ?', (patient_id,)).fetchone()[0]
+
+
+def test_csv_import_validates_rows_and_skips_duplicates(backend, coach):
+    """逐筆驗證：格式錯誤、時間不合理與未知會員各自計數，同一時間的量測重複匯入時略過"""
+    future = (datetime.utcnow() + timedelta(days=2)).isoformat(timespec='seconds')
+    millis = int(datetime(2025, 3, 1, 12, tzinfo=timezone.utc).timestamp() * 1000)
+    body = ('member_id,timestamp,bpm,bp,weight_kg\n'
+            'M1,2025-03-01T08:00:00+08:00,70,120/80,70\n'
+            f'M1,{millis},71,,\n'
+            'M1,1999-12-31T00:00:00,72,,\n'
+            f'M1,{future},73,,\n'
+            'M1,2025-03-02T08:00:00,abc,,\n'
+            'M1,2025-03-03T08:00:00,,12080,\n'
+            'X9,2025-03-01T08:00:00,70,,\n')
+    summary = _post(backend, body).get_json()
+    assert (summary['rows'], summary['inserted'], summary['invalid'], summary['unknown_member']) == (7, 2, 4, 1)
+    assert [e['line'] for e in summary['errors']] == [4, 5, 6, 7]
+    row = backend.get_db().execute("SELECT heart_rate, systolic, diastolic, weight FROM measurements WHERE measured_at = '2025-03-01 00:00:00' AND heart_rate = 70").fetchone()
+    assert row == (70.0, 120.0, 80.0, 70.0)
+    again = _post(backend, body).get_json()
+    assert (again['inserted'], again['duplicates']) == (0, 2)
+    assert _count(backend, 'M1') == 2
+
+
+def test_jsonl_gzip_import_creates_unknown_members(backend):
+    """gzip 壓縮的 JSON Lines；unknown_members=create 自動建立會員，壞掉的 JSON 行只影響該行"""
+    lines = [json.dumps({'patient_id':'N1', 'timestamp':f'2025-01-{d:02d}T07:00:00', 'hr':60 + d}) for d in range(1, 11)] + ['{broken']
+    response = _post(backend, gzip.compress('\n'.join(lines).encode()), '?format=jsonl&unknown_members=create', **{'Content-Encoding':'gzip'})
+    summary = response.get_json()
+    assert response.status_code == 200
+    assert (summary['inserted'], summary['invalid'], summary['members_created']) == (10, 1, 1)
+    assert 'JSON' in summary['errors'][0]['message']
+    assert _count(backend, 'N1') == 10
+
+
+def test_progress_streams_one_line_per_chunk(backend):
+    """?progress=1 每寫入一批回報一行 NDJSON，最後一行是完整摘要"""
+    total = backend.IMPORT_CHUNK_ROWS * 2 + 10
+    start = datetime(2025, 1, 1)
+    rows = ''.join(f'P1,{(start + timedelta(minutes=i)).isoformat()},{60 + i % 30}\n' for i in range(total))
+    response = _post(backend, 'patient_id,timestamp,hr\n' + rows, '?progress=1&unknown_members=create')
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line['rows'] for line in lines[:-1]] == [backend.IMPORT_CHUNK_ROWS, backend.IMPORT_CHUNK_ROWS * 2, total]
+    assert lines[-1]['finished'] and lines[-1]['status'] == 'success' and lines[-1]['inserted'] == total and lines[-1]['chunks'] == 3
+
+
+def test_invalid_import_options_are_rejected(backend):
+    assert _post(backend, 'x', '?format=xml').status_code == 400
+    assert _post(backend, 'x', '?unknown_members=merge').status_code == 400
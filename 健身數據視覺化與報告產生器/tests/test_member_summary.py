@@ -0,0 +1,42 @@
+import io
+from datetime import datetime, timedelta
+
+REPORT = {'patient_id':'M1', 'heart_rate':72, 'bmi':22, 'blood_pressure':'118/76', 'exercise_duration':60, 'weight':70, 'height':178}
+
+
+def _import_csv(backend, text):
+    summary = backend.import_measurements(io.StringIO(text))
+    assert summary['inserted'] == text.count('\n') - 1, summary['errors']
+    return summary
+
+
+def _member(backend, coach_id):
+    dashboard = backend.get_coach_dashboard(coach_id)
+    return dashboard, dashboard['members'][0]
+
+
+def test_partial_import_keeps_member_below_who(backend, coach):
+    """報告之後匯入只有心率的量測：其他項目與報告ID保留，仍列在未達 WHO 運動建議名單"""
+    backend.save_reports_to_db([('M1', backend.normalize_report_data(REPORT), 'r.pdf', 'd.png', None, None, None)])
+    dashboard, member = _member(backend, coach)
+    assert member['below_who_exercise'] and member['overall_score'] == 80.0
+
+    later = (datetime.utcnow() + timedelta(minutes=1)).strftime('%Y-%m-%dT%H:%M:%S')
+    _import_csv(backend, f'patient_id,timestamp,hr\nM1,{later},70\n')
+    dashboard, member = _member(backend, coach)
+    assert member['heart_rate'] == 70.0
+    assert (member['bmi'], member['blood_pressure'], member['exercise_duration']) == (22.0, '118/76', 60.0)
+    assert member['report_id'] is not None and member['report_count'] == 1
+    assert member['overall_score'] == 80.0
+    assert member['below_who_exercise']
+    assert [m['patient_id'] for m in dashboard['below_who_exercise']] == ['M1']
+
+
+def test_imported_exercise_without_report_counts_for_who(backend, coach):
+    """沒有報告、只有匯入的運動量也依運動時間判斷；沒有運動資料則不列入"""
+    _import_csv(backend, 'patient_id,timestamp,hr\nM1,2025-01-01T08:00:00,70\n')
+    assert not _member(backend, coach)[1]['below_who_exercise']
+    _import_csv(backend, 'patient_id,timestamp,exercise_minutes\nM1,2025-01-02T08:00:00,30\n')
+    dashboard, member = _member(backend, coach)
+    assert member['below_who_exercise'] and member['report_count'] == 0
+    assert dashboard['summary']['below_who_exercise_count'] == 1
@@ -0,0 +1,42 @@
+import smtplib
+
+
+def _queue(backend, patient_id='M1', recipients=(('coach', 'coach@example.com'), ('patient', 'm1@example.com'))):
+    pdf_ref = backend._cas_store.put('r.pdf', b'%PDF-1.3 ' + patient_id.encode())
+    data = backend.normalize_report_data({'patient_id':patient_id, 'heart_rate':72, 'bmi':22, 'blood_pressure':'118/76', 'exercise_duration':60})
+    report_id, = backend.save_reports_to_db([(patient_id, data, pdf_ref, None, None, None, None)])
+    return report_id, backend.mail_sender.enqueue(report_id, patient_id, pdf_ref, 'sender@example.com', 'secret', list(recipients))
+
+
+def test_outbox_sends_queued_mail_over_one_connection(backend, smtp):
+    """排入的郵件由背景執行緒寄出，同一批共用連線；密碼不寫入資料庫"""
+    report_id, queued = _queue(backend)
+    assert [r['status'] for r in queued] == ['queued', 'queued']
+    assert backend.mail_sender.drain(timeout=10)
+    assert sorted(recipient for _, recipient, _ in smtp.sent) == ['coach@example.com', 'm1@example.com']
+    assert all('health_report_M1.pdf' in message for _, _, message in smtp.sent)
+    assert smtp.logins == 1
+    deliveries = backend.app.test_client().get(f'/api/reports/{report_id}/deliveries').get_json()['deliveries']
+    assert [(d['status'], d['attempts']) for d in deliveries] == [('sent', 1), ('sent', 1)]
+    assert 'secret' not in str(backend.get_db().execute('SELECT * FROM email_outbox').fetchall())
+
+
+def test_outbox_retries_transient_failures(backend, smtp):
+    """連線中斷屬暫時性錯誤：丟棄連線並稍後重試，第二次成功"""
+    smtp.failures.append(smtplib.SMTPServerDisconnected('連線中斷'))
+    report_id, _ = _queue(backend, recipients=[('patient', 'm1@example.com')])
+    assert backend.mail_sender.drain(timeout=10)
+    delivery, = backend.get_deliveries(report_id)
+    assert (delivery['status'], delivery['attempts']) == ('sent', 2)
+    assert smtp.logins == 2 and len(smtp.sent) == 1
+
+
+def test_outbox_gives_up_on_refused_recipient(backend, smtp):
+    """收件人被拒絕是永久錯誤：不重試，記錄錯誤訊息，同一批的其他郵件照常寄出"""
+    smtp.failures.append(smtplib.SMTPRecipientsRefused({'coach@example.com':(550, b'no such user')}))
+    report_id, _ = _queue(backend)
+    assert backend.mail_sender.drain(timeout=10)
+    failed, sent = backend.get_deliveries(report_id)
+    assert (failed['status'], failed['attempts']) == ('failed', 1) and failed['last_error']
+    assert sent['status'] == 'sent'
+    assert 'email_outbox_messages{status="failed"} 1' in backend.app.test_client().get('/metrics').get_data(as_text=True)
@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+REPORT = {'patient_id':'M1', 'heart_rate':72, 'bmi':22, 'blood_pressure':'118/76', 'exercise_duration':60, 'weight':70, 'height':178}
+
+
+def _generate(client, data, query=''):
+    response = client.post(f'/generate_report{query}', json=data)
+    return response.status_code, response.get_json()
+
+
+def test_identical_request_reuses_rendered_artifacts(backend, pdf_font):
+    """相同量測的第二份報告命中渲染快取，共用同一份 PDF；no_cache 時重新渲染"""
+    client = backend.app.test_client()
+    status, first = _generate(client, REPORT)
+    assert status == 200 and first['cache_hit'] is False and first['pdf_size_bytes'] > 0
+    status, second = _generate(client, dict(REPORT, coach_email='coach@example.com'))
+    assert status == 200 and second['cache_hit'] is True and second['report_id'] != first['report_id']
+    assert client.get(first['download_url']).data == client.get(second['download_url']).data
+    stats = client.get('/api/cache/stats').get_json()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+    assert _generate(client, dict(REPORT, no_cache=True))[1]['cache_hit'] is False
+    assert _generate(client, dict(REPORT, heart_rate=90))[1]['cache_hit'] is False
+
+
+def test_batch_generates_valid_members_and_reports_errors(backend, pdf_font, monkeypatch):
+    """批次中格式錯誤的會員只影響自己；成功的報告在同一次請求中寫入資料庫"""
+    monkeypatch.setattr(backend, 'REPORT_WORKERS', 1)
+    client = backend.app.test_client()
+    members = [dict(REPORT, patient_id=f'B{i}', heart_rate=60 + i) for i in range(3)] + [{'heart_rate':70}, dict(REPORT, patient_id='B9', bmi='abc')]
+    result = client.post('/generate_reports/batch', json={'members':members}).get_json()
+    assert (result['status'], result['total'], result['succeeded'], result['failed']) == ('partial', 5, 3, 2)
+    assert [r['status'] for r in result['results']] == ['success'] * 3 + ['error'] * 2
+    for item in result['results'][:3]:
+        assert client.get(item['download_url']).status_code == 200
+    assert backend.count_reports('B0') == 1 and backend.count_reports('B9') == 0
+
+    csv_text = 'patient_id,heart_rate,bmi,blood_pressure,exercise_duration\nC1,70,21,120/80,90\n'
+    result = client.post('/generate_reports/batch', data=csv_text, content_type='text/csv').get_json()
+    assert result['status'] == 'success' and result['results'][0]['patient_id'] == 'C1'
+    assert client.post('/generate_reports/batch?sender_password=x', data=csv_text, content_type='text/csv').status_code == 400
+
+
+@pytest.fixture
+def job_queue(backend, monkeypatch):
+    queue = backend.ReportJobQueue(1)
+    monkeypatch.setattr(backend, 'job_queue', queue)
+    yield queue
+    queue.shutdown()
+
+
+def test_async_job_runs_in_worker_without_credentials(backend, pdf_font, smtp, job_queue, monkeypatch):
+    """非同步工作在工作程序中產生報告；寄件帳密不傳給工作程序，郵件由主程序排入寄件匣"""
+    submitted = []
+    executor = job_queue.executor()
+    submit = executor.submit
+    monkeypatch.setattr(executor, 'submit', lambda fn, *args: submitted.append(args) or submit(fn, *args))
+    client = backend.app.test_client()
+    status, queued = _generate(client, dict(REPORT, send_email=True, sender_email='sender@example.com', sender_password='secret',
+                                            patient_email='m1@example.com'), '?async=1')
+    assert status == 202 and queued['status'] == 'queued'
+    assert not {'send_email', 'sender_email', 'sender_password'} & set(submitted[0][1])
+
+    deadline = time.time() + 120
+    while (response := client.get(queued['result_url'])).status_code == 202 and time.time() < deadline:
+        time.sleep(0.2)
+    result = response.get_json()
+    assert response.status_code == 200 and result['status'] == 'success'
+    assert not any(key.startswith('_') for key in result)
+    assert client.get(queued['status_url']).get_json()['state'] == 'succeeded'
+    assert backend.mail_sender.drain(timeout=10)
+    assert [recipient for _, recipient, _ in smtp.sent] == ['m1@example.com']
+    assert client.get(result['deliveries_url']).get_json()['deliveries'][0]['status'] == 'sent'
+    assert client.get('/jobs/unknown').status_code == 404
+
+
+def test_async_job_validates_before_queueing(backend, job_queue):
+    """要寄信卻缺少寄件帳密時在排入佇列前就回 400"""
+    client = backend.app.test_client()
+    status, body = _generate(client, dict(REPORT, send_email=True, sender_email='sender@example.com'), '?async=1')
+    assert status == 400 and body['status'] == 'error'
+    assert job_queue.active_count() == 0
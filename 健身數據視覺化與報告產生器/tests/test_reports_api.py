@@ -0,0 +1,62 @@
+import io
+from datetime import datetime, timedelta
+
+REPORT = {'heart_rate':72, 'bmi':22, 'blood_pressure':'118/76', 'exercise_duration':60, 'weight':70, 'height':178}
+
+
+def _save(backend, *reports):
+    return backend.save_reports_to_db([(r['patient_id'], backend.normalize_report_data(r), None, None, None, None, None) for r in reports])
+
+
+def test_report_page_snapshot_answers_conditional_requests(backend):
+    """報告頁第一次瀏覽時保存快照，之後以相同的強 ETag 回應，If-None-Match 相符時回 304"""
+    report_id, = _save(backend, dict(REPORT, patient_id='M1'))
+    client = backend.app.test_client()
+    first = client.get(f'/view_report/{report_id}')
+    assert first.status_code == 200 and first.headers['ETag']
+    assert backend.get_db().execute('SELECT COUNT(*) FROM report_snapshots WHERE report_id = ?', (report_id,)).fetchone()[0] == 1
+    second = client.get(f'/view_report/{report_id}')
+    assert second.headers['ETag'] == first.headers['ETag'] and second.data == first.data
+    cached = client.get(f'/view_report/{report_id}', headers={'If-None-Match':first.headers['ETag']})
+    assert cached.status_code == 304 and cached.data == b''
+    assert client.get(f'/view_report/{report_id}', headers={'If-None-Match':'"stale"'}).status_code == 200
+    assert client.get('/view_report/999').status_code == 404
+
+
+def test_history_page_revalidates_after_new_report(backend):
+    """新報告寫入後歷史列表的 ETag 改變，舊 ETag 不再得到 304"""
+    _save(backend, dict(REPORT, patient_id='M1'))
+    client = backend.app.test_client()
+    etag = client.get('/reports/M1').headers['ETag']
+    assert client.get('/reports/M1', headers={'If-None-Match':etag}).status_code == 304
+    _save(backend, dict(REPORT, patient_id='M1', heart_rate=80))
+    changed = client.get('/reports/M1', headers={'If-None-Match':etag})
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+
+
+def test_search_filters_sorts_and_pages(backend):
+    """指標門檻、血壓任一達標與游標分頁；不合法的參數回 400"""
+    _save(backend, *[dict(REPORT, patient_id=f'M{i}', bmi=20 + i, blood_pressure=f'{120 + 5 * i}/{78 + i}') for i in range(6)])
+    client = backend.app.test_client()
+    found = client.get('/api/reports/search?bmi_min=22&bmi_max=25&sort=-bmi').get_json()
+    assert [r['bmi'] for r in found['reports']] == [24.0, 23.0, 22.0] and found['next_cursor'] is None
+    assert {r['patient_id'] for r in client.get('/api/reports/search?blood_pressure_min=140/90').get_json()['reports']} == {'M4', 'M5'}
+
+    seen, cursor = [], ''
+    while cursor is not None:
+        page = client.get(f'/api/reports/search?sort=bmi&limit=4&cursor={cursor or ""}').get_json()
+        seen += [r['patient_id'] for r in page['reports']]; cursor = page['next_cursor']
+    assert seen == [f'M{i}' for i in range(6)]
+    assert client.get('/api/reports/search?sort=weight').status_code == 400
+    assert client.get('/api/reports/search?bmi_min=abc').status_code == 400
+
+
+def test_trend_keeps_most_recent_points(backend, monkeypatch):
+    """量測超過 TREND_MAX_POINTS 時保留最新的資料點，依時間遞增排列"""
+    monkeypatch.setattr(backend, 'TREND_MAX_POINTS', 5)
+    start = datetime(2025, 1, 1, 8)
+    rows = ''.join(f'M1,{(start + timedelta(days=d)).isoformat()},{60 + d}\n' for d in range(20))
+    assert backend.import_measurements(io.StringIO('patient_id,timestamp,hr\n' + rows), unknown_members='create')['inserted'] == 20
+    points = backend.app.test_client().get('/api/patients/M1/trend?bucket=raw').get_json()['points']
+    assert [p['heart_rate'] for p in points] == [75.0, 76.0, 77.0, 78.0, 79.0]
+    assert points[-1]['period_start'] == '2025-01-20 08:00:00'